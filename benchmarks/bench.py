@@ -0,0 +1,261 @@
+"""Micro-benchmarks for the parser and the scrape/map pipeline.
+
+Run from the repository root:
+
+    python -m benchmarks.bench -o bench.json
+    python -m benchmarks.bench -o new.json --compare bench.json
+
+Database benchmarks run against a throw-away SQLite file, never mondojazz.db.
+"""
+import argparse
+from datetime import datetime, time, timedelta
+import json
+import logging
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import timeit
+
+from sqlalchemy import delete, insert, select, update
+
+from . import context as ctx
+
+parser = ctx.mondojazz.parser
+scraper = ctx.mondojazz.scraper
+mapper = ctx.mondojazz.mapper
+migrations = ctx.mondojazz.migrations
+models = ctx.mondojazz.models
+Session = ctx.mondojazz.Session
+
+BENCHMARKS = {}
+
+
+def benchmark(name, number=1):
+    """Register a benchmark factory.
+
+    The factory returns (run, setup): run is timed number times per repeat,
+    setup (or None) is called untimed before every repeat.
+    """
+    def deco(f):
+        BENCHMARKS[name] = (f, number)
+        return f
+    return deco
+
+
+def readData(fname):
+    with open(os.path.join(ctx.DATA_DIR, fname), encoding='utf-8') as fp:
+        return fp.read()
+
+
+def resetDb():
+    models.Base.metadata.drop_all(ctx.mondojazz.engine)
+    migrations.metadata.drop_all(ctx.mondojazz.engine)
+    ctx.mondojazz.createSchema()
+
+
+def backends():
+    return [b for b in parser.BACKENDS if b != 'lxml' or parser.etree is not None]
+
+
+def registerParsers():
+    for fname, cls in [
+            ('show.html', parser.ShowPage),
+            ('show_last.html', parser.ShowPage),
+            ('pl1.html', parser.PlaylistPage)]:
+        for backend in backends():
+            def factory(fname=fname, cls=cls, backend=backend):
+                markup = readData(fname)
+                return (lambda: cls(markup, backend).getItems()), None
+            benchmark(f'parse[{fname},{backend}]', number=10)(factory)
+
+
+registerParsers()
+
+
+def registerParsePools():
+    for workers in sorted({1, 2, os.cpu_count() or 1}):
+        def factory(workers=workers):
+            markup = [readData('pl1.html')] * 64
+            pool = scraper.getParsePool(workers)
+            list(pool.map(parser.parsePlaylistMarkup, markup[:workers]))  # spawn workers untimed
+            return (lambda: list(pool.map(parser.parsePlaylistMarkup, markup))), None
+        benchmark(f'parse pool pl1.html x64 [{workers} procs]')(factory)
+
+
+registerParsePools()
+
+
+@benchmark('parseTimeslot x10000')
+def benchTimeslot():
+    strings = [
+        (datetime(2020, 1, 1, 8) + timedelta(hours=7 * i)).strftime('%b %d, %Y %I:%M %p')
+        + '\xa0–\xa010:00 AM'
+        for i in range(10000)]
+    return (lambda: list(map(parser.parseTimeslot, strings))), None
+
+
+@benchmark('parseSpinTime x10000')
+def benchSpinTime():
+    strings = [time(i % 24, i % 60).strftime('%I:%M %p') for i in range(10000)]
+    return (lambda: list(map(parser.parseSpinTime, strings))), None
+
+
+def showItems(n):
+    start = datetime(2015, 1, 1, 8)
+    return [{
+            'spinitron_id': i + 1,
+            'timeslot': start + timedelta(days=i),
+            'title': f'Show {i}',
+            'desc': 'Synthetic show',
+        } for i in range(n)]
+
+
+def playlistSpins(pl_no, spins):
+    return [dict(spin,
+                 spinitron_id=pl_no * 1000 + i,
+                 start_time=time(8, i % 60))
+            for i, spin in enumerate(spins)]
+
+
+@benchmark('scraper.storeShowItems x1000')
+def benchStoreShowItems():
+    items = showItems(1000)
+
+    def run():
+        with Session() as session, session.begin():
+            scraper.storeShowItems(items, session)
+    return run, resetDb
+
+
+@benchmark('scraper.storePlaylistSpins x50')
+def benchStorePlaylistSpins():
+    spins = json.loads(readData('pl1.json'))
+    items = showItems(50)
+
+    def setup():
+        resetDb()
+        with Session() as session, session.begin():
+            session.execute(insert(models.SpinitronPlaylist), items)
+
+    def run():
+        with Session() as session, session.begin():
+            for stpl in session.scalars(select(models.SpinitronPlaylist)):
+                spl = playlistSpins(stpl.spinitron_id, spins)
+                scraper.storePlaylistSpins(stpl, spl, session)
+    return run, setup
+
+
+def buildArchive(n_playlists, n_spins=20, rebroadcast=2):
+    """Fill the database with n_playlists playlists of n_spins mapped spins,
+    every rebroadcast consecutive playlists sharing the same song list."""
+    resetDb()
+    n_eps = n_playlists // rebroadcast
+    with Session() as session, session.begin():
+        session.execute(insert(models.Song), [{
+                'id': i + 1,
+                'title': f'Song {i}',
+                'artist': f'Artist {i % 500}',
+                'album': f'Album {i % 2000}',
+                'year': 1950 + i % 70,
+                'spotify_id': f'sp{i}',
+            } for i in range(n_eps * n_spins)])
+        session.execute(insert(models.SpinitronPlaylist), showItems(n_playlists))
+        session.execute(insert(models.Spin), [{
+                'spinitron_id': pl * n_spins + i,
+                'title': f'Song {ep * n_spins + i}',
+                'artist': 'Artist',
+                'album': 'Album',
+                'year': 2000,
+                'start_time': time(8, i % 60),
+                'number': i,
+                'playlist_id': pl + 1,
+                'song_id': ep * n_spins + i + 1,
+            }
+            for pl in range(n_playlists)
+            for ep in [pl // rebroadcast]
+            for i in range(n_spins)])
+
+
+@benchmark('mapper.initEpisodes 4000 playlists')
+def benchInitEpisodes():
+    n = 4000
+    buildArchive(n)
+
+    def setup():
+        with Session() as session, session.begin():
+            session.execute(update(models.SpinitronPlaylist).values(episode_id=None))
+            session.execute(delete(models.Episode))
+
+    return (lambda: mapper.initEpisodes(n)), setup
+
+
+def runBenchmark(factory, number, repeat):
+    run, setup = factory()
+    times = []
+    for _ in range(repeat):
+        if setup:
+            setup()
+        times.append(timeit.timeit(run, number=number) / number)
+    return {
+        'number': number,
+        'repeat': repeat,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times),
+    }
+
+
+def gitRevision():
+    try:
+        return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'],
+                cwd=ctx.ROOT_DIR, capture_output=True, text=True, check=True
+            ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline):
+    print(f'\n{"benchmark":45} {"old":>10} {"new":>10} {"ratio":>7}')
+    for name, res in results.items():
+        old = baseline['results'].get(name)
+        if old is None:
+            continue
+        ratio = res['min'] / old['min']
+        print(f'{name:45} {old["min"] * 1000:9.2f}ms {res["min"] * 1000:9.2f}ms {ratio:6.2f}x')
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('-o', '--output', help='write results as JSON to this file')
+    ap.add_argument('-r', '--repeat', type=int, default=5)
+    ap.add_argument('-k', '--filter', default='', help='only run benchmarks containing this string')
+    ap.add_argument('--compare', help='JSON results of a previous run to compare against')
+    args = ap.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    results = {}
+    for name, (factory, number) in BENCHMARKS.items():
+        if args.filter not in name:
+            continue
+        results[name] = res = runBenchmark(factory, number, args.repeat)
+        print(f'{name:45} min {res["min"] * 1000:9.3f}ms  median {res["median"] * 1000:9.3f}ms')
+
+    report = {
+        'revision': gitRevision(),
+        'python': platform.python_version(),
+        'date': datetime.now().isoformat(timespec='seconds'),
+        'results': results,
+    }
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump(report, fp, indent=2)
+    if args.compare:
+        with open(args.compare) as fp:
+            compare(results, json.load(fp))
+
+
+if __name__ == '__main__':
+    sys.exit(main())
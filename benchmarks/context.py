@@ -0,0 +1,22 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+
+ROOT_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+DATA_DIR = os.path.abspath(os.path.join(ROOT_DIR, 'data'))
+TMP_DIR = tempfile.mkdtemp(prefix='mondojazz-bench-')
+atexit.register(shutil.rmtree, TMP_DIR, ignore_errors=True)
+
+sys.path.insert(0, ROOT_DIR)
+
+os.environ['ENGINE_URL'] = f'sqlite:///{TMP_DIR}/bench.db'
+os.environ['SPOTIFY_CACHE'] = f'{TMP_DIR}/spotify_cache.db'
+
+import mondojazz
+import mondojazz.parser
+import mondojazz.models
+import mondojazz.migrations
+import mondojazz.scraper
+import mondojazz.mapper
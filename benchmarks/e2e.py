@@ -0,0 +1,138 @@
+"""End-to-end scrape and map benchmark against the local fake servers.
+
+Serves a synthetic archive from benchmarks.fakes and drives it through
+scraping and Spotify mapping into a throw-away database, either step by step
+(scrape show pages, scrape spins, map, cluster) or with the streaming pipeline:
+
+    python -m benchmarks.e2e --episodes 1000 --mode steps --workers 8
+    python -m benchmarks.e2e --mode pipeline --latency 0.02 --rate-limit-every 200
+"""
+import argparse
+from datetime import datetime
+import json
+import logging
+import os
+import platform
+import sys
+import time
+
+from sqlalchemy import func, select
+
+from . import context as ctx
+from .bench import gitRevision, resetDb
+from .fakes import Archive, FakeSpinitron, FakeSpotify
+
+mondojazz = ctx.mondojazz
+scraper = ctx.mondojazz.scraper
+mapper = ctx.mondojazz.mapper
+models = ctx.mondojazz.models
+metrics = ctx.mondojazz.metrics
+Session = ctx.mondojazz.Session
+
+
+def runSteps(args):
+    scraper.scrapeShowPages()
+    scraper.scrapeAllSpins(args.workers, args.parse_workers, args.chunk_size)
+    mapper.mapSpinsBatch(args.workers, args.chunk_size and args.chunk_size * args.spins)
+    return {'episodes': len(mapper.updateEpisodes())}
+
+
+def runPipeline(args):
+    from mondojazz.pipeline import Pipeline
+    return dict(Pipeline(fetch_workers=args.workers, match_workers=args.workers,
+                         parse_workers=args.parse_workers).run())
+
+
+MODES = {'steps': runSteps, 'pipeline': runPipeline}
+
+
+def counts():
+    with Session() as session:
+        return {
+            model.__name__: session.scalar(select(func.count()).select_from(model))
+            for model in [models.SpinitronPlaylist, models.Spin, models.Song, models.Episode]}
+
+
+def run(args):
+    archive = Archive(args.episodes, args.rebroadcast, args.spins)
+    spinitron = FakeSpinitron(archive, latency=args.latency).start()
+    spotify = FakeSpotify(args.rate_limit_every, args.retry_after, args.token_lifetime,
+                          latency=args.spotify_latency).start()
+    try:
+        os.environ.update(spotify.env())
+        os.environ['SPOTIFY_RATE'] = str(args.spotify_rate)
+        mondojazz._spotify = None
+        scraper.setBaseUrl(spinitron.url)
+        resetDb()
+        mapper.search.clear()
+        metrics.reset()
+
+        start = time.perf_counter()
+        stats = MODES[args.mode](args)
+        elapsed = time.perf_counter() - start
+    finally:
+        spinitron.stop()
+        spotify.stop()
+
+    rows = counts()
+    return {
+        'mode': args.mode,
+        'workers': args.workers,
+        'parse_workers': args.parse_workers,
+        'playlists': len(archive),
+        'elapsed': elapsed,
+        'playlists_per_s': rows['SpinitronPlaylist'] / elapsed,
+        'spins_per_s': rows['Spin'] / elapsed,
+        'rows': rows,
+        'stats': stats,
+        'requests': {
+            'spinitron': sum(spinitron.requests.values()),
+            'spotify': sum(spotify.requests.values()),
+        },
+        'search_cache': mapper.search.stats(),
+    }
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument('--mode', choices=MODES, default='steps')
+    ap.add_argument('--episodes', type=int, default=1000)
+    ap.add_argument('--rebroadcast', type=int, default=2)
+    ap.add_argument('--spins', type=int, default=20)
+    ap.add_argument('--workers', type=int, default=8)
+    ap.add_argument('--parse-workers', type=int, default=0, help='parse pages in this many processes')
+    ap.add_argument('--chunk-size', type=int, default=None,
+                    help='steps mode: commit every this many playlists (and their spins when mapping)')
+    ap.add_argument('--latency', type=float, default=0.0, help='seconds added to every Spinitron response')
+    ap.add_argument('--spotify-latency', type=float, default=0.0, help='seconds added to every Spotify response')
+    ap.add_argument('--spotify-rate', type=float, default=1000, help='client side Spotify requests per second')
+    ap.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth Spotify request with 429')
+    ap.add_argument('--retry-after', type=float, default=1)
+    ap.add_argument('--token-lifetime', type=float, default=None, help='seconds until a Spotify token expires')
+    ap.add_argument('--metrics', action='store_true', help='include the run metrics in the output')
+    ap.add_argument('-o', '--output', help='write results as JSON to this file')
+    args = ap.parse_args(argv)
+
+    logging.disable(logging.WARNING)
+    metrics.enable(args.metrics)
+    result = run(args)
+    print(f'{result["mode"]}: {result["playlists"]} playlists in {result["elapsed"]:.2f}s, '
+          f'{result["playlists_per_s"]:.1f} playlists/s, {result["spins_per_s"]:.0f} spins/s')
+    print(f'rows: {result["rows"]}')
+    print(f'requests: {result["requests"]}, search cache: {result["search_cache"]}')
+
+    if args.metrics:
+        result['metrics'] = metrics.report()
+    if args.output:
+        with open(args.output, 'w') as fp:
+            json.dump({
+                'revision': gitRevision(),
+                'python': platform.python_version(),
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'args': vars(args),
+                'result': result,
+            }, fp, indent=2, default=str)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
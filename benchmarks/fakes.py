@@ -0,0 +1,467 @@
+"""Local stand-ins for Spinitron and the Spotify Web API.
+
+FakeSpinitron serves a synthetic Mondo Jazz archive built from the data/
+fixtures, FakeSpotify covers the endpoints SpotifyClient uses: token refresh,
+/me, search and playlists. Both can add latency to every response, FakeSpotify
+can also answer every Nth request with a 429 and expire its access tokens.
+
+Point mondojazz at them with SPINITRON_URL, SPOTIFY_API_URL and
+SPOTIFY_ACCOUNTS_URL, or run them standalone:
+
+    python -m benchmarks.fakes --episodes 1000
+"""
+from base64 import b64encode
+from collections import Counter
+from datetime import datetime, timedelta
+from hashlib import sha1
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import argparse
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.parse
+
+DATA_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'data'))
+
+CLIENT_ID = 'fake-client'
+CLIENT_SECRET = 'fake-secret'
+REFRESH_TOKEN = 'fake-refresh-token'
+
+
+def readData(fname):
+    with open(os.path.join(DATA_DIR, fname), encoding='utf-8') as fp:
+        return fp.read()
+
+
+class FakeServer:
+    """HTTP server on a free local port answering from a daemon thread.
+
+    Subclasses implement respond(method, path, query, headers, body) returning
+    (status, headers, body), body being bytes, str or a JSON-serializable object.
+    """
+
+    def __init__(self, latency=0.0, host='127.0.0.1', port=0):
+        self.latency = latency
+        self.requests = Counter()
+        self.lock = threading.Lock()
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def handle_one(self):
+                url = urllib.parse.urlsplit(self.path)
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                if fake.latency:
+                    time.sleep(fake.latency)
+                with fake.lock:
+                    fake.requests[self.command] += 1
+                status, headers, body = fake.respond(
+                    self.command, url.path, urllib.parse.parse_qs(url.query), self.headers, body)
+                if isinstance(body, str):
+                    body = body.encode()
+                elif not isinstance(body, bytes):
+                    body = json.dumps(body).encode()
+                    headers.setdefault('Content-Type', 'application/json')
+                self.send_response(status)
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            do_GET = do_POST = do_PUT = do_DELETE = handle_one
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def respond(self, method, path, query, headers, body):
+        raise NotImplementedError
+
+
+class Archive:
+    """Synthetic show: episodes aired rebroadcast times each, newest first.
+
+    Every episode opens with the theme spin of pl1.html followed by spins
+    songs drawn from a pool of pool_size songs, so songs repeat across
+    episodes roughly as often as on the real show.
+    """
+
+    FIRST_ID = 20_000_000
+    START = datetime(2005, 1, 6, 8)
+
+    def __init__(self, episodes=1000, rebroadcast=2, spins=20, pool_size=5000, seed=0):
+        self.episodes = episodes
+        self.rebroadcast = rebroadcast
+        self.spins = spins
+        self.pool_size = pool_size
+        self.seed = seed
+
+    def __len__(self):
+        return self.episodes * self.rebroadcast
+
+    def playlist(self, k):
+        """Show item of the k-th playlist, the oldest being 0."""
+        ep = k // self.rebroadcast
+        return {
+            'spinitron_id': self.FIRST_ID + k,
+            'timeslot': self.START + timedelta(days=7 * ep + 3 * (k % self.rebroadcast)),
+            'title': f'Episode {ep}',
+            'desc': f'Synthetic episode {ep}',
+        }
+
+    def index(self, spinitron_id):
+        k = spinitron_id - self.FIRST_ID
+        if not 0 <= k < len(self):
+            raise KeyError(spinitron_id)
+        return k
+
+    def songs(self, k):
+        rnd = random.Random(self.seed * 1_000_003 + k // self.rebroadcast)
+        return [rnd.randrange(self.pool_size) for _ in range(self.spins)]
+
+    @staticmethod
+    def song(n):
+        return {
+            'title': f'Song {n}',
+            'artist': f'Artist {n % 800}',
+            'album': f'Album {n % 2000}',
+            'year': 1950 + n % 70,
+        }
+
+
+def formatTime(dt):
+    return dt.strftime('%I:%M %p').lstrip('0')
+
+
+class FakeSpinitron(FakeServer):
+    """Spinitron show and playlist pages of an Archive, rendered from the fixtures.
+
+    Pages carry an ETag and honor If-None-Match, so cached scrapes can be
+    measured too.
+    """
+
+    def __init__(self, archive=None, per_page=20, **kw):
+        super().__init__(**kw)
+        self.archive = archive or Archive()
+        self.per_page = per_page
+        self.loadTemplates()
+
+    def loadTemplates(self):
+        show = readData('show.html')
+        start = show.index('<div class="list-item"')
+        end = show.index('<div class="infpager infpager_next"')
+        self.show_head, self.show_tail = show[:start], show[end:]
+        self.show_item = show[start:show.index('<div class="list-item"', start + 1)]
+
+        pl = readData('pl1.html')
+        rows = re.findall(r'<tr id="sp-\d+" class="spin-item".*?</tr>', pl, re.S)
+        self.pl_head = pl[:pl.index(rows[0])]
+        self.pl_tail = pl[pl.index(rows[-1]) + len(rows[-1]):]
+        self.theme_row, self.spin_rows = rows[0], rows[1:]
+
+    def renderShowItem(self, pl):
+        start = pl['timeslot']
+        timeslot = (f'{start:%b} {start.day}, {start.year} {formatTime(start)}'
+                    f'&nbsp;–&nbsp;{formatTime(start + timedelta(hours=2))}')
+        item = re.sub(r'data-key="\d+"', f'data-key="{pl["spinitron_id"]}"', self.show_item)
+        item = re.sub(r'/pl/\d+/', f'/pl/{pl["spinitron_id"]}/', item)
+        item = re.sub(r'<p class="timeslot">.*?</p>', f'<p class="timeslot">{timeslot}</p>', item)
+        item = re.sub(r'<h4 class="episode-name">.*?</h4>',
+                      f'<h4 class="episode-name">{pl["title"]}</h4>', item)
+        return re.sub(r'<div class="episode-description ">.*?</div>',
+                      f'<div class="episode-description ">{pl["desc"]}</div>', item)
+
+    def showPage(self, page):
+        n = len(self.archive)
+        newest = n - 1 - (page - 1) * self.per_page
+        ks = range(newest, max(newest - self.per_page, -1), -1)
+        items = ''.join(self.renderShowItem(self.archive.playlist(k)) for k in ks)
+        tail = re.sub(r'data-current-page="\d+" data-has-more="\d"',
+                      f'data-current-page="{page - 1}" '
+                      f'data-has-more="{int(newest - self.per_page >= 0)}"',
+                      self.show_tail)
+        return self.show_head + items + tail
+
+    def renderSpin(self, row, spin_id, start, song=None):
+        row = re.sub(r'(id="sp-|data-key="|\?sp=)\d+', lambda m: f'{m.group(1)}{spin_id}', row)
+        row = re.sub(r'(<td class="spin-time"><a [^>]*>)[^<]*', lambda m: m.group(1) + formatTime(start), row)
+        if song is None:
+            return row
+        for cls, field in [('artist', 'artist'), ('song', 'title'),
+                           ('release', 'album'), ('released', 'year')]:
+            row = re.sub(rf'(<span class="{cls}">)[^<]*', lambda m: f'{m.group(1)}{song[field]}', row)
+        return row
+
+    def playlistPage(self, spinitron_id):
+        k = self.archive.index(spinitron_id)
+        start = self.archive.playlist(k)['timeslot']
+        rows = [self.renderSpin(self.theme_row, spinitron_id * 100, start)]
+        for i, n in enumerate(self.archive.songs(k), 1):
+            rows.append(self.renderSpin(
+                self.spin_rows[i % len(self.spin_rows)],
+                spinitron_id * 100 + i,
+                start + timedelta(minutes=5 * i),
+                self.archive.song(n)))
+        return self.pl_head + ''.join(rows) + self.pl_tail
+
+    def respond(self, method, path, query, headers, body):
+        try:
+            if path.endswith('/show/103797/Mondo-Jazz'):
+                page = self.showPage(int(query.get('page', ['1'])[0]))
+            else:
+                m = re.match(r'/RFB/pl/(\d+)/', path)
+                page = self.playlistPage(int(m.group(1)))
+        except (AttributeError, KeyError, ValueError):
+            return 404, {}, 'Not found'
+        etag = '"' + sha1(page.encode()).hexdigest() + '"'
+        if headers.get('If-None-Match') == etag:
+            return 304, {'ETag': etag}, b''
+        return 200, {'Content-Type': 'text/html; charset=utf-8', 'ETag': etag}, page
+
+
+class FakeSpotify(FakeServer):
+    """Spotify Web API and accounts service on one host.
+
+    Searches answer with the track the query's filters describe plus a few
+    worse candidates. Every rate_limit_every-th request gets a 429 with
+    Retry-After: retry_after, access tokens stop working token_lifetime
+    seconds after they were issued. Tracks found by a search can be looked
+    up by id until they are pulled with kill().
+    """
+
+    USER_ID = 'fake-user'
+
+    def __init__(self, rate_limit_every=0, retry_after=1, token_lifetime=None,
+                 results=5, **kw):
+        super().__init__(**kw)
+        self.rate_limit_every = rate_limit_every
+        self.retry_after = retry_after
+        self.token_lifetime = token_lifetime
+        self.results = results
+        self.count = 0
+        self.tokens = {}
+        self.playlists = {}
+        self.known = {}
+        self.dead = set()
+        self.basic_auth = 'Basic ' + b64encode(f'{CLIENT_ID}:{CLIENT_SECRET}'.encode()).decode()
+        self.issueToken('fake-token')
+
+    def env(self):
+        """Environment pointing a SpotifyClient at this server."""
+        return {
+            'SPOTIFY_API_URL': self.url + '/v1',
+            'SPOTIFY_ACCOUNTS_URL': self.url,
+            'SPOTIFY_CLIENT_ID': CLIENT_ID,
+            'SPOTIFY_CLIENT_SECRET': CLIENT_SECRET,
+            'SPOTIFY_ACCESS_TOKEN': 'fake-token',
+            'SPOTIFY_REFRESH_TOKEN': REFRESH_TOKEN,
+        }
+
+    def issueToken(self, token=None):
+        token = token or f'fake-token-{len(self.tokens)}'
+        self.tokens[token] = time.monotonic()
+        return token
+
+    def kill(self, track_ids):
+        """Pull tracks: lookups answer null and searches leave them out."""
+        with self.lock:
+            self.dead.update(track_ids)
+
+    def expireTokens(self):
+        with self.lock:
+            self.tokens.clear()
+
+    def authorized(self, headers):
+        auth = headers.get('Authorization', '')
+        with self.lock:
+            issued = self.tokens.get(auth[len('Bearer '):]) if auth.startswith('Bearer ') else None
+        if issued is None:
+            return False
+        return self.token_lifetime is None or time.monotonic() - issued < self.token_lifetime
+
+    def respond(self, method, path, query, headers, body):
+        if path == '/api/token':
+            return self.refresh(headers, urllib.parse.parse_qs(body.decode()))
+        with self.lock:
+            self.count += 1
+            limited = self.rate_limit_every and self.count % self.rate_limit_every == 0
+        if limited:
+            return 429, {'Retry-After': str(self.retry_after)}, {'error': {'status': 429}}
+        if not self.authorized(headers):
+            return 401, {}, {'error': {'status': 401, 'message': 'The access token expired'}}
+        data = json.loads(body) if body else {}
+
+        parts = path.strip('/').split('/')[1:]
+        if parts == ['me']:
+            return 200, {}, {'id': self.USER_ID}
+        if parts == ['search']:
+            return 200, {}, self.search(query.get('q', [''])[0])
+        if parts == ['tracks'] and method == 'GET':
+            return self.tracks(query.get('ids', [''])[0].split(','), 'market' in query)
+        if parts[:1] == ['users'] and parts[2:] == ['playlists'] and method == 'POST':
+            return 201, {}, self.createPlaylist(data)
+        if parts[:1] == ['playlists'] and parts[1] in self.playlists:
+            pl = self.playlists[parts[1]]
+            if parts[2:] == [] and method == 'GET':
+                return 200, {}, self.describePlaylist(pl)
+            if parts[2:] == ['tracks']:
+                return self.playlistTracks(pl, method, query, data)
+        return 404, {}, {'error': {'status': 404, 'message': 'Not found'}}
+
+    def refresh(self, headers, form):
+        if (headers.get('Authorization') != self.basic_auth
+                or form.get('refresh_token') != [REFRESH_TOKEN]):
+            return 400, {}, {'error': 'invalid_grant'}
+        with self.lock:
+            token = self.issueToken()
+        return 200, {}, {'access_token': token, 'token_type': 'Bearer', 'expires_in': 3600}
+
+    @staticmethod
+    def track(name, artist, album, year):
+        track_id = sha1(f'{name}|{artist}|{album}'.encode()).hexdigest()[:22]
+        return {
+            'id': track_id,
+            'uri': f'spotify:track:{track_id}',
+            'name': name,
+            'album': {'name': album, 'release_date': f'{year}-01-01'},
+            'artists': [{'name': a} for a in artist.split(', ')],
+        }
+
+    def search(self, q):
+        filters = dict(re.findall(r'(\w+):(.*?)(?=\s\w+:|$)', q))
+        text = re.split(r'\s\w+:', q, maxsplit=1)[0].strip()
+        artist = filters.get('artist', 'Various Artists')
+        album = filters.get('album', text)
+        year = filters.get('year', '2000')
+        items = [self.track(text, artist, album, year)]
+        for i in range(1, self.results):
+            items.append(self.track(f'{text} (Take {i})' if i % 2 else text,
+                                    f'Artist {i} Tribute Band', f'Best of {i}', 1990 + i))
+        with self.lock:
+            items = [t for t in items if t['id'] not in self.dead]
+            self.known.update((t['id'], t) for t in items)
+        return {'tracks': {'items': items, 'total': len(items)}}
+
+    def tracks(self, ids, market):
+        if len(ids) > 50:
+            return 400, {}, {'error': {'status': 400, 'message': 'Too many ids requested'}}
+        with self.lock:
+            tracks = [None if i in self.dead else self.known.get(i) for i in ids]
+        if market:
+            tracks = [t and dict(t, is_playable=True) for t in tracks]
+        return 200, {}, {'tracks': tracks}
+
+    def createPlaylist(self, data):
+        with self.lock:
+            pl_id = f'fakepl{len(self.playlists)}'
+            pl = self.playlists[pl_id] = {
+                'id': pl_id,
+                'name': data.get('name'),
+                'description': data.get('description'),
+                'uris': [],
+                'version': 0,
+            }
+        return self.describePlaylist(pl)
+
+    @staticmethod
+    def snapshot(pl):
+        return f'{pl["id"]}-{pl["version"]}'
+
+    def describePlaylist(self, pl):
+        return {
+            'id': pl['id'],
+            'name': pl['name'],
+            'description': pl['description'],
+            'snapshot_id': self.snapshot(pl),
+            'tracks': {'total': len(pl['uris'])},
+        }
+
+    def playlistTracks(self, pl, method, query, data):
+        if method == 'GET':
+            offset = int(query.get('offset', ['0'])[0])
+            limit = int(query.get('limit', ['100'])[0])
+            uris = pl['uris'][offset:offset + limit]
+            return 200, {}, {
+                'items': [{'track': {'id': u.rsplit(':', 1)[1], 'uri': u}} for u in uris],
+                'total': len(pl['uris']),
+                'offset': offset,
+                'limit': limit,
+            }
+        if method == 'DELETE':
+            gone = {t['uri'] for t in data.get('tracks', [])}
+            pl['uris'] = [u for u in pl['uris'] if u not in gone]
+        elif method == 'PUT' and 'range_start' in data:
+            start, length = data['range_start'], data.get('range_length', 1)
+            before = data['insert_before']
+            moved = pl['uris'][start:start + length]
+            del pl['uris'][start:start + length]
+            if before > start:
+                before -= length
+            pl['uris'][before:before] = moved
+        elif method == 'PUT':
+            pl['uris'] = list(data.get('uris', []))
+        else:
+            uris = data.get('uris', [])
+            pos = data.get('position', len(pl['uris']))
+            pl['uris'][pos:pos] = uris
+        pl['version'] += 1
+        return 200 if method != 'POST' else 201, {}, {'snapshot_id': self.snapshot(pl)}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description='Serve a fake Spinitron and Spotify API locally')
+    ap.add_argument('--episodes', type=int, default=1000)
+    ap.add_argument('--rebroadcast', type=int, default=2)
+    ap.add_argument('--spins', type=int, default=20)
+    ap.add_argument('--spinitron-port', type=int, default=8001)
+    ap.add_argument('--spotify-port', type=int, default=8002)
+    ap.add_argument('--latency', type=float, default=0.0, help='seconds added to every response')
+    ap.add_argument('--rate-limit-every', type=int, default=0, help='answer every Nth Spotify request with 429')
+    ap.add_argument('--retry-after', type=float, default=1)
+    ap.add_argument('--token-lifetime', type=float, default=None)
+    args = ap.parse_args(argv)
+
+    archive = Archive(args.episodes, args.rebroadcast, args.spins)
+    spinitron = FakeSpinitron(archive, latency=args.latency, port=args.spinitron_port).start()
+    spotify = FakeSpotify(args.rate_limit_every, args.retry_after, args.token_lifetime,
+                          latency=args.latency, port=args.spotify_port).start()
+    print(f'SPINITRON_URL={spinitron.url}')
+    for k, v in spotify.env().items():
+        print(f'{k}={v}')
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
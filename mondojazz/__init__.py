@@ -1,19 +1,122 @@
 __all__ = [
     'Session',
+    'init',
+    'createSchema',
+    'getEngine',
+    'getSpotify',
+    'spotifyClient',
 ]
 
 import logging
 import os
+import threading
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
 
-from mondojazz.spotify import SpotifyClient
+from mondojazz import metrics
 
+logger = logging.getLogger(__name__)
 
-engine_url = os.getenv('ENGINE_URL', 'sqlite:///mondojazz.db')
-logging.getLogger(__name__).info(f'Using engine url: "{engine_url}"')
+# SQLite is written by one Writer thread (see mondojazz.writer) while any
+# number of threads read: WAL lets readers run alongside the writer, NORMAL
+# sync only fsyncs at checkpoints, which WAL keeps consistent, and the busy
+# timeout makes an occasional second writer wait instead of failing.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', 30000)),
+}
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 10))
 
-engine = create_engine(engine_url)
-Session = sessionmaker(engine)
-spotify = SpotifyClient()
+_lock = threading.RLock()
+_engine = None
+_spotify = None
+
+
+class LazySessionmaker(sessionmaker):
+    """sessionmaker that creates the engine on the first session."""
+
+    def __call__(self, **kw):
+        getEngine()
+        return super().__call__(**kw)
+
+
+Session = LazySessionmaker()
+metrics.instrumentSessions(Session)
+
+
+def init(engine_url=None, create=False):
+    """Create the engine and bind Session to it.
+
+    Called implicitly on first use with ENGINE_URL, call it explicitly to pick
+    another database. With create the schema is brought up to date too.
+    """
+    global _engine
+    engine_url = engine_url or os.getenv('ENGINE_URL', 'sqlite:///mondojazz.db')
+    with _lock:
+        logger.info(f'Using engine url: "{engine_url}"')
+        _engine = createEngine(engine_url)
+        Session.configure(bind=_engine)
+    if create:
+        createSchema()
+    return _engine
+
+
+def createEngine(engine_url):
+    """Engine for engine_url, file based SQLite databases get SQLITE_PRAGMAS
+    on every connection and a pool with room for a reader per worker thread."""
+    url = make_url(engine_url)
+    if url.get_backend_name() != 'sqlite' or url.database in (None, '', ':memory:'):
+        return create_engine(url)
+    engine = create_engine(url, pool_size=POOL_SIZE, max_overflow=POOL_SIZE)
+
+    @event.listens_for(engine, 'connect')
+    def setPragmas(dbapi_conn, record):
+        cursor = dbapi_conn.cursor()
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+    return engine
+
+
+def getEngine():
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                init()
+    return _engine
+
+
+def createSchema():
+    """Create the schema or apply the migrations it is missing."""
+    from mondojazz.migrations import upgrade
+    return upgrade(getEngine())
+
+
+def getSpotify():
+    global _spotify
+    with _lock:
+        if _spotify is None:
+            from mondojazz.spotify import SpotifyClient
+            _spotify = SpotifyClient()
+    return _spotify
+
+
+class LazySpotify:
+    """Stand-in for the SpotifyClient, authorizing only when first used."""
+
+    def __getattr__(self, name):
+        return getattr(getSpotify(), name)
+
+
+# mondojazz.spotify is the client's module, the shared client is spotifyClient
+spotifyClient = LazySpotify()
+
+
+def __getattr__(name):
+    if name == 'engine':
+        return getEngine()
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
@@ -0,0 +1,196 @@
+import argparse
+import logging
+import os
+import sys
+
+import mondojazz
+from mondojazz import metrics
+
+
+def cmdInit(args):
+    version = mondojazz.createSchema()
+    logging.info(f'Schema is at version {version}')
+
+
+def cmdScrape(args):
+    from mondojazz import scraper
+    if args.pages:
+        scraper.scrapeShowPages(args.first_page, args.last_page, args.read_ahead)
+    else:
+        count = scraper.scrapeLatest(args.read_ahead, args.find_boundary)
+        logging.info(f'Scraped {count} new playlists')
+    if args.all_spins:
+        scraper.scrapeAllSpins(args.workers, args.parse_workers, args.chunk_size, args.resume)
+
+
+def cmdReparse(args):
+    from mondojazz import scraper
+    stats = scraper.reparseArchive(args.parse_workers)
+    logging.info(f'Reparsed {stats["pages"]} playlist pages: {dict(stats)}')
+
+
+def cmdMap(args):
+    from mondojazz import mapper
+    if args.batch:
+        mapper.mapSpinsBatch(args.workers, args.chunk_size, args.resume)
+    else:
+        mapper.mapSpins(args.chunk_size, args.resume)
+
+
+def cmdRevalidate(args):
+    from datetime import timedelta
+    from mondojazz import mapper
+    max_age = timedelta(days=args.max_age) if args.max_age is not None else None
+    mapper.revalidateSongs(max_age, args.workers, not args.no_rematch)
+
+
+def cmdSearch(args):
+    from mondojazz import textsearch
+    query = ' '.join(args.query)
+    if args.songs:
+        for r in textsearch.searchSongs(query, args.field, args.limit):
+            print(f'{r["spins"]:4d} spins  {r["artist"]} - {r["title"]} ({r["album"]}, {r["year"]})'
+                  f'  {r["spotify_id"] or "unmatched"}')
+        return
+    for r in textsearch.searchSpins(query, args.field, args.limit):
+        aired = r['timeslot'].strftime('%Y-%m-%d') if r['timeslot'] else '?'
+        episode = f'episode {r["episode"]}' if r['episode'] else 'no episode'
+        print(f'{aired}  {episode:12}  {r["artist"]} - {r["title"]} ({r["album"]}, {r["year"]})')
+
+
+def cmdEpisodes(args):
+    from mondojazz import mapper
+    mapper.updateEpisodes()
+
+
+def cmdPublish(args):
+    from mondojazz import mapper
+    publish = mapper.syncEpisodes if args.sync else mapper.publishEpisodes
+    results = publish(args.episodes or None, args.first, args.last, args.workers)
+    failed = [r['episode'] for r in results if r['error']]
+    if failed:
+        logging.error(f'Failed to {"sync" if args.sync else "publish"} episodes {failed}')
+        return 1
+
+
+def cmdRun(args):
+    from mondojazz.pipeline import Pipeline
+    Pipeline(
+        fetch_workers=args.fetch_workers,
+        parse_workers=args.parse_workers,
+        match_workers=args.match_workers,
+        publish_workers=args.publish_workers,
+        queue_size=args.queue_size,
+        publish=args.publish,
+    ).run()
+
+
+def makeParser():
+    ap = argparse.ArgumentParser(prog='python -m mondojazz',
+                                 description='Mondo Jazz Spinitron to Spotify importer')
+    ap.add_argument('--db', help='database url, defaults to $ENGINE_URL or sqlite:///mondojazz.db')
+    ap.add_argument('--cache-dir', help='cache Spinitron pages in this directory')
+    ap.add_argument('--spinitron-url', help='Spinitron base url, defaults to $SPINITRON_URL or https://spinitron.com')
+    ap.add_argument('--archive', help='append every fetched Spinitron page to the archive in this directory')
+    ap.add_argument('--offline', action='store_true', help='serve Spinitron pages from the cache only')
+    ap.add_argument('--metrics-json', metavar='PATH', help='write run metrics as JSON to PATH')
+    ap.add_argument('--metrics-prom', metavar='PATH',
+                    help='write run metrics to PATH in the Prometheus textfile format')
+    ap.add_argument('-v', '--verbose', action='count', default=0)
+    sub = ap.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('init', help='create the database schema or upgrade it')
+    p.set_defaults(func=cmdInit)
+
+    p = sub.add_parser('scrape', help='scrape new playlists from Spinitron')
+    p.add_argument('--pages', action='store_true', help='scrape a range of show pages instead of the latest')
+    p.add_argument('--first-page', type=int, default=1)
+    p.add_argument('--last-page', type=int, default=0)
+    p.add_argument('--read-ahead', type=int, default=None, metavar='K',
+                   help='fetch the next K show pages while processing the current one')
+    p.add_argument('--find-boundary', action='store_true',
+                   help='bisect the last show page holding new playlists before scraping them')
+    p.add_argument('--all-spins', action='store_true', help='also (re)scrape spins of every playlist')
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--parse-workers', type=int, default=None,
+                   help='parse playlist pages in this many processes')
+    p.add_argument('--chunk-size', type=int, default=None,
+                   help='with --all-spins, commit every this many playlists')
+    p.add_argument('--resume', action='store_true', help='resume an interrupted chunked run')
+    p.set_defaults(func=cmdScrape)
+
+    p = sub.add_parser('reparse', help='re-extract playlists and spins from the page archive')
+    p.add_argument('--parse-workers', type=int, default=None,
+                   help='parse pages in this many processes')
+    p.set_defaults(func=cmdReparse)
+
+    p = sub.add_parser('map', help='map unmapped spins to Spotify tracks')
+    p.add_argument('--batch', action='store_true')
+    p.add_argument('--workers', type=int, default=None)
+    p.add_argument('--chunk-size', type=int, default=None, help='commit every this many spins')
+    p.add_argument('--resume', action='store_true', help='resume an interrupted chunked run')
+    p.set_defaults(func=cmdMap)
+
+    p = sub.add_parser('revalidate', help='recheck the Spotify tracks of stored songs')
+    p.add_argument('--max-age', type=float, default=None, metavar='DAYS',
+                   help='skip songs checked less than DAYS days ago')
+    p.add_argument('--workers', type=int, default=4)
+    p.add_argument('--no-rematch', action='store_true', help='only flag dead tracks, do not search again')
+    p.set_defaults(func=cmdRevalidate)
+
+    p = sub.add_parser('search', help='full-text search of spins or songs by artist, title and album')
+    p.add_argument('query', nargs='+')
+    p.add_argument('--songs', action='store_true', help='search songs instead of spins')
+    p.add_argument('--field', choices=['artist', 'title', 'album'], help='only search this field')
+    p.add_argument('--limit', type=int, default=20)
+    p.set_defaults(func=cmdSearch)
+
+    p = sub.add_parser('episodes', help='cluster new playlists into episodes')
+    p.set_defaults(func=cmdEpisodes)
+
+    p = sub.add_parser('publish', help='publish episodes as Spotify playlists')
+    p.add_argument('episodes', nargs='*', type=int)
+    p.add_argument('--first', type=int)
+    p.add_argument('--last', type=int)
+    p.add_argument('--workers', type=int, default=4)
+    p.add_argument('--sync', action='store_true',
+                   help='also update published playlists, sending only the changes to their tracks')
+    p.set_defaults(func=cmdPublish)
+
+    p = sub.add_parser('run', help='scrape, map, cluster and publish new playlists in one pass')
+    p.add_argument('--fetch-workers', type=int, default=4)
+    p.add_argument('--parse-workers', type=int, default=0,
+                   help='parse pages in this many processes instead of the fetch threads')
+    p.add_argument('--match-workers', type=int, default=4)
+    p.add_argument('--publish-workers', type=int, default=2)
+    p.add_argument('--queue-size', type=int, default=16)
+    p.add_argument('--publish', action='store_true')
+    p.set_defaults(func=cmdRun)
+    return ap
+
+
+def main(argv=None):
+    args = makeParser().parse_args(argv)
+    logging.basicConfig(level=[logging.WARNING, logging.INFO, logging.DEBUG][min(args.verbose, 2)])
+    mondojazz.init(args.db)
+    if args.spinitron_url or args.archive or args.cache_dir or args.offline:
+        from mondojazz import scraper
+        if args.spinitron_url:
+            scraper.setBaseUrl(args.spinitron_url)
+        if args.archive:
+            scraper.setArchive(args.archive)
+        if args.cache_dir or args.offline:
+            scraper.setCache(args.cache_dir or os.getenv('SCRAPER_CACHE_DIR'), args.offline)
+    if args.metrics_json or args.metrics_prom:
+        metrics.enable()
+    try:
+        return args.func(args)
+    finally:
+        if args.metrics_json:
+            metrics.writeJson(args.metrics_json)
+        if args.metrics_prom:
+            metrics.writePrometheus(args.metrics_prom)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
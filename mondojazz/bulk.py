@@ -0,0 +1,42 @@
+import logging
+
+from sqlalchemy import insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+
+from mondojazz import metrics
+
+logger = logging.getLogger(__name__)
+
+INSERT_IGNORE = {
+    'sqlite': sqlite.insert,
+    'postgresql': postgresql.insert,
+}
+
+
+def insertIgnore(session, model, rows):
+    """Insert rows into model's table, skipping rows that violate a unique constraint.
+
+    Uses a single executemany INSERT ... ON CONFLICT DO NOTHING on SQLite and
+    PostgreSQL, other dialects fall back to one savepoint per row.
+    Returns (inserted, skipped).
+    """
+    if not rows:
+        return 0, 0
+    session.flush()
+    conn = session.connection()
+    table = model.__table__
+    make_insert = INSERT_IGNORE.get(conn.dialect.name)
+    if make_insert is not None:
+        inserted = conn.execute(make_insert(table).on_conflict_do_nothing(), rows).rowcount
+    else:
+        inserted = 0
+        for row in rows:
+            try:
+                with conn.begin_nested():
+                    conn.execute(insert(table), row)
+                inserted += 1
+            except IntegrityError as e:
+                logger.debug(f'Row:\n\t{row}\n\tCaused Exception:\n\t{e}')
+    metrics.inc('rows_written_total', inserted, table=table.name)
+    return inserted, len(rows) - inserted
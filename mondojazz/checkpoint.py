@@ -0,0 +1,65 @@
+"""Chunked, resumable processing of a whole table.
+
+Rows are read in chunks by ascending id, each chunk in its own session and
+transaction. The id of its last row is committed with the chunk, so an
+interrupted job loses at most one chunk and resumes right after the last
+committed one, and the session closing after every chunk keeps memory flat.
+"""
+import logging
+
+from sqlalchemy import delete, select
+
+from mondojazz import Session
+from mondojazz.models import Checkpoint
+
+logger = logging.getLogger(__name__)
+
+
+def loadCheckpoint(name):
+    with Session() as session:
+        return session.scalar(select(Checkpoint.position).where(Checkpoint.name == name)) or 0
+
+
+def saveCheckpoint(session, name, position):
+    checkpoint = session.scalars(select(Checkpoint).where(Checkpoint.name == name)).first()
+    if checkpoint is None:
+        session.add(Checkpoint(name=name, position=position))
+    else:
+        checkpoint.position = position
+
+
+def clearCheckpoint(name):
+    with Session() as session, session.begin():
+        session.execute(delete(Checkpoint).where(Checkpoint.name == name))
+
+
+def iterChunks(name, model, *where, chunk_size=500, resume=False, options=()):
+    """Yield (session, rows) for successive chunks of model rows matching where.
+
+    The chunk is committed together with the checkpoint once the caller asks
+    for the next one, and rolled back if the caller raises. With resume the
+    job starts after the checkpoint left by an interrupted run, which is
+    cleared once every chunk is done. Rows skipped by the caller, e.g. spins
+    that could not be matched, are not offered again in the same run.
+    """
+    position = loadCheckpoint(name) if resume else 0
+    if position:
+        logger.info(f'Resuming {name} after id={position}')
+    chunk = 0
+    while True:
+        with Session() as session, session.begin():
+            rows = session.scalars(
+                    select(model)
+                    .where(model.id > position, *where)
+                    .options(*options)
+                    .order_by(model.id)
+                    .limit(chunk_size)
+                ).all()
+            if not rows:
+                break
+            yield session, rows
+            position = rows[-1].id
+            saveCheckpoint(session, name, position)
+        chunk += 1
+        logger.info(f'{name}: committed chunk {chunk} up to id={position}')
+    clearCheckpoint(name)
@@ -0,0 +1,98 @@
+from hashlib import sha1
+import json
+import logging
+import os
+import time
+
+import requests
+
+from mondojazz import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class OfflineCacheMiss(requests.RequestException):
+    pass
+
+
+class HttpCache:
+    """On-disk cache of GET responses using conditional requests.
+
+    Every entry is a pair of files named after the hash of the url:
+    <hash>.json with the validators and fetch time, <hash>.html with the body.
+    Entries younger than ttl seconds are served without touching the network,
+    older ones are revalidated with If-None-Match/If-Modified-Since.
+    In offline mode only cached entries are served, regardless of age.
+    """
+
+    def __init__(self, path, http=None, offline=False):
+        self.path = path
+        self.http = http or requests.Session()
+        self.offline = offline
+        os.makedirs(path, exist_ok=True)
+
+    def _paths(self, url):
+        key = sha1(url.encode()).hexdigest()
+        base = os.path.join(self.path, key)
+        return base + '.json', base + '.html'
+
+    def _load(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path) as fp:
+                meta = json.load(fp)
+            with open(body_path, encoding='utf-8') as fp:
+                return meta, fp.read()
+        except (OSError, ValueError):
+            return None, None
+
+    def _store(self, url, meta, body=None):
+        meta_path, body_path = self._paths(url)
+        if body is not None:
+            with open(body_path + '.tmp', 'w', encoding='utf-8') as fp:
+                fp.write(body)
+            os.replace(body_path + '.tmp', body_path)
+        with open(meta_path + '.tmp', 'w') as fp:
+            json.dump(meta, fp)
+        os.replace(meta_path + '.tmp', meta_path)
+
+    def get(self, url, params=None, ttl=0):
+        return self.fetch(url, params, ttl)[0]
+
+    def fetch(self, url, params=None, ttl=0):
+        """Return (body, etag) of url, etag is None if the server sent none."""
+        url = requests.Request('GET', url, params=params).prepare().url
+        meta, body = self._load(url)
+        if self.offline:
+            if body is None:
+                metrics.inc('cache_requests_total', cache='http', result='miss')
+                raise OfflineCacheMiss(f'{url} is not cached')
+            metrics.inc('cache_requests_total', cache='http', result='hit')
+            return body, meta.get('etag')
+        if body is not None and time.time() - meta['fetched_at'] < ttl:
+            logger.debug(f'Cache hit {url}')
+            metrics.inc('cache_requests_total', cache='http', result='hit')
+            return body, meta.get('etag')
+
+        headers = {}
+        if body is not None:
+            if meta.get('etag'):
+                headers['If-None-Match'] = meta['etag']
+            if meta.get('last_modified'):
+                headers['If-Modified-Since'] = meta['last_modified']
+        r = self.http.get(url, headers=headers)
+        if r.status_code == 304 and body is not None:
+            logger.debug(f'Not modified {url}')
+            metrics.inc('cache_requests_total', cache='http', result='revalidated')
+            meta['fetched_at'] = time.time()
+            self._store(url, meta)
+            return body, meta.get('etag')
+        r.raise_for_status()
+        metrics.inc('cache_requests_total', cache='http', result='miss')
+        self._store(url, {
+                'url': url,
+                'etag': r.headers.get('ETag'),
+                'last_modified': r.headers.get('Last-Modified'),
+                'fetched_at': time.time(),
+            }, r.text)
+        return r.text, r.headers.get('ETag')
@@ -1,16 +1,26 @@
-from collections import defaultdict
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict, deque
+from datetime import datetime
+from hashlib import sha1
 import logging
 from urllib.error import HTTPError
 
-from sqlalchemy import func, select
+from sqlalchemy import and_, delete, func, insert, or_, select, tuple_, update
+from sqlalchemy.orm import selectinload
 
-from mondojazz import Session, spotify
+from mondojazz import Session, spotifyClient
+from mondojazz.checkpoint import iterChunks
 from mondojazz.models import Spin, SpinitronPlaylist
 from mondojazz.models import Song, Episode
 from mondojazz.models import SpotifyPlaylist, PlaylistItem
+from mondojazz.matcher import Matcher, THRESHOLD, parseYear
+from mondojazz.searchcache import SearchCache
+from mondojazz.spotify import chunks
 
 logger = logging.getLogger(__name__)
 
+search = SearchCache(spotifyClient)
+
 
 def initEpisodes(ep_no):
     with Session() as session, session.begin():
@@ -31,31 +41,488 @@ def initEpisodes(ep_no):
                 stpl.episode = ep
 
 
+def songsFingerprint(song_ids):
+    return sha1(','.join(map(str, song_ids)).encode()).hexdigest()
+
+
+def updateEpisodes(until=None):
+    """Assign episodes to playlists that have none, leaving existing episodes alone.
+
+    Every playlist whose spins are all mapped gets a fingerprint of its song
+    list stored once. A playlist without an episode joins the episode of a
+    playlist with the same fingerprint, otherwise a new episode is created,
+    numbered after the highest existing one in air order. With until only
+    playlists aired up to that datetime are considered.
+    Returns the numbers of the new episodes.
+    """
+    with Session() as session, session.begin():
+        todo = or_(SpinitronPlaylist.episode_id == None, SpinitronPlaylist.fingerprint == None)
+        if until is not None:
+            todo = and_(todo, SpinitronPlaylist.timeslot <= until)
+        stpls = session.scalars(
+                select(SpinitronPlaylist)
+                .where(todo)
+                .order_by(SpinitronPlaylist.timeslot)
+            ).all()
+        song_ids = defaultdict(list)
+        for pl_id, song_id in session.execute(
+                select(Spin.playlist_id, Spin.song_id)
+                .join(Spin.playlist)
+                .where(todo)
+                .order_by(Spin.playlist_id, Spin.number)):
+            song_ids[pl_id].append(song_id)
+
+        for stpl in stpls:
+            ids = song_ids.get(stpl.id)
+            if not ids or None in ids:
+                logger.debug(f'{stpl} is not fully mapped yet')
+                continue
+            stpl.fingerprint = songsFingerprint(ids)
+
+        pending = [stpl for stpl in stpls if stpl.episode_id is None and stpl.fingerprint]
+        session.flush()
+        known = dict(session.execute(
+                select(SpinitronPlaylist.fingerprint, SpinitronPlaylist.episode_id)
+                .where(SpinitronPlaylist.episode_id != None,
+                       SpinitronPlaylist.fingerprint.in_({stpl.fingerprint for stpl in pending}))
+            ).all())
+        ep_no = (session.scalar(select(func.max(Episode.number))) or 0) + 1
+        new = {}
+        for stpl in pending:
+            if stpl.fingerprint in known:
+                stpl.episode_id = known[stpl.fingerprint]
+                continue
+            if stpl.fingerprint not in new:
+                new[stpl.fingerprint] = Episode(number=ep_no)
+                ep_no += 1
+            stpl.episode = new[stpl.fingerprint]
+        logger.info(f'Assigned {len(pending)} playlists, {len(new)} new episodes')
+        numbers = [ep.number for ep in new.values()]
+    return numbers
+
+
+def getEpisodeDesc(ep):
+    aired = ', '.join(ep.getAirDates())
+    return f'{aired} on Radio Free Brooklyn with Ludovico Granvassu'
+
+
+def getEpisodeSongs(ep):
+    """Songs to publish for ep, skipping the theme, spins without a Spotify
+    match and songs whose track revalidateSongs found dead."""
+    spins = sorted(ep.spinitron_playlists[0].spins, key=lambda spin: spin.number)
+    return [spin.song for spin in spins[1:]
+            if spin.song and spin.song.spotify_id and spin.song.playable is not False]
+
+
+def storePlaylistItems(pl, songs, session):
+    for i, song in enumerate(songs):
+        item = PlaylistItem(index=i, track_id=song.spotify_id)
+        item.song = song
+        item.playlist = pl
+        session.add(item)
+
+
 def mapEpToSpotify(ep, session):
     pl = session.scalars(select(SpotifyPlaylist).where(SpotifyPlaylist.episode == ep)).first()
     if pl:
-        logger.warning(f'Episode {ep.number} already has a playlist: {pl.spotify_id}')
+        logger.warning(f'Episode {ep.number} already has a playlist: {pl.spotify_id}, use syncEpisodes')
         return
     name = ep.getName()
-    aired = ', '.join(ep.getAirDates())
-    desc = f'{aired} on Radio Free Brooklyn with Ludovico Granvassu'
-    spotify_id = spotify.create_playlist(name, desc)
+    desc = getEpisodeDesc(ep)
+    spotify_id = spotifyClient.create_playlist(name, desc)
     pl = SpotifyPlaylist(
             spotify_id=spotify_id,
             name=name,
             desc=desc,
         )
     ep.playlist = pl
-    for i, spin in enumerate(ep.spinitron_playlists[0].spins[1:]):
-        item = PlaylistItem(index=i)
-        item.song = spin.song
-        item.playlist = pl
-        session.add(item)
-    spotify.add_items_to_playlist(pl.spotify_id, [item.song.spotify_id for item in pl.items])
-        
+    songs = getEpisodeSongs(ep)
+    storePlaylistItems(pl, songs, session)
+    pl.snapshot_id = spotifyClient.add_items_to_playlist(
+            pl.spotify_id, [song.spotify_id for song in songs])
+
+
+def publishEpisode(job):
+    """Create the playlist if needed and upload its items, without touching the database."""
+    result = {'episode': job['episode'], 'spotify_id': job['spotify_id'],
+              'snapshot_id': None, 'error': None}
+    try:
+        if result['spotify_id'] is None:
+            result['spotify_id'] = spotifyClient.create_playlist(job['name'], job['desc'])
+        result['snapshot_id'] = spotifyClient.replace_playlist_items(
+                result['spotify_id'], job['tracks'])
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def selectEpisodes(numbers=None, first=None, last=None):
+    """Select Episodes with everything needed to publish them loaded,
+    optionally only a list or range of episode numbers."""
+    q = (select(Episode)
+         .options(selectinload(Episode.playlist)
+                  .selectinload(SpotifyPlaylist.items)
+                  .selectinload(PlaylistItem.song),
+                  selectinload(Episode.spinitron_playlists)
+                  .selectinload(SpinitronPlaylist.spins)
+                  .selectinload(Spin.song))
+         .order_by(Episode.number))
+    if numbers is not None:
+        q = q.where(Episode.number.in_(numbers))
+    if first is not None:
+        q = q.where(Episode.number >= first)
+    if last is not None:
+        q = q.where(Episode.number <= last)
+    return q
+
+
+def makePublishJob(ep):
+    """Plain data for publishEpisode, None if ep is already published."""
+    if ep.playlist and ep.playlist.snapshot_id:
+        logger.info(f'Episode {ep.number} already published: {ep.playlist.spotify_id}')
+        return None
+    return {
+        'episode': ep.number,
+        'spotify_id': ep.playlist.spotify_id if ep.playlist else None,
+        'name': ep.getName(),
+        'desc': getEpisodeDesc(ep),
+        'tracks': [song.spotify_id for song in getEpisodeSongs(ep)],
+    }
+
+
+def storePublishResult(ep, job, result, session):
+    if result['spotify_id'] and ep.playlist is None:
+        ep.playlist = SpotifyPlaylist(
+                spotify_id=result['spotify_id'],
+                name=job['name'],
+                desc=job['desc'],
+            )
+        storePlaylistItems(ep.playlist, getEpisodeSongs(ep), session)
+    if ep.playlist:
+        ep.playlist.snapshot_id = result['snapshot_id']
+    if result['error']:
+        logger.error(f'Publishing episode {ep.number} failed: {result["error"]}')
+    else:
+        logger.info(f'Published episode {ep.number}: {result["spotify_id"]}')
+
+
+def publishEpisodes(numbers=None, first=None, last=None, max_workers=4):
+    """Publish a list or range of episodes to Spotify.
+
+    Playlists are created and filled by a worker pool, while results are
+    written and committed from this thread one episode at a time. A playlist
+    whose upload failed keeps snapshot_id None and is refilled on the next
+    run, fully uploaded ones are skipped. Returns one result dict per episode.
+    """
+    with Session(expire_on_commit=False) as session:
+        episodes = {}
+        jobs = []
+        for ep in session.scalars(selectEpisodes(numbers, first, last)):
+            job = makePublishJob(ep)
+            if job:
+                episodes[ep.number] = ep
+                jobs.append(job)
+        logger.info(f'Publishing {len(jobs)} episodes')
+
+        results = []
+        for job, result in spotifyClient.map(publishEpisode, jobs, max_workers):
+            storePublishResult(episodes[job['episode']], job, result, session)
+            session.commit()
+            results.append(result)
+    return results
+
+
+def longestIncreasing(values):
+    """Set of the values of a longest strictly increasing subsequence."""
+    tails = []  # smallest tail value of an increasing subsequence of every length
+    ends = []  # and its index into values
+    prev = [None] * len(values)
+    for i, v in enumerate(values):
+        k = bisect_left(tails, v)
+        prev[i] = ends[k - 1] if k else None
+        if k == len(tails):
+            tails.append(v)
+            ends.append(i)
+        else:
+            tails[k] = v
+            ends[k] = i
+    keep = set()
+    i = ends[-1] if ends else None
+    while i is not None:
+        keep.add(values[i])
+        i = prev[i]
+    return keep
+
+
+def diffPlaylistItems(current, desired):
+    """Playlist calls turning the track list current into desired.
+
+    Tracks current holds more often than desired are removed, Spotify
+    removing every occurrence of a track. The k-th occurrence of every other
+    track is matched to its k-th place in desired, the tracks outside a longest
+    run of increasing places are moved one by one and the missing places are
+    filled by adding runs of tracks. Returns a list of ('remove', track_ids),
+    ('move', range_start, insert_before) and ('add', track_ids, position).
+    """
+    want, have = Counter(desired), Counter(current)
+    removed = [t for t in have if have[t] > want[t]]
+    ops = [('remove', removed)] if removed else []
+
+    places = defaultdict(deque)
+    for j, t in enumerate(desired):
+        places[t].append(j)
+    work = [places[t].popleft() for t in current if have[t] <= want[t]]
+    settled = sorted(longestIncreasing(work))
+    for x in sorted(set(work).difference(settled)):
+        start = work.index(x)
+        k = bisect_left(settled, x)
+        before = work.index(settled[k - 1]) + 1 if k else 0
+        insort(settled, x)
+        if before in (start, start + 1):
+            continue
+        ops.append(('move', start, before))
+        work.pop(start)
+        work.insert(before if before < start else before - 1, x)
+
+    present = set(work)
+    run = []
+    for j in range(len(desired) + 1):
+        if j < len(desired) and j not in present:
+            run.append(j)
+        elif run:
+            ops.append(('add', [desired[r] for r in run], run[0]))
+            run = []
+    return ops
+
+
+def applyPlaylistDiff(playlist_id, ops, snapshot_id=None):
+    """Send the calls of diffPlaylistItems, returns the resulting snapshot_id."""
+    for op, *args in ops:
+        if op == 'remove':
+            snapshot_id = spotifyClient.remove_playlist_items(playlist_id, args[0], snapshot_id)
+        elif op == 'move':
+            snapshot_id = spotifyClient.reorder_playlist_items(playlist_id, *args, snapshot_id=snapshot_id)
+        else:
+            snapshot_id = spotifyClient.add_items_to_playlist(playlist_id, *args)
+    return snapshot_id
+
+
+def makeSyncJob(ep):
+    """Plain data for syncPlaylist: the mirrored and the wanted track list of ep."""
+    pl = ep.playlist
+    return {
+        'episode': ep.number,
+        'spotify_id': pl.spotify_id if pl else None,
+        'snapshot_id': pl.snapshot_id if pl else None,
+        'items': [item.track_id or item.song.spotify_id
+                  for item in sorted(pl.items, key=lambda item: item.index)] if pl else [],
+        'name': ep.getName(),
+        'desc': getEpisodeDesc(ep),
+        'tracks': [song.spotify_id for song in getEpisodeSongs(ep)],
+    }
+
+
+def syncPlaylist(job):
+    """Bring the Spotify playlist of job in line with its tracks, without touching the database.
+
+    The mirrored items are trusted while the playlist's snapshot_id is the
+    stored one, otherwise the tracks are read back first. Only the calls
+    needed to turn them into the wanted tracks are made, none for a playlist
+    that is up to date.
+    """
+    result = {'episode': job['episode'], 'spotify_id': job['spotify_id'],
+              'snapshot_id': job['snapshot_id'], 'changes': 0, 'error': None}
+    try:
+        current = job['items']
+        if result['spotify_id'] is None:
+            result['spotify_id'] = spotifyClient.create_playlist(job['name'], job['desc'])
+            current = []
+        else:
+            snapshot_id = spotifyClient.get_playlist_snapshot(result['spotify_id'])
+            if snapshot_id != job['snapshot_id']:
+                logger.info(f'Playlist of episode {job["episode"]} changed since the last sync, reading it')
+                current = spotifyClient.get_playlist_tracks(result['spotify_id'])
+                result['snapshot_id'] = snapshot_id
+        if None in current:
+            # local or unavailable tracks can not be removed by id
+            result['changes'] = 1
+            result['snapshot_id'] = spotifyClient.replace_playlist_items(result['spotify_id'], job['tracks'])
+        else:
+            ops = diffPlaylistItems(current, job['tracks'])
+            result['changes'] = len(ops)
+            result['snapshot_id'] = applyPlaylistDiff(result['spotify_id'], ops, result['snapshot_id'])
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+def storeSyncResult(ep, job, result, session):
+    if result['spotify_id'] and ep.playlist is None:
+        ep.playlist = SpotifyPlaylist(
+                spotify_id=result['spotify_id'],
+                name=job['name'],
+                desc=job['desc'],
+            )
+    pl = ep.playlist
+    if pl is None:
+        logger.error(f'Syncing episode {ep.number} failed: {result["error"]}')
+        return
+    if result['error']:
+        # the playlist may be half updated, read it back on the next sync
+        pl.snapshot_id = None
+        logger.error(f'Syncing episode {ep.number} failed: {result["error"]}')
+        return
+    if job['items'] != job['tracks'] or pl.id is None:
+        if pl.id is not None:
+            session.execute(delete(PlaylistItem).where(PlaylistItem.playlist_id == pl.id))
+            session.expire(pl, ['items'])
+        storePlaylistItems(pl, getEpisodeSongs(ep), session)
+    pl.snapshot_id = result['snapshot_id']
+    if result['changes']:
+        logger.info(f'Synced episode {ep.number} with {result["changes"]} changes: {pl.spotify_id}')
+    else:
+        logger.info(f'Episode {ep.number} is up to date: {pl.spotify_id}')
+
+
+def syncEpisodes(numbers=None, first=None, last=None, max_workers=4):
+    """Update the Spotify playlists of a list or range of episodes to their
+    current songs, creating missing ones.
 
-def mapSpins():
+    Like publishEpisodes the calls are made by a worker pool and results
+    committed from this thread one episode at a time, but already published
+    playlists are diffed against their stored items, see syncPlaylist.
+    Returns one result dict per episode.
+    """
+    with Session(expire_on_commit=False) as session:
+        episodes = {}
+        jobs = []
+        for ep in session.scalars(selectEpisodes(numbers, first, last)):
+            episodes[ep.number] = ep
+            jobs.append(makeSyncJob(ep))
+        logger.info(f'Syncing {len(jobs)} episodes')
+
+        results = []
+        for job, result in spotifyClient.map(syncPlaylist, jobs, max_workers):
+            storeSyncResult(episodes[job['episode']], job, result, session)
+            session.commit()
+            results.append(result)
+    changed = sum(1 for r in results if r['changes'] and not r['error'])
+    logger.info(f'Synced {len(results)} episodes, {changed} changed')
+    return results
+
+
+def checkSong(song, track, checked_at):
+    """Store the result of looking up song's track, returns whether it is playable."""
+    song.playable = bool(track) and track.get('is_playable', True)
+    song.checked_at = checked_at
+    if song.playable:
+        song.album = track['album']['name'] or song.album
+        song.year = parseYear(track['album']['release_date']) or song.year
+    return song.playable
+
+
+def rematchSong(song, match, session):
+    """Replace the dead track of song by match, returns whether one was found."""
+    dead_id, song.spotify_id = song.spotify_id, None
+    if match is None or match.spotify_id is None:
+        logger.warning(f'No track replaces dead {dead_id} of {song}')
+        return False
+    session.flush()
+    dup = session.scalars(select(Song).where(Song.spotify_id == match.spotify_id)).first()
+    if dup:
+        logger.info(f'{song} now matches {dup}, moving its spins')
+        # their song lists changed, updateEpisodes fingerprints them again
+        session.execute(
+            update(SpinitronPlaylist)
+            .where(SpinitronPlaylist.id.in_(select(Spin.playlist_id).where(Spin.song_id == song.id)))
+            .values(fingerprint=None))
+        session.execute(update(Spin).where(Spin.song_id == song.id).values(song_id=dup.id))
+        return True
+    logger.info(f'Replacing dead {dead_id} of {song} with {match.spotify_id}')
+    song.spotify_id = match.spotify_id
+    song.score = match.score
+    song.playable = True
+    return True
+
+
+def revalidateSongs(max_age=None, max_workers=4, rematch=True):
+    """Recheck the Spotify track of every song with batched track lookups.
+
+    Tracks are looked up MAX_TRACK_IDS at a time, max_workers requests in
+    parallel, skipping songs checked less than max_age (a timedelta) ago
+    unless they were found dead. Album and year of playable tracks are
+    refreshed, relinked ones keep their id as Spotify advises. Tracks that are
+    gone or no longer playable are flagged playable=False, which leaves them
+    out of playlists, and with rematch matched again through
+    matchSpinToSpotify, a song without a new match losing its spotify_id.
+    Songs flagged without being rematched, e.g. with rematch=False or after a
+    failed search, are rematched by the next run.
+    Returns a Counter of checked, dead and rematched songs.
+    """
+    now = datetime.now()
+    stats = Counter()
+    with Session() as session:
+        q = select(Song).where(Song.spotify_id != None)
+        if max_age is not None:
+            q = q.where(or_(Song.checked_at == None, Song.checked_at < now - max_age,
+                            Song.playable == False))
+        by_spotify_id = {song.spotify_id: song for song in session.scalars(q)}
+        ids = list(by_spotify_id)
+        batches = list(chunks(ids, spotifyClient.MAX_TRACK_IDS))
+        logger.info(f'Revalidating {len(by_spotify_id)} songs in {len(batches)} requests')
+
+        dead = []
+        for batch, tracks in spotifyClient.map(spotifyClient.get_tracks, batches, max_workers):
+            if isinstance(tracks, Exception):
+                logger.error(f'Looking up {len(batch)} tracks failed: {tracks}')
+                stats['failed'] += len(batch)
+                continue
+            for spotify_id, track in zip(batch, tracks):
+                song = by_spotify_id[spotify_id]
+                stats['checked'] += 1
+                if track and track['id'] != spotify_id:
+                    stats['relinked'] += 1
+                if not checkSong(song, track, now):
+                    dead.append(song)
+        stats['dead'] = len(dead)
+        session.commit()
+
+        if rematch and dead:
+            logger.info(f'Rematching {len(dead)} songs with dead tracks')
+            spins = [Spin(title=song.title, artist=song.artist, album=song.album, year=song.year)
+                     for song in dead]
+            exclude = {song.spotify_id for song in dead}
+            matches = spotifyClient.map(lambda spin: matchSpinToSpotify(spin, exclude=exclude),
+                                  spins, max_workers)
+            for song, (_, match) in zip(dead, matches):
+                if isinstance(match, Exception):
+                    logger.error(f'Spotify error while rematching {song}\n{match}')
+                    continue
+                stats['rematched' if rematchSong(song, match, session) else 'unmatched'] += 1
+            session.commit()
+    logger.info(f'Revalidated songs: {dict(stats)}')
+    return stats
+
+
+def mapSpins(chunk_size=None, resume=False):
+    """Map unmapped spins one by one.
+
+    With chunk_size spins are committed chunk_size at a time, so an interrupt
+    loses at most one chunk, and with resume an interrupted chunked run picks
+    up after its last commit.
+    """
     logger.info(f'Querying unmaped spins')
+    if chunk_size:
+        try:
+            for session, spins in iterChunks('mapSpins', Spin, Spin.song_id == None,
+                                             chunk_size=chunk_size, resume=resume):
+                for spin in spins:
+                    logger.info(f'Mapping {spin}')
+                    findOrCreateSong(spin, session)
+        except KeyboardInterrupt:
+            logger.info(f'Stopping')
+        logger.info(f'Spotify search cache: {search.stats()}')
+        return
     with Session() as session, session.begin():
         try:
             spins = session.scalars(select(Spin).where(Spin.song == None)).all()
@@ -64,12 +531,160 @@ def mapSpins():
                 findOrCreateSong(spin, session)
         except KeyboardInterrupt:
             logger.info(f'Stopping')
+    logger.info(f'Spotify search cache: {search.stats()}')
+
+
+def mapSpinsBatch(max_workers=None, chunk_size=None, resume=False):
+    """Map all unmapped spins with a constant number of queries.
+
+    Existing songs are indexed in memory by (title, artist) and spotify_id,
+    unmapped spins are grouped by (title, artist) and each group is resolved
+    once, then song_id is assigned to all spins with one bulk update.
+    With max_workers Spotify is queried concurrently, the database is only
+    touched from this thread.
+    With chunk_size spins are mapped and committed chunk_size at a time,
+    looking up only the songs each chunk needs, see mapSpinChunk.
+    """
+    logger.info(f'Querying unmaped spins')
+    if chunk_size:
+        mapped = distinct = 0
+        try:
+            for session, spins in iterChunks('mapSpinsBatch', Spin, Spin.song_id == None,
+                                             chunk_size=chunk_size, resume=resume):
+                m, d = mapSpinChunk(session, spins, max_workers)
+                mapped += m
+                distinct += d
+        except KeyboardInterrupt:
+            logger.info(f'Stopping')
+        logger.info(f'Mapped {mapped} of {distinct} distinct songs')
+        logger.info(f'Spotify search cache: {search.stats()}')
+        return
+    with Session() as session, session.begin():
+        songs = session.scalars(select(Song)).all()
+        by_key = {(song.title, song.artist): song for song in songs}
+        by_spotify_id = {song.spotify_id: song for song in songs if song.spotify_id}
+
+        groups = defaultdict(list)
+        for spin in session.scalars(select(Spin).where(Spin.song_id == None)):
+            groups[(spin.title, spin.artist)].append(spin)
+        logger.info(f'Got {sum(map(len, groups.values()))} spins with {len(groups)} distinct songs')
+
+        resolved = {key: by_key[key] for key in groups if key in by_key}
+        todo = [spins[0] for key, spins in groups.items() if key not in by_key]
+        try:
+            for spin, song in matchSpins(todo, max_workers):
+                resolved[(spin.title, spin.artist)] = dedupSong(song, by_spotify_id)
+        except KeyboardInterrupt:
+            logger.info(f'Stopping')
+
+        insertSongs(session, resolved.values())
+        rows = [
+            {'id': spin.id, 'song_id': song.id}
+            for key, song in resolved.items()
+            for spin in groups[key]
+        ]
+        if rows:
+            session.execute(update(Spin), rows)
+    logger.info(f'Mapped {len(resolved)} of {len(groups)} distinct songs')
+    logger.info(f'Spotify search cache: {search.stats()}')
+
+
+def mapSpinChunk(session, spins, max_workers=None):
+    """Map spins like mapSpinsBatch, reading only the songs they may map to.
+
+    Returns (mapped, distinct) counts of the (title, artist) groups.
+    """
+    groups = defaultdict(list)
+    for spin in spins:
+        groups[(spin.title, spin.artist)].append(spin)
+    by_key = {
+        (song.title, song.artist): song
+        for song in session.scalars(
+            select(Song).where(tuple_(Song.title, Song.artist).in_(list(groups))))
+    }
+    resolved = {key: by_key[key] for key in groups if key in by_key}
+    matched = list(matchSpins(
+        [spins[0] for key, spins in groups.items() if key not in by_key], max_workers))
+
+    spotify_ids = {song.spotify_id for _, song in matched if song.spotify_id}
+    by_spotify_id = {
+        song.spotify_id: song
+        for song in session.scalars(select(Song).where(Song.spotify_id.in_(spotify_ids)))
+    } if spotify_ids else {}
+    for spin, song in matched:
+        resolved[(spin.title, spin.artist)] = dedupSong(song, by_spotify_id)
+
+    insertSongs(session, resolved.values())
+    rows = [
+        {'id': spin.id, 'song_id': song.id}
+        for key, song in resolved.items()
+        for spin in groups[key]
+    ]
+    if rows:
+        session.execute(update(Spin), rows)
+    return len(resolved), len(groups)
+
+
+def insertSongs(session, songs):
+    """Insert the not yet stored songs with one executemany and set their ids.
+
+    Ids come back by (title, artist), unique among songs resolved for spin
+    groups, as asking for the rows in parameter order makes SQLite insert
+    them one by one.
+    """
+    new = list({id(song): song for song in songs if song.id is None}.values())
+    if not new:
+        return
+    ids = {
+        (title, artist): id_
+        for id_, title, artist in session.execute(
+            insert(Song).returning(Song.id, Song.title, Song.artist),
+            [{
+                'title': song.title,
+                'artist': song.artist,
+                'album': song.album,
+                'year': song.year,
+                'spotify_id': song.spotify_id,
+                'score': song.score,
+            } for song in new])
+    }
+    for song in new:
+        song.id = ids[(song.title, song.artist)]
+
+
+def matchSpins(spins, max_workers=None):
+    """Yield (spin, song) for every spin matched on Spotify, skipping errors."""
+    def match(spin):
+        try:
+            return matchSpinToSpotify(spin)
+        except Exception as e:
+            return e
+
+    if max_workers:
+        results = spotifyClient.map(matchSpinToSpotify, spins, max_workers)
+    else:
+        results = ((spin, match(spin)) for spin in spins)
+    for spin, song in results:
+        if isinstance(song, Exception):
+            logger.error(f'Spotify error while querying {spin}\n{song}')
+            continue
+        yield spin, song
+
+
+def dedupSong(song, by_spotify_id):
+    dup = by_spotify_id.get(song.spotify_id)
+    if dup:
+        logger.info(f'{song} seems to be a duplicate of {dup}')
+        return dup
+    if song.spotify_id:
+        by_spotify_id[song.spotify_id] = song
+    return song
 
 
 def findOrCreateSong(spin, session):
     song = session.scalars(
         select(Song)
-        .where(Song.title == spin.title and Song.artist == spin.artist)
+        .where(Song.title == spin.title, Song.artist == spin.artist)
     ).first()
     if song:
         logger.info(f'Found {song} in database')
@@ -85,40 +700,58 @@ def findOrCreateSong(spin, session):
             song = dup
         else:
             session.add(song)
-    song.spins.append(spin)
+    # assigning the many-to-one side does not load the song's spins collection
+    spin.song = song
 
 
-def matchSpinToSpotify(spin):
-    spotify_id = None
-    album = spin.album
-    year = spin.year
+def matchSpinToSpotify(spin, threshold=None, exclude=()):
+    """Match spin to a Spotify track, ranking every candidate returned.
 
-    try:
-        for qf in [spin.toFilterQuery, spin.toSimpleQuery, spin.toQuery]:
-            q = qf()
-            logger.info(f'Querying spotify q="{q}"')
-            results = spotify.search_track(q)
-            if results:
-                break
-    except HTTPError as e:
-        if e.code == 400:
+    Queries are tried from the most to the least specific and the first one
+    whose best candidate scores at least threshold wins, otherwise the best
+    candidate seen overall is taken. The score is kept on the Song so low
+    confidence matches can be rechecked later. Track ids in exclude, known to
+    be dead, are never matched even if a cached search still returns them.
+    """
+    if threshold is None:
+        threshold = THRESHOLD
+    matcher = Matcher(spin)
+    score, result = 0.0, None
+
+    for qf in [spin.toFilterQuery, spin.toSimpleQuery, spin.toQuery]:
+        q = qf()
+        logger.info(f'Querying spotify q="{q}"')
+        try:
+            results = search.search_track(q)
+        except HTTPError as e:
+            if e.code != 400:
+                raise
             logger.error(f'Got 400 with {q}')
-            results = spotify.search_track(spin.toSimpleQuery())
+            continue
+        results = [r for r in results if r['id'] not in exclude]
+        if results:
+            best_score, best = matcher.rank(results)[0]
+            if result is None or best_score > score:
+                score, result = best_score, best
+            if score >= threshold:
+                break
 
-    if not results:
+    spotify_id = None
+    album = spin.album
+    year = spin.year
+    if result is None:
         logger.warning(f'Nothing matches {spin}')
     else:
-        result = results[0]
-        logger.info(f'Best match for {spin}:\n\t{result}')
-        spotify_id = results[0]['id']
-
+        logger.info(f'Best match for {spin} scored {score:.2f}:\n\t{result}')
+        spotify_id = result['id']
         album = album or result['album']
-        year = year or int(result['date'] if len(result['date']) == 4 else result['date'][:4])
+        year = year or parseYear(result['date'])
 
     return Song(
         spotify_id=spotify_id,
         title=spin.title,
         artist=spin.artist,
         album=album,
-        year=year
+        year=year,
+        score=score if result else None,
     )
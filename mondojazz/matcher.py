@@ -0,0 +1,79 @@
+import os
+import re
+import unicodedata
+
+THRESHOLD = float(os.getenv('MATCH_THRESHOLD', 0.75))
+
+WEIGHTS = {
+    'title': 0.5,
+    'artist': 0.3,
+    'album': 0.15,
+    'year': 0.05,
+}
+
+# "with" credits only in brackets, it is a common word in titles
+FEAT_RE = re.compile(r'\s([\(\[]?(feat\.?|ft\.|featuring)|[\(\[]with)\s.*$')
+PAREN_RE = re.compile(r'\([^)]*\)|\[[^\]]*\]')
+PUNCT_RE = re.compile(r'[^\w\s]')
+
+
+def normalize(s):
+    """Casefold, strip accents, "feat." credits, parentheticals and punctuation."""
+    s = unicodedata.normalize('NFKD', s or '')
+    s = ''.join(c for c in s if not unicodedata.combining(c)).casefold()
+    s = FEAT_RE.sub('', s)
+    s = PAREN_RE.sub(' ', s)
+    s = PUNCT_RE.sub(' ', s)
+    return ' '.join(s.split())
+
+
+def trigrams(s):
+    s = f'  {s} '
+    return frozenset(s[i:i + 3] for i in range(len(s) - 2))
+
+
+def similarity(a, b):
+    """Dice coefficient of the character trigrams of two trigram sets."""
+    if not a or not b:
+        return 0.0
+    return 2 * len(a & b) / (len(a) + len(b))
+
+
+def parseYear(date):
+    try:
+        return int(date[:4])
+    except (TypeError, ValueError):
+        return 0
+
+
+class Matcher:
+    """Scores Spotify search results against a single spin.
+
+    The spin's normalized fields are computed once and reused for every
+    candidate, fields the spin lacks (album, year) are left out and the
+    remaining weights rescaled.
+    """
+
+    def __init__(self, spin):
+        self.title = trigrams(normalize(spin.title))
+        self.artist = trigrams(normalize(spin.artist))
+        self.album = trigrams(normalize(spin.album)) if spin.album else None
+        self.year = spin.year or None
+        self.total = sum(w for f, w in WEIGHTS.items() if getattr(self, f) is not None)
+
+    def score(self, result):
+        s = WEIGHTS['title'] * similarity(self.title, trigrams(normalize(result['track'])))
+        artists = [result['artist']] + result['artist'].split(', ')
+        s += WEIGHTS['artist'] * max(
+            similarity(self.artist, trigrams(normalize(a))) for a in artists)
+        if self.album is not None:
+            s += WEIGHTS['album'] * similarity(self.album, trigrams(normalize(result['album'])))
+        if self.year is not None:
+            diff = abs(self.year - parseYear(result['date']))
+            s += WEIGHTS['year'] * (1.0 if diff == 0 else 0.5 if diff == 1 else 0.0)
+        return s / self.total
+
+    def rank(self, results):
+        """Return [(score, result)] sorted best first."""
+        return sorted(((self.score(r), r) for r in results),
+                      key=lambda sr: sr[0], reverse=True)
@@ -0,0 +1,165 @@
+"""Run metrics: counters and latency histograms with JSON and Prometheus output.
+
+Disabled by default, in which case every call returns right away. Enable with
+enable() or the MONDOJAZZ_METRICS environment variable, then write the
+collected values at the end of a run with writeJson() / writePrometheus().
+"""
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+import json
+import os
+import threading
+import time
+
+PREFIX = 'mondojazz_'
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, float('inf'))
+
+enabled = bool(os.getenv('MONDOJAZZ_METRICS'))
+
+_lock = threading.Lock()
+_counters = defaultdict(float)
+_histograms = {}
+
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _histograms.clear()
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    if not enabled:
+        return
+    with _lock:
+        _counters[_key(name, labels)] += value
+
+
+def observe(name, value, **labels):
+    if not enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        h = _histograms.get(key)
+        if h is None:
+            h = _histograms[key] = {'count': 0, 'sum': 0.0, 'buckets': [0] * len(BUCKETS)}
+        h['count'] += 1
+        h['sum'] += value
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                h['buckets'][i] += 1
+                break
+
+
+@contextmanager
+def _timed(name, labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def timed(name, **labels):
+    """Context manager observing the duration of its block in seconds."""
+    if not enabled:
+        return nullcontext()
+    return _timed(name, labels)
+
+
+def instrumentSessions(factory):
+    """Record flush durations and rows flushed per table for sessions of factory."""
+    from sqlalchemy import event
+
+    @event.listens_for(factory, 'before_flush')
+    def beforeFlush(session, flush_context, instances):
+        if not enabled:
+            return
+        for obj in session.new:
+            inc('rows_written_total', table=obj.__table__.name)
+        session.info['metrics_flush_start'] = time.perf_counter()
+
+    @event.listens_for(factory, 'after_flush_postexec')
+    def afterFlush(session, flush_context):
+        start = session.info.pop('metrics_flush_start', None)
+        if start is not None:
+            observe('db_flush_seconds', time.perf_counter() - start)
+
+
+def report():
+    """Collected metrics as a JSON-serializable dict."""
+    with _lock:
+        counters = defaultdict(list)
+        for (name, labels), value in sorted(_counters.items()):
+            counters[name].append({'labels': dict(labels), 'value': value})
+        histograms = defaultdict(list)
+        for (name, labels), h in sorted(_histograms.items()):
+            histograms[name].append({
+                'labels': dict(labels),
+                'count': h['count'],
+                'sum': h['sum'],
+                'mean': h['sum'] / h['count'],
+                'buckets': {str(b): c for b, c in zip(BUCKETS, h['buckets'])},
+            })
+        hits, totals = defaultdict(float), defaultdict(float)
+        for (name, labels), value in _counters.items():
+            if name == 'cache_requests_total':
+                labels = dict(labels)
+                totals[labels['cache']] += value
+                if labels['result'] == 'hit':
+                    hits[labels['cache']] += value
+        hit_rates = {cache: hits[cache] / total for cache, total in totals.items()}
+    return {'counters': dict(counters), 'histograms': dict(histograms), 'cache_hit_rates': hit_rates}
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+
+
+def prometheus():
+    """Collected metrics in the Prometheus text exposition format."""
+    lines = []
+    with _lock:
+        seen = set()
+        for (name, labels), value in sorted(_counters.items()):
+            if name not in seen:
+                lines.append(f'# TYPE {PREFIX}{name} counter')
+                seen.add(name)
+            lines.append(f'{PREFIX}{name}{_labels(labels)} {value:g}')
+        for (name, labels), h in sorted(_histograms.items()):
+            if name not in seen:
+                lines.append(f'# TYPE {PREFIX}{name} histogram')
+                seen.add(name)
+            cumulative = 0
+            for bound, count in zip(BUCKETS, h['buckets']):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else f'{bound:g}'
+                lines.append(f'{PREFIX}{name}_bucket{_labels(labels + (("le", le),))} {cumulative}')
+            lines.append(f'{PREFIX}{name}_sum{_labels(labels)} {h["sum"]:g}')
+            lines.append(f'{PREFIX}{name}_count{_labels(labels)} {h["count"]}')
+    return '\n'.join(lines) + '\n'
+
+
+def _write(path, text):
+    # textfile collectors may read at any time, so never expose a partial file
+    with open(path + '.tmp', 'w') as fp:
+        fp.write(text)
+    os.replace(path + '.tmp', path)
+
+
+def writeJson(path):
+    _write(path, json.dumps(report(), indent=2))
+
+
+def writePrometheus(path):
+    _write(path, prometheus())
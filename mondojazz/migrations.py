@@ -0,0 +1,127 @@
+"""Versioned schema migrations.
+
+The version of a database is kept in the schemaversion table. A database is
+brought up to date by applying the migrations above its version in order,
+each in its own transaction. New databases and those created before
+versioning have no schemaversion table and start at version 0: their missing
+tables are created from the models first, then every migration runs, adding
+the columns old tables lack and what the models can not express, like the
+full-text index.
+
+A migration is a function taking a Connection, registered with
+@migration(version). Migrations must not use the models, which only describe
+the latest schema, and must be safe to run on a database that already has
+their changes (create_all of a later release, an interrupted upgrade).
+"""
+import logging
+
+from sqlalchemy import Column, Integer, MetaData, String, Table
+from sqlalchemy import inspect, text
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = {}
+
+metadata = MetaData()
+schemaVersion = Table('schemaversion', metadata, Column('version', Integer, nullable=False))
+
+
+def migration(version):
+    def register(fn):
+        assert version not in MIGRATIONS, f'duplicate migration {version}'
+        MIGRATIONS[version] = fn
+        return fn
+    return register
+
+
+def latestVersion():
+    return max(MIGRATIONS, default=0)
+
+
+def currentVersion(conn):
+    if not inspect(conn).has_table(schemaVersion.name):
+        return 0
+    return conn.scalar(schemaVersion.select()) or 0
+
+
+def setVersion(conn, version):
+    schemaVersion.create(conn, checkfirst=True)
+    conn.execute(schemaVersion.delete())
+    conn.execute(schemaVersion.insert().values(version=version))
+
+
+def addColumn(conn, table, name, type_):
+    if name not in {c['name'] for c in inspect(conn).get_columns(table)}:
+        conn.execute(text(f'ALTER TABLE {table} ADD COLUMN {name} {type_}'))
+
+
+def createIndex(conn, name, table, *columns, unique=False):
+    unique = 'UNIQUE ' if unique else ''
+    conn.execute(text(f'CREATE {unique}INDEX IF NOT EXISTS {name} ON {table} ({", ".join(columns)})'))
+
+
+def upgrade(engine):
+    """Create or upgrade the schema of engine's database, returns its version."""
+    from mondojazz.models import Base
+    with engine.begin() as conn:
+        version = currentVersion(conn)
+        if version == 0:
+            Base.metadata.create_all(conn)
+    for v in sorted(MIGRATIONS):
+        if v <= version:
+            continue
+        fn = MIGRATIONS[v]
+        logger.info(f'Migrating schema to version {v}: {fn.__doc__}')
+        with engine.begin() as conn:
+            fn(conn)
+            setVersion(conn, v)
+        version = v
+    return version
+
+
+@migration(1)
+def addCacheColumns(conn):
+    """Columns and tables added for conditional fetching, change detection and resumable jobs."""
+    addColumn(conn, 'spotifyplaylist', 'snapshot_id', 'VARCHAR')
+    addColumn(conn, 'spinitronplaylist', 'content_hash', 'VARCHAR')
+    addColumn(conn, 'spinitronplaylist', 'etag', 'VARCHAR')
+    addColumn(conn, 'spinitronplaylist', 'fingerprint', 'VARCHAR')
+    addColumn(conn, 'song', 'score', 'FLOAT')
+    createIndex(conn, 'ix_spinitronplaylist_fingerprint', 'spinitronplaylist', 'fingerprint')
+    Table('checkpoint', MetaData(),
+          Column('name', String, nullable=False, unique=True),
+          Column('position', Integer, nullable=False),
+          Column('id', Integer, primary_key=True),
+          ).create(conn, checkfirst=True)
+
+
+@migration(2)
+def addLookupIndexes(conn):
+    """Indexes for unmapped spins, song lookups and foreign key joins."""
+    createIndex(conn, 'ix_spin_song_id', 'spin', 'song_id')
+    createIndex(conn, 'ix_spin_playlist_id', 'spin', 'playlist_id')
+    createIndex(conn, 'ix_song_title_artist', 'song', 'title', 'artist')
+    createIndex(conn, 'ix_playlistitem_playlist_id', 'playlistitem', 'playlist_id')
+    createIndex(conn, 'ix_playlistitem_song_id', 'playlistitem', 'song_id')
+    createIndex(conn, 'ix_spinitronplaylist_episode_id', 'spinitronplaylist', 'episode_id')
+    createIndex(conn, 'ix_spotifyplaylist_episode_id', 'spotifyplaylist', 'episode_id')
+
+
+@migration(3)
+def addPlaylistItemTrack(conn):
+    """Track id of playlist items, mirroring the synced Spotify playlist."""
+    addColumn(conn, 'playlistitem', 'track_id', 'VARCHAR')
+
+
+@migration(4)
+def addSongChecks(conn):
+    """Last revalidation of songs' Spotify tracks."""
+    addColumn(conn, 'song', 'checked_at', 'DATETIME')
+    addColumn(conn, 'song', 'playable', 'BOOLEAN')
+
+
+@migration(5)
+def addFullTextIndex(conn):
+    """Full-text index over artist, title and album of spins and songs."""
+    from mondojazz.textsearch import createIndex as createTextIndex
+    createTextIndex(conn)
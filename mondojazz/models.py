@@ -1,12 +1,10 @@
 from datetime import datetime, time
 
-from sqlalchemy import ForeignKey
+from sqlalchemy import ForeignKey, Index
 from sqlalchemy.orm import DeclarativeBase, declared_attr
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.orm import relationship
 
-from . import engine
-
 class Base(DeclarativeBase):
 
     @declared_attr.directive
@@ -21,9 +19,10 @@ class HasSpotifyID:
 
 
 class SpotifyPlaylist(HasSpotifyID, Base):
-    episode_id: Mapped[int] = mapped_column(ForeignKey('episode.id'))
+    episode_id: Mapped[int] = mapped_column(ForeignKey('episode.id'), index=True)
     name: Mapped[str]
     desc: Mapped[str]
+    snapshot_id: Mapped[str | None]
     
     episode: Mapped['Episode'] = relationship(back_populates='playlist')
     items: Mapped[list['PlaylistItem']] = relationship(back_populates='playlist')
@@ -31,8 +30,10 @@ class SpotifyPlaylist(HasSpotifyID, Base):
 
 class PlaylistItem(Base):
     index: Mapped[int]
-    song_id: Mapped[int] = mapped_column(ForeignKey('song.id'))
-    playlist_id: Mapped[int] = mapped_column(ForeignKey('spotifyplaylist.id'))
+    song_id: Mapped[int] = mapped_column(ForeignKey('song.id'), index=True)
+    playlist_id: Mapped[int] = mapped_column(ForeignKey('spotifyplaylist.id'), index=True)
+    # the track as last synced, song.spotify_id may have changed since
+    track_id: Mapped[str | None]
     
     song: Mapped['Song'] = relationship(back_populates='tracks')
     playlist: Mapped[SpotifyPlaylist] = relationship(back_populates='items')
@@ -58,10 +59,16 @@ class Episode(Base):
 
 
 class Song(HasSpotifyID, Base):
+    __table_args__ = (Index('ix_song_title_artist', 'title', 'artist'),)
+
     artist: Mapped[str]
     title: Mapped[str]
     album: Mapped[str]
     year: Mapped[int]
+    score: Mapped[float | None]
+    # result of the last revalidation of spotify_id, see mapper.revalidateSongs
+    checked_at: Mapped[datetime | None]
+    playable: Mapped[bool | None]
 
     spins: Mapped[list['Spin']] = relationship(back_populates='song')
     tracks: Mapped[list[PlaylistItem]] = relationship(back_populates='song')
@@ -77,8 +84,8 @@ class Spin(Base):
     year: Mapped[int]
     start_time: Mapped[time]
     number: Mapped[int]
-    playlist_id: Mapped[int | None] = mapped_column(ForeignKey('spinitronplaylist.id'))
-    song_id: Mapped[int | None] = mapped_column(ForeignKey('song.id'))
+    playlist_id: Mapped[int | None] = mapped_column(ForeignKey('spinitronplaylist.id'), index=True)
+    song_id: Mapped[int | None] = mapped_column(ForeignKey('song.id'), index=True)
 
     playlist: Mapped['SpinitronPlaylist'] = relationship(back_populates='spins')
     song: Mapped[Song] = relationship(back_populates='spins')
@@ -106,16 +113,22 @@ class Spin(Base):
 
 class SpinitronPlaylist(Base):
     spinitron_id: Mapped[int] = mapped_column(unique=True)
-    episode_id: Mapped[int | None] = mapped_column(ForeignKey('episode.id'))
+    episode_id: Mapped[int | None] = mapped_column(ForeignKey('episode.id'), index=True)
     timeslot: Mapped[datetime] = mapped_column(unique=True)
     title: Mapped[str]
     desc: Mapped[str | None]
+    content_hash: Mapped[str | None]
+    etag: Mapped[str | None]
+    fingerprint: Mapped[str | None] = mapped_column(index=True)
     
     episode: Mapped[Episode] = relationship(back_populates='spinitron_playlists')
     spins: Mapped[list[Spin]] = relationship(back_populates='playlist', cascade='all, delete')
 
     def getAirDate(self):
         return self.timeslot.strftime('%a %b %d %Y at %I:%M %p')
-    
- 
-Base.metadata.create_all(engine)
+
+
+class Checkpoint(Base):
+    """Resume position of a chunked job: the id of the last committed row."""
+    name: Mapped[str] = mapped_column(unique=True)
+    position: Mapped[int]
@@ -0,0 +1,126 @@
+"""Append-only archive of fetched pages for re-parsing without the network.
+
+The archive is a directory holding two files:
+
+    pages.dat  records of (header, url, zlib compressed body), appended only
+    pages.idx  fixed size entries (sha1 of url, sha1 of body, offset, length)
+               into pages.dat, read through mmap
+
+A body is only appended when it differs from the one last archived for its
+url, so re-fetching unchanged pages does not grow the archive.
+"""
+from hashlib import sha1
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+
+logger = logging.getLogger(__name__)
+
+HEADER = struct.Struct('<dII')  # fetched_at, url length, compressed body length
+ENTRY = struct.Struct('<20s20sQI')  # url hash, body hash, record offset, record length
+
+
+def urlKey(url):
+    return sha1(url.encode()).digest()
+
+
+class PageArchive:
+
+    def __init__(self, path, level=6):
+        self.path = path
+        self.level = level
+        self.lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+        self.data = open(os.path.join(path, 'pages.dat'), 'a+b')
+        self.index = open(os.path.join(path, 'pages.idx'), 'a+b')
+        self.entries = {}
+        self._loadIndex()
+
+    def _loadIndex(self):
+        """Map url hashes to their latest entry, dropping a torn last entry or
+        entries past the end of the data file left by an interrupted append."""
+        data_size = os.fstat(self.data.fileno()).st_size
+        size = os.fstat(self.index.fileno()).st_size
+        valid = size - size % ENTRY.size
+        if valid:
+            with mmap.mmap(self.index.fileno(), valid, access=mmap.ACCESS_READ) as m:
+                for i, (url_key, body_key, offset, length) in enumerate(ENTRY.iter_unpack(m)):
+                    if offset + length > data_size:
+                        valid = i * ENTRY.size
+                        break
+                    self.entries[url_key] = (body_key, offset, length)
+        if valid != size:
+            logger.warning(f'Truncating archive index {self.path} to {valid // ENTRY.size} entries')
+            self.index.truncate(valid)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, url):
+        return urlKey(url) in self.entries
+
+    def close(self):
+        self.data.close()
+        self.index.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, url, body, fetched_at=None):
+        """Archive body of url, returns False if it is already the latest one."""
+        url_key = urlKey(url)
+        raw = body.encode('utf-8')
+        body_key = sha1(raw).digest()
+        latest = self.entries.get(url_key)
+        if latest is not None and latest[0] == body_key:
+            return False
+        encoded_url = url.encode()
+        compressed = zlib.compress(raw, self.level)
+        record = HEADER.pack(fetched_at or time.time(), len(encoded_url), len(compressed))
+        record += encoded_url + compressed
+        with self.lock:
+            self.data.seek(0, os.SEEK_END)
+            offset = self.data.tell()
+            self.data.write(record)
+            self.data.flush()
+            self.index.write(ENTRY.pack(url_key, body_key, offset, len(record)))
+            self.index.flush()
+            self.entries[url_key] = (body_key, offset, len(record))
+        return True
+
+    def _read(self, offset, length, match=None):
+        """Read the record at offset, its body is only decompressed if match(url)."""
+        with self.lock:
+            self.data.seek(offset)
+            record = self.data.read(length)
+        fetched_at, url_len, body_len = HEADER.unpack_from(record)
+        url = record[HEADER.size:HEADER.size + url_len].decode()
+        if match is not None and not match(url):
+            return url, None, fetched_at
+        body = zlib.decompress(record[HEADER.size + url_len:]).decode('utf-8')
+        return url, body, fetched_at
+
+    def get(self, url):
+        """Latest archived body of url or None."""
+        entry = self.entries.get(urlKey(url))
+        if entry is None:
+            return None
+        return self._read(*entry[1:])[1]
+
+    def iter(self, match=None):
+        """Yield (url, body, fetched_at) of the latest body of every url
+        matching match(url), in the order they were archived."""
+        for _, offset, length in sorted(self.entries.values(), key=lambda e: e[1]):
+            url, body, fetched_at = self._read(offset, length, match)
+            if body is not None:
+                yield url, body, fetched_at
+
+    def __iter__(self):
+        return self.iter()
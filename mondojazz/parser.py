@@ -1,10 +1,21 @@
 from datetime import datetime
 import logging
+import os
 
 from bs4 import BeautifulSoup, SoupStrainer
 
+try:
+    from lxml import etree
+except ImportError:
+    etree = None
+
+from mondojazz import metrics
+
 logger = logging.getLogger(__name__)
 
+BACKENDS = ('lxml', 'bs4')
+BACKEND = os.getenv('MONDOJAZZ_PARSER', 'lxml' if etree is not None else 'bs4')
+
 def parseSpinTime(s):
     return datetime.strptime(s, '%I:%M %p').time()
 
@@ -13,19 +24,78 @@ def parseTimeslot(s):
     return datetime.strptime(s[:s.index('\xa0')], '%b %d, %Y %I:%M %p')
 
 
+class LxmlTag:
+    """Minimal BeautifulSoup Tag look-alike over an lxml element.
+
+    Supports just what the parseEl methods use: find, find_all,
+    attribute access, .text and first-descendant lookup like tag.a.
+    """
+    __slots__ = ('el',)
+
+    def __init__(self, el):
+        self.el = el
+
+    @staticmethod
+    def _matches(el, class_):
+        if class_ is None:
+            return True
+        cls = el.get('class')
+        if cls is None:
+            return False
+        if ' ' in class_:
+            return cls == class_
+        return class_ in cls.split()
+
+    def find_all(self, name, class_=None):
+        return [LxmlTag(el) for el in self.el.iter(name) if self._matches(el, class_)]
+
+    def find(self, name, class_=None):
+        for el in self.el.iter(name):
+            if self._matches(el, class_):
+                return LxmlTag(el)
+
+    def __getitem__(self, key):
+        return self.el.attrib[key]
+
+    def __getattr__(self, name):
+        return self.find(name)
+
+    @property
+    def text(self):
+        return ''.join(self.el.itertext(etree.Entity, etree.Element))
+
+
+def makeLxmlSoup(markup, container, container_id):
+    if hasattr(markup, 'read'):
+        markup = markup.read()
+    root = etree.fromstring(markup, etree.HTMLParser())
+    el = None
+    if root is not None:
+        el = root.find(f'.//{container}[@id="{container_id}"]')
+    return LxmlTag(el if el is not None else etree.Element(container))
+
+
 class Page:
     container = el = 'div'
 
-    def __init__(self, markup):
-        self.soup = BeautifulSoup(
-            markup,
-            'html.parser',
-            parse_only=SoupStrainer(self.container, id=self.container_id))
+    def __init__(self, markup, backend=None):
+        backend = backend or BACKEND
+        if backend not in BACKENDS:
+            raise ValueError(f'Unknown parser backend "{backend}", expected one of {BACKENDS}')
+        with metrics.timed('parse_seconds', page=type(self).__name__, step='tree'):
+            if backend == 'lxml':
+                self.soup = makeLxmlSoup(markup, self.container, self.container_id)
+            else:
+                self.soup = BeautifulSoup(
+                    markup,
+                    'html.parser',
+                    parse_only=SoupStrainer(self.container, id=self.container_id))
 
     def getItems(self):
-        return list(map(
-            self.parseEl,
-            self.soup.find_all(self.el, class_=self.el_class)))
+        with metrics.timed('parse_seconds', page=type(self).__name__, step='items'):
+            return list(map(
+                self.parseEl,
+                self.soup.find_all(self.el, class_=self.el_class)))
 
 
 class ShowPage(Page):
@@ -77,3 +147,7 @@ class PlaylistPage(Page):
         d['start_time'] = parseSpinTime(tag.find('td', class_='spin-time').a.text)
         return d
 
+
+def parsePlaylistMarkup(markup):
+    """Items of a playlist page, importable by process pool workers."""
+    return PlaylistPage(markup).getItems()
@@ -0,0 +1,343 @@
+"""Streaming scrape -> map -> publish pipeline.
+
+Stages run in their own threads and hand items over through bounded queues,
+so a new playlist is fetched, mapped and published as soon as it is found:
+
+    discover -> fetch (N) [-> parse (N)] -> match (N) -> write (1) -> publish (N)
+                                                          ^______________|
+
+With parse_workers, fetch threads only download and pages are parsed in a
+process pool, so parsing is not bound to the one core holding the GIL.
+
+Only the write stage, a mondojazz.writer.Writer, touches the database.
+Playlists matched while it is busy are written together in one transaction.
+A playlist whose page fails is not written and is fetched again next run.
+"""
+from collections import Counter
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+
+from sqlalchemy import select, update
+
+from mondojazz import Session, metrics
+from mondojazz.mapper import matchSpinToSpotify, search
+from mondojazz.mapper import updateEpisodes, selectEpisodes
+from mondojazz.mapper import makePublishJob, publishEpisode, storePublishResult
+from mondojazz.models import Episode, Song, Spin, SpinitronPlaylist
+from mondojazz.scraper import genPlaylists, fetchPlaylistPage
+from mondojazz.parser import parsePlaylistMarkup
+from mondojazz.scraper import fetchPlaylistMarkup, getParsePool
+from mondojazz.scraper import storeShowItems, storePlaylistSpins
+from mondojazz.writer import BATCH_SIZE, Writer
+
+logger = logging.getLogger(__name__)
+
+STOP = object()
+
+
+class Stage:
+    """Apply func to every item of inq in workers threads.
+
+    func returns an iterable of items put on outq. Once every worker has
+    seen STOP, a single STOP is passed on to outq.
+    """
+
+    def __init__(self, name, func, inq, outq, workers=1):
+        self.name = name
+        self.func = func
+        self.inq = inq
+        self.outq = outq
+        self.running = workers
+        self.lock = threading.Lock()
+        self.threads = [
+            threading.Thread(target=self._run, name=f'{name}-{i}', daemon=True)
+            for i in range(workers)]
+
+    def start(self):
+        for t in self.threads:
+            t.start()
+        return self
+
+    def _run(self):
+        while True:
+            item = self.inq.get()
+            if item is STOP:
+                self.inq.put(STOP)
+                with self.lock:
+                    self.running -= 1
+                    if self.running == 0:
+                        self.outq.put(STOP)
+                return
+            try:
+                with metrics.timed('stage_seconds', stage=self.name):
+                    out = list(self.func(item))
+                for o in out:
+                    self.outq.put(o)
+            except Exception:
+                logger.exception(f'Stage {self.name} failed on {item}')
+
+
+class Pipeline:
+
+    def __init__(self, fetch_workers=4, match_workers=4, publish_workers=2,
+                 queue_size=16, publish=False, parse_workers=0, write_batch=BATCH_SIZE):
+        self.fetch_workers = fetch_workers
+        self.parse_workers = parse_workers
+        self.match_workers = match_workers
+        self.publish_workers = publish_workers
+        self.queue_size = queue_size
+        self.write_batch = write_batch
+        self.publish = publish
+        self.stats = Counter()
+        self.discovered = []
+        self.written = set()
+        self.assigned = 0
+        # songs added to the indexes in the running write transaction
+        self.pending = []
+        # (title, artist) -> Future of the Song matched by a match worker
+        self.matching = {}
+        self.matching_lock = threading.Lock()
+
+    def discover(self, outq):
+        """Queue the playlists aired after the latest clustered one whose spins
+        are not stored, oldest first.
+
+        Playlists stored with their spins by an earlier run, e.g. around one
+        that failed to fetch, are not fetched again but count as written, so
+        episodes keep being numbered in air order.
+        """
+        with Session() as session:
+            latest = session.scalars(
+                    select(SpinitronPlaylist)
+                    .where(SpinitronPlaylist.episode_id != None)
+                    .order_by(SpinitronPlaylist.timeslot.desc())
+                ).first()
+            latest = latest and (latest.spinitron_id, latest.timeslot)
+            stored = set(session.scalars(
+                    select(SpinitronPlaylist.spinitron_id)
+                    .where(SpinitronPlaylist.content_hash != None)))
+        items = []
+        try:
+            for pl in genPlaylists():
+                if latest and (pl['timeslot'] <= latest[1] or pl['spinitron_id'] == latest[0]):
+                    logger.info(f'Reached latest clustered playlist {latest[0]}')
+                    break
+                items.append(pl)
+        except Exception:
+            logger.exception('Discovering playlists failed')
+        items.reverse()
+        todo = [pl for pl in items if pl['spinitron_id'] not in stored]
+        self.written.update(pl['spinitron_id'] for pl in items if pl['spinitron_id'] in stored)
+        self.discovered = items
+        self.stats['discovered'] = len(todo)
+        logger.info(f'Discovered {len(todo)} playlists to fetch, {len(items) - len(todo)} stored already')
+        for pl in todo:
+            outq.put(pl)
+        outq.put(STOP)
+
+    def fetch(self, pl):
+        """Yield (pl, spins or markup with parse_workers, etag), None instead of
+        spins or markup if the page could not be fetched."""
+        fetch = fetchPlaylistMarkup if self.parse_workers else fetchPlaylistPage
+        try:
+            page, etag = fetch(pl['spinitron_id'])
+        except Exception as e:
+            logger.error(f'Fetching playlist {pl["spinitron_id"]} failed:\n\t{e}')
+            page, etag = None, None
+        yield pl, page, etag
+
+    def parse(self, item):
+        pl, markup, etag = item
+        spins = None
+        if markup is not None:
+            try:
+                spins = self.parse_pool.submit(parsePlaylistMarkup, markup).result()
+            except Exception as e:
+                logger.error(f'Parsing playlist {pl["spinitron_id"]} failed:\n\t{e}')
+        yield pl, spins, etag
+
+    def match(self, item):
+        pl, spins, etag = item
+        if spins is None:
+            # not written, the next run fetches it again
+            logger.warning(f'Skipping playlist {pl["spinitron_id"]}, its page failed')
+            return
+        songs = {}
+        for spin in spins:
+            key = (spin['title'], spin['artist'])
+            if key in self.by_key or key in songs:
+                continue
+            song = self.matchOnce(key, spin)
+            if song is not None:
+                songs[key] = song
+        yield 'playlist', (pl, spins, etag, songs)
+
+    def matchOnce(self, key, spin):
+        """Song matched for key, searched by the first worker asking for it
+        while the others wait for its result. None if the search failed, the
+        next playlist with key searches again."""
+        with self.matching_lock:
+            future = self.matching.get(key)
+            searching = future is None
+            if searching:
+                future = self.matching[key] = Future()
+        if searching:
+            try:
+                future.set_result(matchSpinToSpotify(Spin(**spin)))
+            except Exception as e:
+                logger.error(f'Spotify error while querying {spin}\n{e}')
+                with self.matching_lock:
+                    del self.matching[key]
+                future.set_result(None)
+        return future.result()
+
+    def loadSongIndex(self):
+        self.by_key = {}
+        self.by_spotify_id = {}
+        with Session() as session:
+            for id_, title, artist, spotify_id in session.execute(
+                    select(Song.id, Song.title, Song.artist, Song.spotify_id)):
+                self.by_key[(title, artist)] = id_
+                if spotify_id:
+                    self.by_spotify_id[spotify_id] = id_
+
+    def mapPlaylistSpins(self, stpl, songs, session):
+        updates = []
+        for id_, title, artist in session.execute(
+                select(Spin.id, Spin.title, Spin.artist)
+                .where(Spin.playlist_id == stpl.id, Spin.song_id == None)):
+            key = (title, artist)
+            song_id = self.by_key.get(key)
+            if song_id is None:
+                song = songs.get(key)
+                if song is None:
+                    continue
+                song_id = self.by_spotify_id.get(song.spotify_id)
+                if song_id is None:
+                    session.add(song)
+                    session.flush()
+                    song_id = song.id
+                    if song.spotify_id:
+                        self.by_spotify_id[song.spotify_id] = song_id
+                        self.pending.append((self.by_spotify_id, song.spotify_id))
+                self.by_key[key] = song_id
+                self.pending.append((self.by_key, key))
+            updates.append({'id': id_, 'song_id': song_id})
+        if updates:
+            session.execute(update(Spin), updates)
+
+    def writePlaylist(self, session, pl, spins, etag, songs):
+        storeShowItems([pl], session)
+        stpl = session.scalars(
+                select(SpinitronPlaylist)
+                .where(SpinitronPlaylist.spinitron_id == pl['spinitron_id'])
+            ).one()
+        storePlaylistSpins(stpl, spins, session, etag)
+        self.mapPlaylistSpins(stpl, songs, session)
+        return 'written', pl['spinitron_id']
+
+    def committed(self, results):
+        """Writer callback: cluster and queue publishing of what was committed."""
+        self.stats['songs'] += sum(index is self.by_key for index, _ in self.pending)
+        self.pending.clear()
+        written = False
+        for kind, key in filter(None, results):
+            self.stats[kind] += 1
+            if kind == 'written':
+                self.written.add(key)
+                written = True
+        if written:
+            numbers = self.assignEpisodes()
+            if self.publish:
+                self.queueJobs(numbers, self.publishq)
+
+    def rolledBack(self):
+        """Writer callback: forget the song ids of a rolled back transaction."""
+        for index, key in self.pending:
+            index.pop(key, None)
+        self.pending.clear()
+
+    def assignEpisodes(self):
+        """Cluster the written playlists not preceded by a missing one, so
+        episode numbers follow air order even though playlists arrive out of order."""
+        start = self.assigned
+        while (self.assigned < len(self.discovered)
+               and self.discovered[self.assigned]['spinitron_id'] in self.written):
+            self.assigned += 1
+        if self.assigned == start:
+            return []
+        numbers = updateEpisodes(until=self.discovered[self.assigned - 1]['timeslot'])
+        self.stats['episodes'] += len(numbers)
+        return numbers
+
+    def queueJobs(self, numbers, publishq):
+        if not numbers:
+            return 0
+        count = 0
+        with Session() as session:
+            for ep in session.scalars(selectEpisodes().where(Episode.number.in_(numbers))):
+                job = makePublishJob(ep)
+                if job:
+                    publishq.put(job)
+                    count += 1
+        return count
+
+    def writePublished(self, session, job, result):
+        ep = session.scalars(
+                selectEpisodes().where(Episode.number == job['episode'])
+            ).one()
+        storePublishResult(ep, job, result, session)
+        return 'published' if not result['error'] else 'publish_failed', job['episode']
+
+    def run(self):
+        """Run all stages to completion, returns a Counter of processed items."""
+        self.loadSongIndex()
+        playlistq = queue.Queue(self.queue_size)
+        pageq = queue.Queue(self.queue_size)
+        writeq = queue.Queue(self.queue_size)
+        # unbounded: the writer must never block on the stage feeding it back
+        publishq = self.publishq = queue.Queue()
+        writer = Writer(self.write_batch, on_commit=self.committed, on_rollback=self.rolledBack)
+        writer.start()
+
+        threading.Thread(target=self.discover, args=(playlistq,), name='discover', daemon=True).start()
+        if self.parse_workers:
+            self.parse_pool = getParsePool(self.parse_workers)
+            markupq = queue.Queue(self.queue_size)
+            Stage('fetch', self.fetch, playlistq, markupq, self.fetch_workers).start()
+            Stage('parse', self.parse, markupq, pageq, self.parse_workers).start()
+        else:
+            Stage('fetch', self.fetch, playlistq, pageq, self.fetch_workers).start()
+        Stage('match', self.match, pageq, writeq, self.match_workers).start()
+        if self.publish:
+            Stage('publish',
+                  lambda job: [('published', (job, publishEpisode(job)))],
+                  publishq, writeq, self.publish_workers).start()
+
+        stops = 2 if self.publish else 1
+        playlists_done = False
+        while stops:
+            item = writeq.get()
+            if item is STOP:
+                stops -= 1
+                if not playlists_done:
+                    playlists_done = True
+                    writer.flush()
+                    # when every playlist was stored already nothing got clustered yet
+                    numbers = self.assignEpisodes()
+                    if self.publish:
+                        # the last playlists written may still queue publish jobs
+                        self.queueJobs(numbers, publishq)
+                        publishq.put(STOP)
+                continue
+            kind, payload = item
+            writer.submit(self.writePlaylist if kind == 'playlist' else self.writePublished, *payload)
+        writer.close()
+
+        if self.assigned < len(self.discovered):
+            logger.warning(f'{len(self.discovered) - self.assigned} playlists were not '
+                           f'clustered, run the episodes command once they are stored')
+        logger.info(f'Pipeline done: {dict(self.stats)}, search cache: {search.stats()}')
+        return self.stats
@@ -1,48 +1,310 @@
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from hashlib import sha1
+from itertools import islice
+import atexit
 import logging
+import multiprocessing
+import os
+import re
+import threading
+from urllib.parse import urlsplit
 
 import requests
-from sqlalchemy import select
+from requests.adapters import HTTPAdapter
+from sqlalchemy import delete, select, update
 from sqlalchemy.exc import DBAPIError
 
-from mondojazz import Session
+from mondojazz import Session, metrics
+from mondojazz.bulk import insertIgnore
+from mondojazz.checkpoint import iterChunks
+from mondojazz.httpcache import HttpCache
+from mondojazz.pagearchive import PageArchive
 from mondojazz.models import SpinitronPlaylist, Spin
-from mondojazz.parser import ShowPage, PlaylistPage
+from mondojazz.parser import ShowPage, parsePlaylistMarkup
 
 logger = logging.getLogger(__name__)
 
-SHOW_URL = 'https://spinitron.com/RFB/show/103797/Mondo-Jazz'
-PLAYLIST_FMT = 'https://spinitron.com/RFB/pl/{}/Mondo-Jazz'
+SPINITRON_URL = os.getenv('SPINITRON_URL', 'https://spinitron.com')
+SHOW_PATH = '/RFB/show/103797/Mondo-Jazz'
+PLAYLIST_PATH = '/RFB/pl/{}/Mondo-Jazz'
+PLAYLIST_RE = re.compile(r'/RFB/pl/(\d+)/')
+
+MAX_WORKERS = int(os.getenv('SCRAPER_MAX_WORKERS', 8))
+# show pages fetched ahead of the one being processed
+READ_AHEAD = int(os.getenv('SCRAPER_READ_AHEAD', 0))
+# processes parsing playlist pages, 0 parses in the fetching threads
+PARSE_WORKERS = int(os.getenv('SCRAPER_PARSE_WORKERS', 0))
+
+# seconds a cached page is served without revalidation
+SHOW_TTL = 60 * 60
+PLAYLIST_TTL = 30 * 24 * 60 * 60
+
+
+def recordResponse(r, *args, **kwargs):
+    if not metrics.enabled:
+        return
+    endpoint = 'show' if r.url.startswith(SHOW_URL) else 'playlist'
+    metrics.inc('http_requests_total', endpoint=endpoint, status=r.status_code)
+    metrics.inc('http_bytes_total', len(r.content), endpoint=endpoint)
+    metrics.observe('http_request_seconds', r.elapsed.total_seconds(), endpoint=endpoint)
+
+
+def makeHttpSession(pool_size=MAX_WORKERS):
+    s = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+    s.mount('https://', adapter)
+    s.mount('http://', adapter)
+    s.hooks['response'].append(recordResponse)
+    return s
+
+
+def setBaseUrl(url):
+    """Scrape from another Spinitron host, e.g. a local stand-in."""
+    global SPINITRON_URL, SHOW_URL, PLAYLIST_FMT
+    SPINITRON_URL = url.rstrip('/')
+    SHOW_URL = SPINITRON_URL + SHOW_PATH
+    PLAYLIST_FMT = SPINITRON_URL + PLAYLIST_PATH
+
+
+setBaseUrl(SPINITRON_URL)
+http = makeHttpSession()
+cache = None
+
+
+def setCache(path, offline=False):
+    global cache
+    if offline and not path:
+        raise ValueError('Offline mode needs a cache, set SCRAPER_CACHE_DIR')
+    cache = HttpCache(path, http, offline) if path else None
+
+
+setCache(os.getenv('SCRAPER_CACHE_DIR'), bool(os.getenv('SCRAPER_OFFLINE')))
+archive = None
+
+
+def setArchive(path):
+    """Append every page fetched from now on to the PageArchive at path."""
+    global archive
+    if archive is not None:
+        archive.close()
+    archive = PageArchive(path) if path else None
+
+
+setArchive(os.getenv('SCRAPER_ARCHIVE'))
+
+
+def fetch(url, params=None, ttl=0):
+    return fetchWithEtag(url, params, ttl)[0]
+
+
+def fetchWithEtag(url, params=None, ttl=0):
+    if cache:
+        text, etag = cache.fetch(url, params, ttl)
+    else:
+        r = http.get(url, params=params)
+        r.raise_for_status()
+        text, etag = r.text, r.headers.get('ETag')
+    if archive is not None:
+        archive.append(requests.Request('GET', url, params=params).prepare().url, text)
+    return text, etag
+
 
 def parseShowPage(page=None):
     params = {}
     if page is not None:
         params['page'] = page
-    r = requests.get(SHOW_URL, params=params)
-    sp = ShowPage(r.text)
+    sp = ShowPage(fetch(SHOW_URL, params, SHOW_TTL))
     page = sp.getNextPageNum()
     return sp.getItems(), page
 
 
 def parsePlaylistPage(pl_id):
-    r = requests.get(PLAYLIST_FMT.format(pl_id))
-    plp = PlaylistPage(r.text)
-    return plp.getItems()
+    return fetchPlaylistPage(pl_id)[0]
+
+
+def fetchPlaylistMarkup(pl_id):
+    return fetchWithEtag(PLAYLIST_FMT.format(pl_id), ttl=PLAYLIST_TTL)
+
+
+def fetchPlaylistPage(pl_id):
+    markup, etag = fetchPlaylistMarkup(pl_id)
+    return parsePlaylistMarkup(markup), etag
+
+
+_parse_pool = None
+_parse_pool_workers = 0
+_parse_pool_lock = threading.Lock()
+
+
+def getParsePool(workers=None):
+    """Process pool shared by every caller, (re)created with workers processes.
+
+    Workers are spawned rather than forked, forking a process running fetch
+    threads could copy locks held by them.
+    """
+    global _parse_pool, _parse_pool_workers
+    workers = workers or PARSE_WORKERS or os.cpu_count()
+    with _parse_pool_lock:
+        if _parse_pool is None or _parse_pool_workers != workers:
+            if _parse_pool is not None:
+                _parse_pool.shutdown()
+            _parse_pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'))
+            _parse_pool_workers = workers
+        return _parse_pool
+
+
+@atexit.register
+def shutdownParsePool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(cancel_futures=True)
+        _parse_pool = None
+
+
+def fetchPlaylistPages(pl_ids, max_workers=MAX_WORKERS, parse_workers=None):
+    """Download and parse playlist pages with at most max_workers requests in flight.
+
+    With parse_workers, pages are parsed in that many processes while the
+    threads go on fetching, at most twice as many pages as processes waiting
+    to be parsed.
+    Yields (pl_id, (items, etag)) in completion order, None instead of
+    (items, etag) if the page failed.
+    """
+    if parse_workers is None:
+        parse_workers = PARSE_WORKERS
+    parse_pool = getParsePool(parse_workers) if parse_workers else None
+    pl_ids = iter(pl_ids)
+    with ThreadPoolExecutor(max_workers) as pool:
+        fetching = {}
+        parsing = {}
+
+        def submit():
+            if parse_pool and len(parsing) >= 2 * parse_workers:
+                return
+            for pl_id in pl_ids:
+                f = pool.submit(fetchPlaylistMarkup if parse_pool else fetchPlaylistPage, pl_id)
+                fetching[f] = pl_id
+                if len(fetching) >= max_workers:
+                    break
+
+        submit()
+        while fetching or parsing:
+            done, _ = wait([*fetching, *parsing], return_when=FIRST_COMPLETED)
+            for f in done:
+                if f in parsing:
+                    pl_id, etag = parsing.pop(f)
+                    try:
+                        yield pl_id, (f.result(), etag)
+                    except Exception as e:
+                        logger.error(f'Parsing playlist {pl_id} failed:\n\t{e}')
+                        yield pl_id, None
+                    continue
+                pl_id = fetching.pop(f)
+                try:
+                    result = f.result()
+                except Exception as e:
+                    # without parse_pool this is the parse too
+                    logger.error(f'Fetching playlist {pl_id} failed:\n\t{e}')
+                    yield pl_id, None
+                    continue
+                if parse_pool:
+                    markup, etag = result
+                    parsing[parse_pool.submit(parsePlaylistMarkup, markup)] = pl_id, etag
+                else:
+                    yield pl_id, result
+            submit()
+
 
+def genShowPages(page=1, read_ahead=None, last_page=0):
+    """Yield (page, items) of every show page from page on, up to last_page if given.
 
-def scrapeShowPages(page=1, last_page=0):
+    With read_ahead the following read_ahead pages are fetched while the
+    current one is processed. Speculative requests are cancelled once a page
+    has no next page or the caller stops iterating.
+    """
+    if read_ahead is None:
+        read_ahead = READ_AHEAD
+    def in_range(p):
+        return p and (not last_page or p <= last_page)
+
+    if not read_ahead:
+        while in_range(page):
+            items, next_page = parseShowPage(page)
+            yield page, items
+            page = next_page
+        return
+
+    pool = ThreadPoolExecutor(read_ahead + 1)
+    pending = {}
+    try:
+        while in_range(page):
+            for p in range(page, page + read_ahead + 1):
+                if p not in pending and in_range(p):
+                    pending[p] = pool.submit(parseShowPage, p)
+            items, next_page = pending.pop(page).result()
+            yield page, items
+            page = next_page
+            for p in [p for p in pending if not page or p < page]:
+                pending.pop(p).cancel()
+    finally:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
+def findBoundaryPage(timeslot, first=1):
+    """First show page from first on holding a playlist aired at or before
+    timeslot, or the last page if there is none.
+
+    Pages are probed at exponentially growing distances until one is old
+    enough, then the boundary is bisected, taking O(log n) requests instead
+    of walking every page.
+    """
+    probed = {}
+
+    def reached(p):
+        if p not in probed:
+            items, next_page = parseShowPage(p)
+            probed[p] = (not items or next_page is None
+                         or min(pl['timeslot'] for pl in items) <= timeslot)
+        return probed[p]
+
+    lo, hi, step = first - 1, first, 1
+    while not reached(hi):
+        lo, hi, step = hi, hi + step, step * 2
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if reached(mid):
+            hi = mid
+        else:
+            lo = mid
+    logger.info(f'Found boundary page={hi} for {timeslot.isoformat()} with {len(probed)} requests')
+    return hi
+
+
+def scrapeShowPages(page=1, last_page=0, read_ahead=None):
     if not last_page:
         logger.info(f'Scraping all pages starting from page={page}')
     else:
         logger.info(f'Scraping pages [{page}...{last_page}]')
     with Session() as session, session.begin():
-        while page and (not last_page or page <= last_page):
-            page = scrapeSingleShowPage(page, session)
+        for page, items in genShowPages(page, read_ahead, last_page):
+            logger.info(f'Parsed page={page}, got {len(items)} items')
+            storeShowItems(items, session)
 
 
 def scrapeSingleShowPage(page, session, skip=True):
     logger.info(f'Parsing page={page}')
     items, page = parseShowPage(page)
     logger.debug(f'Got {len(items)} items, next page={page}')
+    storeShowItems(items, session, skip)
+    return page
+
+
+def storeShowItems(items, session, skip=True):
+    if skip:
+        inserted, skipped = insertIgnore(session, SpinitronPlaylist, items)
+        logger.info(f'Stored {inserted} playlists, skipped {skipped} already stored')
+        return inserted, skipped
     for pl in items:
         logger.debug(f'Parsed item:\n\t{pl}')
         try: 
@@ -52,47 +314,179 @@ def scrapeSingleShowPage(page, session, skip=True):
             logger.debug(f'Added object:\n\t{o}')
         except DBAPIError as e:
             logger.error(f'Item:\n\t{pl}\n\tCaused Exception:\n\t{e}')
-            if not skip:
-                raise e
-    return page
+            raise e
+    return len(items), 0
 
 
 def scrapePlaylistSpins(stpl, session):
     logger.info(f'Parsing spins from {stpl.spinitron_id}')
-    spins = parsePlaylistPage(stpl.spinitron_id)
-    if len(spins) == len(stpl.spins):
-        logger.warning(f'Already got {len(spins)} spins, skipping {stpl}')
-        return
+    spins, etag = fetchPlaylistPage(stpl.spinitron_id)
+    return storePlaylistSpins(stpl, spins, session, etag)
+
+
+SPIN_FIELDS = ('artist', 'title', 'album', 'year', 'start_time', 'number')
+
+
+def spinsHash(spins):
+    h = sha1()
     for i, spin in enumerate(spins):
-        o = Spin(number=i, **spin)
-        try: 
-            with session.begin_nested() as sp:
-                stpl.spins.append(o)
-        except DBAPIError as e:
-            logger.error(f'Spin:\n\t{spin}\n\tCaused Exception:\n\t{e}')
+        h.update(repr((spin['spinitron_id'], spin['artist'], spin['title'], spin['album'],
+                       spin['year'], spin['start_time'].isoformat(), i)).encode())
+    return h.hexdigest()
+
+
+def storePlaylistSpins(stpl, spins, session, etag=None):
+    """Bring the stored spins of stpl in line with the parsed spins.
+
+    Unchanged playlists (same ETag or same content hash) are skipped without
+    reading the spin table, changed ones get a diff by spinitron_id applied:
+    new spins are inserted, edited ones updated and vanished ones deleted.
+    Spins whose title or artist changed lose their song. A page without
+    spins, like an error page, leaves the stored spins alone.
+    Returns (inserted, updated, deleted).
+    """
+    if not spins:
+        logger.warning(f'No spins parsed for {stpl}, keeping the stored ones')
+        return 0, 0, 0
+    if stpl.content_hash and etag and etag == stpl.etag:
+        logger.debug(f'ETag unchanged, skipping {stpl}')
+        return 0, 0, 0
+    content_hash = spinsHash(spins)
+    stpl.etag = etag
+    if content_hash == stpl.content_hash:
+        logger.debug(f'Spins unchanged, skipping {stpl}')
+        return 0, 0, 0
+    is_new = stpl.id is None
+    if is_new:
+        session.flush()
+    rows = {spin['spinitron_id']: dict(spin, number=i, playlist_id=stpl.id)
+            for i, spin in enumerate(spins)}
+    stored = {
+        row.spinitron_id: row
+        for row in session.execute(
+            select(Spin.id, Spin.spinitron_id, Spin.song_id, *(getattr(Spin, f) for f in SPIN_FIELDS))
+            .where(Spin.playlist_id == stpl.id))
+    } if not is_new else {}
+
+    new = [row for sid, row in rows.items() if sid not in stored]
+    changed = [
+        dict({f: row[f] for f in SPIN_FIELDS}, id=stored[sid].id,
+             song_id=stored[sid].song_id if (stored[sid].title, stored[sid].artist)
+             == (row['title'], row['artist']) else None)
+        for sid, row in rows.items()
+        if sid in stored and any(getattr(stored[sid], f) != row[f] for f in SPIN_FIELDS)
+    ]
+    gone = [row.id for sid, row in stored.items() if sid not in rows]
+
+    inserted, skipped = insertIgnore(session, Spin, new)
+    if skipped:
+        logger.warning(f'{skipped} spins of {stpl.spinitron_id} already belong to another playlist')
+    if changed:
+        session.execute(update(Spin), changed)
+    if gone:
+        session.execute(delete(Spin).where(Spin.id.in_(gone)))
+    stpl.content_hash = content_hash
+    stpl.fingerprint = None
+    session.expire(stpl, ['spins'])
+    logger.info(f'Spins of {stpl.spinitron_id}: {inserted} new, {len(changed)} updated, {len(gone)} deleted')
+    return inserted, len(changed), len(gone)
 
 
-def scrapeAllSpins():
+def scrapeAllSpins(max_workers=None, parse_workers=None, chunk_size=None, resume=False):
+    """Scrape spins of every stored playlist.
+
+    With max_workers pages are fetched concurrently and with parse_workers
+    parsed in as many processes, writes stay in this thread.
+    With chunk_size playlists are committed chunk_size at a time and with
+    resume an interrupted chunked run picks up after its last commit.
+    """
+    if chunk_size:
+        for session, stpls in iterChunks('scrapeAllSpins', SpinitronPlaylist,
+                                         chunk_size=chunk_size, resume=resume):
+            scrapeSpinsOf(stpls, session, max_workers, parse_workers)
+        return
     with Session() as session, session.begin():
         stpls = session.scalars(select(SpinitronPlaylist)).all()
+        scrapeSpinsOf(stpls, session, max_workers, parse_workers)
+
+
+def scrapeSpinsOf(stpls, session, max_workers=None, parse_workers=None):
+    if not max_workers and not parse_workers:
         for stpl in stpls:
-            scrapePlaylistSpins(stpl, session)
+            try:
+                scrapePlaylistSpins(stpl, session)
+            except requests.RequestException as e:
+                logger.error(f'Fetching playlist {stpl.spinitron_id} failed:\n\t{e}')
+        return
+    by_id = {stpl.spinitron_id: stpl for stpl in stpls}
+    for pl_id, page in fetchPlaylistPages(by_id, max_workers or MAX_WORKERS, parse_workers):
+        if page is not None:
+            logger.info(f'Storing spins from {pl_id}')
+            spins, etag = page
+            storePlaylistSpins(by_id[pl_id], spins, session, etag)
+
+
+def batched(iterable, n):
+    it = iter(iterable)
+    while batch := list(islice(it, n)):
+        yield batch
+
+
+def reparseArchive(parse_workers=None, batch_size=64):
+    """Re-extract playlists and spins from the archived pages, without the network.
 
-def genPlaylists(page=1):
-    while page:
-        items, page = parseShowPage(page)
+    Show pages go first so every archived playlist is stored, then the spins
+    of every archived playlist page are parsed, in parse_workers processes if
+    given, and stored with storePlaylistSpins, which leaves playlists whose
+    spins parse the same as before alone.
+    Returns a Counter of playlists added and spins inserted, updated and deleted.
+    """
+    if archive is None:
+        raise ValueError('No page archive, set one with setArchive() or SCRAPER_ARCHIVE')
+    pool = getParsePool(parse_workers) if parse_workers else None
+    stats = Counter()
+    with Session() as session, session.begin():
+        for url, body, _ in archive.iter(lambda url: urlsplit(url).path == SHOW_PATH):
+            stats['playlists'] += storeShowItems(ShowPage(body).getItems(), session)[0]
+
+        by_id = {stpl.spinitron_id: stpl for stpl in session.scalars(select(SpinitronPlaylist))}
+        pages = ((int(PLAYLIST_RE.search(url).group(1)), body)
+                 for url, body, _ in archive.iter(PLAYLIST_RE.search))
+        for batch in batched(pages, batch_size):
+            bodies = [body for _, body in batch]
+            parsed = pool.map(parsePlaylistMarkup, bodies) if pool else map(parsePlaylistMarkup, bodies)
+            for (pl_id, _), spins in zip(batch, parsed):
+                stpl = by_id.get(pl_id)
+                if stpl is None:
+                    logger.warning(f'Archived playlist {pl_id} is not stored, skipping')
+                    continue
+                inserted, updated, deleted = storePlaylistSpins(stpl, spins, session)
+                stats.update(inserted=inserted, updated=updated, deleted=deleted)
+            stats['pages'] += len(batch)
+    logger.info(f'Reparsed archive: {dict(stats)}')
+    return stats
+
+
+def genPlaylists(page=1, read_ahead=None, last_page=0):
+    for _, items in genShowPages(page, read_ahead, last_page):
         yield from items
 
 
-def scrapeLatest():
+def scrapeLatest(read_ahead=None, find_boundary=False):
+    """Store playlists newer than the latest stored one, with their spins.
+
+    With find_boundary the last show page to scrape is bisected first, so
+    read-ahead never fetches past it.
+    """
     with Session() as session, session.begin():
         latest = session.scalars(
                 select(SpinitronPlaylist)
                 .order_by(SpinitronPlaylist.timeslot.desc())
             ).first()
+        last_page = findBoundaryPage(latest.timeslot) if latest and find_boundary else 0
         count = 0
-        for pl in genPlaylists():
-            if pl['timeslot'] <= latest.timeslot or pl['spinitron_id'] == latest.spinitron_id:
+        for pl in genPlaylists(read_ahead=read_ahead, last_page=last_page):
+            if latest and (pl['timeslot'] <= latest.timeslot or pl['spinitron_id'] == latest.spinitron_id):
                 logger.info(f'Reached {latest} from {latest.timeslot.isoformat()}, aborting')
                 break
             stpl = SpinitronPlaylist(**pl)
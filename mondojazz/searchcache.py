@@ -0,0 +1,108 @@
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import unicodedata
+
+from mondojazz import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def normalizeQuery(hints):
+    """Canonical string for a search_track hints dict.
+
+    Keys are sorted, values casefolded, NFC normalized and whitespace collapsed,
+    so queries differing only in case or spacing share a cache entry.
+    """
+    norm = {
+        k: ' '.join(unicodedata.normalize('NFC', str(v)).casefold().split())
+        for k, v in hints.items()
+    }
+    return json.dumps(norm, sort_keys=True, ensure_ascii=False)
+
+
+class SearchCache:
+    """Persistent cache in front of SpotifyClient.search_track.
+
+    Results, including empty ones, are kept in a separate SQLite file so the
+    cache never competes for locks with the main database. Entries older than
+    max_age seconds are refreshed, max_age=None keeps them forever.
+    """
+
+    ENV_PATH = 'SPOTIFY_CACHE'
+    ENV_MAX_AGE = 'SPOTIFY_CACHE_MAX_AGE'
+
+    def __init__(self, client, path=None, max_age=None):
+        self.client = client
+        self.path = path or os.getenv(self.ENV_PATH, 'spotify_cache.db')
+        if max_age is None and os.getenv(self.ENV_MAX_AGE):
+            max_age = float(os.getenv(self.ENV_MAX_AGE))
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.RLock()
+        self._db = None
+
+    @property
+    def db(self):
+        """Connection to the cache file, opened on first use."""
+        with self.lock:
+            if self._db is None:
+                self._db = sqlite3.connect(self.path, check_same_thread=False)
+                self._db.execute(
+                    'CREATE TABLE IF NOT EXISTS search ('
+                    ' query TEXT PRIMARY KEY,'
+                    ' results TEXT NOT NULL,'
+                    ' fetched_at REAL NOT NULL)')
+                self._db.commit()
+            return self._db
+
+    def get(self, key):
+        with self.lock:
+            row = self.db.execute(
+                'SELECT results, fetched_at FROM search WHERE query = ?', (key,)
+            ).fetchone()
+        if row is None:
+            return None
+        results, fetched_at = row
+        if self.max_age is not None and time.time() - fetched_at > self.max_age:
+            return None
+        return json.loads(results)
+
+    def put(self, key, results):
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO search (query, results, fetched_at) VALUES (?, ?, ?)',
+                (key, json.dumps(results), time.time()))
+
+    def search_track(self, hints):
+        key = normalizeQuery(hints)
+        results = self.get(key)
+        with self.lock:
+            if results is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if results is not None:
+            logger.debug(f'Search cache hit {key}')
+            metrics.inc('cache_requests_total', cache='spotify_search', result='hit')
+            return results
+        metrics.inc('cache_requests_total', cache='spotify_search', result='miss')
+        results = self.client.search_track(dict(hints))
+        self.put(key, results)
+        return results
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def clear(self):
+        with self.lock, self.db:
+            self.db.execute('DELETE FROM search')
@@ -1,11 +1,20 @@
 from base64 import b64encode
+from concurrent.futures import ThreadPoolExecutor
 from http.server import HTTPServer, BaseHTTPRequestHandler
 import json
+import logging
 import os
+import threading
+import time
+import urllib.error
 import urllib.parse
 import urllib.request
 import webbrowser
 
+from mondojazz import metrics
+
+logger = logging.getLogger(__name__)
+
 def get_handler(callback):
     class Handler(BaseHTTPRequestHandler):
         def do_GET(self):
@@ -14,33 +23,92 @@ def get_handler(callback):
             self.end_headers()
     return Handler
 
-def api(endpoint):
+def chunks(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+API_URL = 'https://api.spotify.com/v1'
+ACCOUNTS_URL = 'https://accounts.spotify.com'
+
+
+def api(endpoint, base=API_URL):
     if endpoint[0] == '/':
         endpoint = endpoint[1:]
-    return f'https://api.spotify.com/v1/{endpoint}'
+    return f'{base}/{endpoint}'
 
-class AuthHandler(urllib.request.BaseHandler):
 
-    TOKEN_ENDPOINT = 'https://accounts.spotify.com/api/token'
+ENDPOINT_WORDS = {'v1', 'me', 'search', 'users', 'playlists', 'tracks', 'albums', 'artists'}
+
+
+def endpoint_label(url):
+    """Path of url with ids replaced by {id}, e.g. /v1/playlists/{id}/tracks."""
+    path = urllib.parse.urlsplit(url).path
+    return '/'.join(p if not p or p in ENDPOINT_WORDS else '{id}' for p in path.split('/'))
+
+class TokenBucket:
+    """Thread-safe token bucket allowing rate requests per second with bursts up to burst."""
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def pause(self, seconds):
+        """Hold back every caller for seconds, e.g. after a 429."""
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                if now >= self.paused_until:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+                else:
+                    self.updated = self.paused_until
+                    wait = self.paused_until - now
+            time.sleep(wait)
+
+
+class AuthHandler(urllib.request.BaseHandler):
 
-    def __init__(self, client_id, client_secret, access_token, refresh_token):
+    def __init__(self, client_id, client_secret, access_token, refresh_token,
+                 accounts_url=ACCOUNTS_URL):
+        self.token_endpoint = f'{accounts_url}/api/token'
         self.basic_auth_header = 'Basic ' + b64encode(f'{client_id}:{client_secret}'.encode()).decode()
         self.bearer_auth_header = 'Bearer ' + access_token
         self.refresh_token = refresh_token
+        self.lock = threading.Lock()
 
     def https_request(self, req):
         if not req.has_header('Authorization'):
             req.add_header('Authorization', self.bearer_auth_header)
         return req
 
+    http_request = https_request
+
     def http_error_401(self, req, fp, code, msg, hdrs):
-        self._refresh_token()
+        used = req.get_header('Authorization')
+        with self.lock:
+            # another thread may have refreshed while this request was in flight
+            if used == self.bearer_auth_header:
+                self._refresh_token()
         req.remove_header('Authorization')
         return self.parent.open(req)
 
     def _refresh_token(self):
         req = urllib.request.Request(
-                self.TOKEN_ENDPOINT,
+                self.token_endpoint,
                 data=urllib.parse.urlencode({
                         'grant_type': 'refresh_token',
                         'refresh_token': self.refresh_token
@@ -49,6 +117,7 @@ class AuthHandler(urllib.request.BaseHandler):
                 method='POST')
         with urllib.request.urlopen(req) as f:
             res = json.load(f)
+        metrics.inc('spotify_token_refreshes_total')
         self.bearer_auth_header = 'Bearer ' + res['access_token']
         if 'refresh_token' in res:
             self.refresh_token = res['refresh_token']
@@ -59,20 +128,37 @@ class SpotifyClient:
     ENV_CLIENT_SECRET = 'SPOTIFY_CLIENT_SECRET'
     ENV_ACCESS_TOKEN = 'SPOTIFY_ACCESS_TOKEN'
     ENV_REFRESH_TOKEN = 'SPOTIFY_REFRESH_TOKEN'
+    ENV_RATE = 'SPOTIFY_RATE'
+    ENV_API_URL = 'SPOTIFY_API_URL'
+    ENV_ACCOUNTS_URL = 'SPOTIFY_ACCOUNTS_URL'
+
+    MAX_RETRIES = 5
+    BACKOFF = 1
+    # 5xx responses are only retried for these, a failed POST may have been applied
+    IDEMPOTENT_METHODS = ('GET', 'PUT', 'DELETE')
+    MAX_PLAYLIST_ITEMS = 100
+    MAX_TRACK_IDS = 50
 
     def __init__(self):
         self.client_id = os.getenv(self.ENV_CLIENT_ID)
         self.client_secret = os.getenv(self.ENV_CLIENT_SECRET)
         self.access_token = os.getenv(self.ENV_ACCESS_TOKEN, 'foo')
         self.refresh_token = os.getenv(self.ENV_REFRESH_TOKEN)
+        self.api_url = os.getenv(self.ENV_API_URL, API_URL)
+        self.accounts_url = os.getenv(self.ENV_ACCOUNTS_URL, ACCOUNTS_URL)
         self.redirect_uri = 'http://127.0.0.1:3000/callback'
         self.scope = 'playlist-modify-public playlist-read-private'
+        self.limiter = TokenBucket(float(os.getenv(self.ENV_RATE, 10)), burst=5)
         if not self.refresh_token:
             self._authorize()
-        self.handler = AuthHandler(self.client_id, self.client_secret, self.access_token, self.refresh_token)
+        self.handler = AuthHandler(self.client_id, self.client_secret, self.access_token, self.refresh_token,
+                                   self.accounts_url)
         self.opener = urllib.request.build_opener(self.handler)
         self.user_id = self.call('/me')['id']
 
+    def api(self, endpoint):
+        return api(endpoint, self.api_url)
+
     def call(self, endpoint, data=None, method='GET'):
         if data:
             data=urllib.parse.urlencode(data)
@@ -82,12 +168,59 @@ class SpotifyClient:
                 data = None
             else:
                 data = data.encode()
-        req = urllib.request.Request(api(endpoint),
+        req = urllib.request.Request(self.api(endpoint),
                                      data=data,
                                      method=method)
-        with self.opener.open(req) as f:
+        with self._open(req) as f:
             return json.load(f)
 
+    def _open(self, req):
+        """Open req through the rate limiter, retrying 429 responses, and 5xx
+        ones of IDEMPOTENT_METHODS."""
+        if isinstance(req, str):
+            req = urllib.request.Request(req)
+        endpoint = endpoint_label(req.full_url) if metrics.enabled else None
+        for attempt in range(self.MAX_RETRIES + 1):
+            self.limiter.acquire()
+            try:
+                with metrics.timed('spotify_request_seconds', endpoint=endpoint):
+                    res = self.opener.open(req)
+                metrics.inc('spotify_requests_total', endpoint=endpoint, status=res.status)
+                return res
+            except urllib.error.HTTPError as e:
+                metrics.inc('spotify_requests_total', endpoint=endpoint, status=e.code)
+                if attempt == self.MAX_RETRIES:
+                    raise
+                if e.code == 429:
+                    delay = float(e.headers.get('Retry-After') or self.BACKOFF)
+                    logger.warning(f'Rate limited, retrying after {delay}s')
+                    metrics.observe('spotify_throttled_seconds', delay)
+                    self.limiter.pause(delay)
+                elif e.code >= 500 and req.get_method() in self.IDEMPOTENT_METHODS:
+                    delay = self.BACKOFF * 2 ** attempt
+                    logger.warning(f'Got {e.code}, retrying after {delay}s')
+                    time.sleep(delay)
+                else:
+                    raise
+                e.close()
+
+    def map(self, func, items, max_workers=8):
+        """Run func over items in a thread pool, yielding (item, result or exception).
+
+        All workers share the client's rate limiter, so max_workers only bounds
+        the requests in flight, not the request rate.
+        """
+        pool = ThreadPoolExecutor(max_workers)
+        try:
+            futures = [(item, pool.submit(func, item)) for item in items]
+            for item, f in futures:
+                try:
+                    yield item, f.result()
+                except Exception as e:
+                    yield item, e
+        finally:
+            pool.shutdown(cancel_futures=True)
+
     def search_track(self, hints):
         if '' in hints:
             q = hints['']
@@ -99,7 +232,7 @@ class SpotifyClient:
 
         endpoint = '/search?' + urllib.parse.urlencode({'q': q, 'type': 'track'})
         
-        with self.opener.open(api(endpoint)) as f:
+        with self._open(self.api(endpoint)) as f:
             body = json.load(f)
         return [
             {
@@ -110,29 +243,93 @@ class SpotifyClient:
                 'artist': ', '.join(a['name'] for a in e['artists'])
             } for e in body['tracks']['items']]
 
+    def get_tracks(self, ids, market='from_token'):
+        """Tracks of up to MAX_TRACK_IDS ids in one request, None for unknown ids.
+
+        With a market tracks carry is_playable, and a relinked track comes
+        back under the id playable there with the requested one in linked_from.
+        """
+        query = {'ids': ','.join(ids)}
+        if market:
+            query['market'] = market
+        with self._open(self.api('/tracks?' + urllib.parse.urlencode(query))) as f:
+            return json.load(f)['tracks']
+
     def create_playlist(self, name, description):
         req = urllib.request.Request(
-                api(f'/users/{self.user_id}/playlists'), 
+                self.api(f'/users/{self.user_id}/playlists'), 
                 data=json.dumps({'name': name, 'description': description}).encode(),
                 headers={'Content-Type': 'application/json'},
                 method='POST')
-        with self.opener.open(req) as f:
+        with self._open(req) as f:
             body = json.load(f)
         return body['id']
     
-    def add_items_to_playlist(self, playlist_id, items):
-        uris = [f'spotify:track:{e}' for e in items]
+    def get_playlist_snapshot(self, playlist_id):
+        with self._open(self.api(f'/playlists/{playlist_id}?fields=snapshot_id')) as f:
+            return json.load(f)['snapshot_id']
+
+    def get_playlist_tracks(self, playlist_id):
+        """Track ids of the playlist in order, None for local or unavailable tracks."""
+        tracks = []
+        total = None
+        while total is None or len(tracks) < total:
+            query = urllib.parse.urlencode({
+                'offset': len(tracks),
+                'limit': self.MAX_PLAYLIST_ITEMS,
+                'fields': 'items(track(id)),total',
+            })
+            with self._open(self.api(f'/playlists/{playlist_id}/tracks?{query}')) as f:
+                body = json.load(f)
+            total = body['total']
+            if not body['items']:
+                break
+            tracks.extend((e['track'] or {}).get('id') for e in body['items'])
+        return tracks
+
+    def add_items_to_playlist(self, playlist_id, items, position=None):
+        snapshot_id = None
+        for chunk in chunks(items, self.MAX_PLAYLIST_ITEMS):
+            body = {'uris': [f'spotify:track:{e}' for e in chunk]}
+            if position is not None:
+                body['position'] = position
+                position += len(chunk)
+            snapshot_id = self._send_playlist_tracks(playlist_id, body, 'POST')
+        return snapshot_id
+
+    def replace_playlist_items(self, playlist_id, items):
+        uris = [f'spotify:track:{e}' for e in items[:self.MAX_PLAYLIST_ITEMS]]
+        snapshot_id = self._send_playlist_tracks(playlist_id, {'uris': uris}, 'PUT')
+        return self.add_items_to_playlist(
+                playlist_id, items[self.MAX_PLAYLIST_ITEMS:]) or snapshot_id
+
+    def remove_playlist_items(self, playlist_id, items, snapshot_id=None):
+        """Remove every occurrence of the tracks items from the playlist."""
+        for chunk in chunks(items, self.MAX_PLAYLIST_ITEMS):
+            body = {'tracks': [{'uri': f'spotify:track:{e}'} for e in chunk]}
+            if snapshot_id:
+                body['snapshot_id'] = snapshot_id
+            snapshot_id = self._send_playlist_tracks(playlist_id, body, 'DELETE')
+        return snapshot_id
+
+    def reorder_playlist_items(self, playlist_id, range_start, insert_before, range_length=1, snapshot_id=None):
+        body = {'range_start': range_start, 'insert_before': insert_before, 'range_length': range_length}
+        if snapshot_id:
+            body['snapshot_id'] = snapshot_id
+        return self._send_playlist_tracks(playlist_id, body, 'PUT')
+
+    def _send_playlist_tracks(self, playlist_id, body, method):
         req = urllib.request.Request(
-                api(f'/playlists/{playlist_id}/tracks'), 
-                data=json.dumps({'uris': uris}).encode(),
+                self.api(f'/playlists/{playlist_id}/tracks'), 
+                data=json.dumps(body).encode(),
                 headers={'Content-Type': 'application/json'},
-                method='POST')
-        with self.opener.open(req) as f:
+                method=method)
+        with self._open(req) as f:
             body = json.load(f)
         return body['snapshot_id']
                 
     def _authorize(self):
-        webbrowser.open(f'https://accounts.spotify.com/authorize'\
+        webbrowser.open(f'{self.accounts_url}/authorize'\
             f'?client_id={self.client_id}'\
             f'&response_type=code'\
             f'&redirect_uri={self.redirect_uri}'\
@@ -143,7 +340,7 @@ class SpotifyClient:
             srv.server_close()
 
         req = urllib.request.Request(
-                url='https://accounts.spotify.com/api/token',
+                url=f'{self.accounts_url}/api/token',
                 data=urllib.parse.urlencode({
                     'grant_type': 'authorization_code',
                     'code': self.callback['code'],
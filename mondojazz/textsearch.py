@@ -0,0 +1,155 @@
+"""Full-text search over the artist, title and album of spins and songs.
+
+On SQLite the spin and song tables get FTS5 indexes (spin_fts, song_fts)
+holding no copy of the text, kept up to date by triggers so every write
+path, bulk inserts and updates included, maintains them. Words match
+case and accent insensitively and by prefix, results are ranked by bm25
+with artist and title weighing more than album. Other engines, or SQLite
+built without FTS5, fall back to LIKE scans returning the same fields.
+
+    searchSpins('coltrane', field='artist')
+    similarSongs(song_id)  # candidates for merging duplicate songs
+"""
+import logging
+import re
+
+from sqlalchemy import and_, func, or_, select, text
+from sqlalchemy.exc import OperationalError
+
+from mondojazz import Session
+from mondojazz.models import Episode, Song, Spin, SpinitronPlaylist
+
+logger = logging.getLogger(__name__)
+
+FIELDS = ('artist', 'title', 'album')
+WEIGHTS = (2.0, 2.0, 1.0)
+TABLES = ('spin', 'song')
+
+_available = {}
+
+
+def createIndex(conn):
+    """Create the FTS5 tables and their triggers if missing and fill them from
+    the indexed tables. Returns False if the engine can not have them."""
+    if conn.dialect.name != 'sqlite':
+        return False
+    columns = ', '.join(FIELDS)
+    old = ', '.join(f'old.{f}' for f in FIELDS)
+    new = ', '.join(f'new.{f}' for f in FIELDS)
+    for table in TABLES:
+        fts = f'{table}_fts'
+        try:
+            conn.execute(text(
+                f'CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5({columns}, '
+                f"content='{table}', content_rowid='id', "
+                f"tokenize='unicode61 remove_diacritics 2', prefix='2 3')"))
+        except OperationalError as e:
+            logger.warning(f'No full-text index, searches will scan: {e}')
+            return False
+        conn.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN '
+            f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); END'))
+        conn.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN '
+            f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old}); END"))
+        conn.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {columns} ON {table} BEGIN '
+            f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old}); "
+            f'INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new}); END'))
+        conn.execute(text(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')"))
+    return True
+
+
+def hasIndex(session):
+    engine = session.get_bind()
+    if engine not in _available:
+        _available[engine] = engine.dialect.name == 'sqlite' and session.scalar(
+            text("SELECT count(*) FROM sqlite_master WHERE name IN ('spin_fts', 'song_fts')")) == 2
+    return _available[engine]
+
+
+def words(query):
+    return re.findall(r'\w+', query)
+
+
+def matchQuery(query, field=None, any_word=False):
+    """FTS5 query matching the words of query as prefixes, all of them or any
+    with any_word, in field only if given."""
+    terms = (' OR ' if any_word else ' ').join(f'"{w}"*' for w in words(query))
+    return f'{field} : ({terms})' if field else terms
+
+
+def likeFilter(model, query, field=None, any_word=False):
+    fields = [getattr(model, field)] if field else [getattr(model, f) for f in FIELDS]
+    conds = [or_(*(f.ilike(f'%{w}%') for f in fields)) for w in words(query)]
+    return or_(*conds) if any_word else and_(*conds)
+
+
+def _checkField(field):
+    if field is not None and field not in FIELDS:
+        raise ValueError(f'Unknown field {field!r}, expected one of {FIELDS}')
+
+
+def _ranked(session, model, query, field, any_word, limit, exclude=None):
+    """Ids of model's rows matching query with their rank, best first."""
+    if hasIndex(session):
+        fts = f'{model.__tablename__}_fts'
+        rows = session.execute(text(
+            f'SELECT rowid, bm25({fts}, {", ".join(map(str, WEIGHTS))}) AS rank FROM {fts} '
+            f'WHERE {fts} MATCH :q AND rowid IS NOT :exclude ORDER BY rank LIMIT :limit'),
+            {'q': matchQuery(query, field, any_word), 'exclude': exclude, 'limit': limit})
+        return [(id_, -rank) for id_, rank in rows]
+    q = select(model.id).where(likeFilter(model, query, field, any_word))
+    if exclude is not None:
+        q = q.where(model.id != exclude)
+    return [(id_, None) for id_ in session.scalars(q.order_by(model.id.desc()).limit(limit))]
+
+
+def searchSpins(query, field=None, limit=20):
+    """Spins whose artist, title and album, or only field, contain every word of
+    query, best first, as dicts with the playlist's air date and episode number."""
+    _checkField(field)
+    if not words(query):
+        return []
+    with Session() as session:
+        ranked = _ranked(session, Spin, query, field, False, limit)
+        rows = {row.id: row for row in session.execute(
+            select(Spin.id, Spin.artist, Spin.title, Spin.album, Spin.year, Spin.song_id,
+                   SpinitronPlaylist.spinitron_id, SpinitronPlaylist.timeslot,
+                   Episode.number.label('episode'))
+            .outerjoin(Spin.playlist)
+            .outerjoin(SpinitronPlaylist.episode)
+            .where(Spin.id.in_([id_ for id_, _ in ranked])))}
+    return [dict(rows[id_]._asdict(), rank=rank) for id_, rank in ranked if id_ in rows]
+
+
+def _songs(session, ranked):
+    rows = {row.id: row for row in session.execute(
+        select(Song.id, Song.artist, Song.title, Song.album, Song.year, Song.spotify_id,
+               func.count(Spin.id).label('spins'))
+        .outerjoin(Song.spins)
+        .where(Song.id.in_([id_ for id_, _ in ranked]))
+        .group_by(Song.id))}
+    return [dict(rows[id_]._asdict(), rank=rank) for id_, rank in ranked if id_ in rows]
+
+
+def searchSongs(query, field=None, limit=20):
+    """Songs matching query like searchSpins, with their number of spins."""
+    _checkField(field)
+    if not words(query):
+        return []
+    with Session() as session:
+        return _songs(session, _ranked(session, Song, query, field, False, limit))
+
+
+def similarSongs(song_id, limit=10):
+    """Other songs sharing words with the title and artist of song_id, most
+    similar first: the candidates to check when deduplicating songs."""
+    with Session() as session:
+        song = session.get(Song, song_id)
+        if song is None:
+            return []
+        query = f'{song.title} {song.artist}'
+        if not words(query):
+            return []
+        return _songs(session, _ranked(session, Song, query, None, True, limit, exclude=song_id))
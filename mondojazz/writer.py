@@ -0,0 +1,129 @@
+"""Single database writer fed from any number of threads.
+
+Worker threads submit write jobs, callables taking a session, and one writer
+thread applies them. Jobs queued while a transaction is running are applied
+together in the next one, up to batch_size jobs, so write throughput grows
+with the backlog instead of every worker contending for the database lock:
+
+    with Writer() as writer:
+        writer.insert(Spin, rows)
+        future = writer.update(Spin, [{'id': spin_id, 'song_id': song_id}])
+
+If a grouped transaction fails its jobs are retried in a transaction each, so
+only the failing job is lost. The Future of a job is resolved once its
+transaction is committed.
+"""
+from concurrent.futures import Future
+import logging
+import queue
+import threading
+
+from sqlalchemy import update
+
+from mondojazz import Session, metrics
+from mondojazz.bulk import insertIgnore
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 64
+
+_STOP = object()
+
+
+def bulkUpdate(session, model, rows):
+    if rows:
+        session.execute(update(model), rows)
+    return len(rows)
+
+
+class Writer:
+
+    def __init__(self, batch_size=BATCH_SIZE, queue_size=0, on_commit=None, on_rollback=None):
+        """on_commit(results) and on_rollback() are called in the writer
+        thread after a transaction, results holding the return value of every
+        job in it."""
+        self.batch_size = batch_size
+        self.queue = queue.Queue(queue_size)
+        self.on_commit = on_commit
+        self.on_rollback = on_rollback
+        self.thread = threading.Thread(target=self._run, name='writer', daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def submit(self, fn, *args, **kwargs):
+        """Queue fn(session, *args, **kwargs), returns a Future of its result."""
+        future = Future()
+        self.queue.put((future, fn, args, kwargs))
+        return future
+
+    def insert(self, model, rows):
+        """Queue rows for insertion into model's table, skipping duplicates.
+        The Future's result is (inserted, skipped)."""
+        return self.submit(insertIgnore, model, rows)
+
+    def update(self, model, rows):
+        """Queue a bulk update of model by primary key, rows being dicts."""
+        return self.submit(bulkUpdate, model, rows)
+
+    def flush(self):
+        """Block until every job queued so far is committed."""
+        self.submit(lambda session: None).result()
+
+    def close(self):
+        """Apply the queued jobs and stop the writer thread."""
+        self.queue.put(_STOP)
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _run(self):
+        stop = False
+        while not stop:
+            batch = []
+            job = self.queue.get()
+            while True:
+                if job is _STOP:
+                    stop = True
+                    break
+                batch.append(job)
+                if len(batch) == self.batch_size:
+                    break
+                try:
+                    job = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            batch = [job for job in batch if job[0].set_running_or_notify_cancel()]
+            if batch and not self._apply(batch) and len(batch) > 1:
+                logger.warning(f'Grouped write of {len(batch)} jobs failed, retrying one by one')
+                for job in batch:
+                    self._apply([job])
+
+    def _apply(self, batch):
+        """Run batch in one transaction, returns False if it was rolled back."""
+        try:
+            with metrics.timed('db_write_seconds'), Session() as session, session.begin():
+                results = [fn(session, *args, **kwargs) for _, fn, args, kwargs in batch]
+        except Exception as e:
+            metrics.inc('writer_rollbacks_total')
+            if self.on_rollback:
+                self.on_rollback()
+            if len(batch) == 1:
+                logger.exception(f'Write job {batch[0][1]} failed')
+                batch[0][0].set_exception(e)
+            return False
+        metrics.inc('writer_transactions_total')
+        metrics.inc('writer_jobs_total', len(batch))
+        if self.on_commit:
+            try:
+                self.on_commit(results)
+            except Exception:
+                logger.exception('Writer commit callback failed')
+        for (future, *_), result in zip(batch, results):
+            future.set_result(result)
+        return True
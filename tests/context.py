@@ -1,6 +1,9 @@
+import atexit
 import logging
 import os
+import shutil
 import sys
+import tempfile
 
 logging.basicConfig(level=logging.DEBUG)
 
@@ -9,8 +12,26 @@ DATA_DIR = os.path.abspath(os.path.join(TESTS_DIR, 'data'))
 
 sys.path.insert(0, TESTS_DIR)
 
-os.environ['ENGINE_URL'] = f'sqlite:///{DATA_DIR}/test.db'
+TMP_DIR = tempfile.mkdtemp(prefix='mondojazz-test-')
+atexit.register(shutil.rmtree, TMP_DIR, ignore_errors=True)
+os.environ['ENGINE_URL'] = f'sqlite:///{TMP_DIR}/test.db'
 
 import mondojazz
 import mondojazz.parser
 import mondojazz.models
+import mondojazz.bulk
+import mondojazz.searchcache
+import mondojazz.matcher
+import mondojazz.metrics
+import mondojazz.checkpoint
+import mondojazz.httpcache
+import mondojazz.migrations
+import mondojazz.writer
+import mondojazz.textsearch
+import mondojazz.pagearchive
+import mondojazz.mapper
+import mondojazz.pipeline
+import mondojazz.scraper
+import mondojazz.__main__
+
+mondojazz.init(create=True)
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta
+import unittest
+from unittest import mock
+
+from sqlalchemy import delete, select
+
+from . import context as ctx
+bulk = ctx.mondojazz.bulk
+models = ctx.mondojazz.models
+Session = ctx.mondojazz.Session
+
+START = datetime(2024, 1, 1, 8)
+
+
+def playlists(*ids):
+    return [{'spinitron_id': i, 'timeslot': START + timedelta(days=i), 'title': f'Show {i}'} for i in ids]
+
+
+class TestInsertIgnore(unittest.TestCase):
+    def tearDown(self):
+        with Session() as session, session.begin():
+            session.execute(delete(models.SpinitronPlaylist))
+
+    def insert(self, rows):
+        with Session() as session, session.begin():
+            return bulk.insertIgnore(session, models.SpinitronPlaylist, rows)
+
+    def stored(self):
+        with Session() as session:
+            return session.execute(
+                select(models.SpinitronPlaylist.spinitron_id, models.SpinitronPlaylist.title)
+                .order_by(models.SpinitronPlaylist.spinitron_id)).all()
+
+    def check(self):
+        self.assertEqual(self.insert([]), (0, 0))
+        self.assertEqual(self.insert(playlists(1, 2)), (2, 0))
+        rows = playlists(2, 3, 3, 4)
+        rows[0]['title'] = 'Edited'
+        # stored rows and repeats in the same batch are skipped, not updated
+        self.assertEqual(self.insert(rows), (2, 2))
+        self.assertEqual(self.stored(), [(1, 'Show 1'), (2, 'Show 2'), (3, 'Show 3'), (4, 'Show 4')])
+
+    def test_on_conflict(self):
+        self.check()
+
+    def test_savepoints(self):
+        with mock.patch.dict(bulk.INSERT_IGNORE, clear=True):
+            self.check()
+
+    def test_pending_objects(self):
+        # objects added to the session are flushed first, so they conflict too
+        with Session() as session, session.begin():
+            session.add(models.SpinitronPlaylist(**playlists(5)[0]))
+            self.assertEqual(bulk.insertIgnore(session, models.SpinitronPlaylist, playlists(5, 6)), (1, 1))
+        self.assertEqual([i for i, _ in self.stored()], [5, 6])
@@ -0,0 +1,55 @@
+import unittest
+
+from sqlalchemy import delete, insert, select
+
+from . import context as ctx
+Session = ctx.mondojazz.Session
+Song = ctx.mondojazz.models.Song
+Checkpoint = ctx.mondojazz.models.Checkpoint
+checkpoint = ctx.mondojazz.checkpoint
+
+
+class TestIterChunks(unittest.TestCase):
+    def setUp(self):
+        with Session() as session, session.begin():
+            session.execute(delete(Checkpoint))
+            session.execute(delete(Song))
+            session.execute(insert(Song), [
+                {'title': f'Song {i}', 'artist': 'Artist', 'album': '', 'year': 0}
+                for i in range(10)])
+
+    def tearDown(self):
+        with Session() as session, session.begin():
+            session.execute(delete(Checkpoint))
+            session.execute(delete(Song))
+
+    def mark(self, chunks, fail_at=None):
+        seen = []
+        for i, (session, songs) in enumerate(chunks):
+            seen.append(len(songs))
+            for song in songs:
+                song.album = 'done'
+            if i == fail_at:
+                raise RuntimeError('interrupted')
+        return seen
+
+    def albums(self):
+        with Session() as session:
+            return session.scalars(select(Song.album).order_by(Song.id)).all()
+
+    def test_chunks(self):
+        chunks = checkpoint.iterChunks('test', Song, Song.album == '', chunk_size=4)
+        self.assertEqual(self.mark(chunks), [4, 4, 2])
+        self.assertEqual(self.albums(), ['done'] * 10)
+        self.assertEqual(checkpoint.loadCheckpoint('test'), 0)
+
+    def test_resume(self):
+        chunks = checkpoint.iterChunks('test', Song, chunk_size=4)
+        with self.assertRaises(RuntimeError):
+            self.mark(chunks, fail_at=1)
+        chunks.close()
+        self.assertEqual(self.albums(), ['done'] * 4 + [''] * 6)
+
+        chunks = checkpoint.iterChunks('test', Song, chunk_size=4, resume=True)
+        self.assertEqual(self.mark(chunks), [4, 2])
+        self.assertEqual(self.albums(), ['done'] * 10)
@@ -0,0 +1,84 @@
+from datetime import datetime, time, timedelta
+import unittest
+
+from sqlalchemy import delete, select, update
+
+from . import context as ctx
+mapper = ctx.mondojazz.mapper
+models = ctx.mondojazz.models
+Session = ctx.mondojazz.Session
+
+START = datetime(2024, 1, 1, 8)
+
+
+class TestUpdateEpisodes(unittest.TestCase):
+    def setUp(self):
+        with Session() as session, session.begin():
+            songs = [models.Song(title=f'Song {i}', artist='Artist', album='', year=0) for i in range(6)]
+            session.add_all(songs)
+            session.flush()
+            self.song_ids = [song.id for song in songs]
+
+    def tearDown(self):
+        with Session() as session, session.begin():
+            for model in [models.Spin, models.SpinitronPlaylist, models.Episode, models.Song]:
+                session.execute(delete(model))
+
+    def addPlaylist(self, spinitron_id, day, songs, episode=None):
+        """Playlist aired on day spinning songs, indexes into the songs, None for unmapped spins."""
+        with Session() as session, session.begin():
+            stpl = models.SpinitronPlaylist(spinitron_id=spinitron_id, timeslot=START + timedelta(days=day),
+                                            title='Show')
+            if episode is not None:
+                stpl.episode = models.Episode(number=episode)
+            for i, song in enumerate(songs):
+                stpl.spins.append(models.Spin(
+                    spinitron_id=spinitron_id * 100 + i, artist='Artist', title='Song', album='', year=0,
+                    start_time=time(8, i), number=i, song_id=None if song is None else self.song_ids[song]))
+            session.add(stpl)
+
+    def episodes(self):
+        with Session() as session:
+            return dict(session.execute(
+                select(models.SpinitronPlaylist.spinitron_id, models.Episode.number)
+                .outerjoin(models.SpinitronPlaylist.episode)).all())
+
+    def test_same_fingerprint(self):
+        # stored before fingerprints, it gets one and its rebroadcast joins it
+        self.addPlaylist(1, 0, [0, 1, 2], episode=5)
+        self.addPlaylist(2, 3, [0, 1, 2])
+        self.assertEqual(mapper.updateEpisodes(), [])
+        self.assertEqual(self.episodes(), {1: 5, 2: 5})
+
+    def test_numbering(self):
+        self.addPlaylist(1, 0, [0, 1], episode=5)
+        self.addPlaylist(4, 10, [3, 4])
+        self.addPlaylist(3, 7, [2, 3])
+        self.addPlaylist(2, 3, [1, 2])
+        self.addPlaylist(5, 13, [2, 3])
+        # numbered in air order after the highest episode
+        self.assertEqual(mapper.updateEpisodes(), [6, 7, 8])
+        self.assertEqual(self.episodes(), {1: 5, 2: 6, 3: 7, 4: 8, 5: 7})
+        # same songs in another order are another episode
+        self.addPlaylist(6, 14, [4, 3])
+        self.assertEqual(mapper.updateEpisodes(), [9])
+
+    def test_not_mapped(self):
+        self.addPlaylist(1, 0, [0, None, 2])
+        self.addPlaylist(2, 1, [])
+        self.assertEqual(mapper.updateEpisodes(), [])
+        self.assertEqual(self.episodes(), {1: None, 2: None})
+
+        with Session() as session, session.begin():
+            session.execute(update(models.Spin).where(models.Spin.song_id == None)
+                            .values(song_id=self.song_ids[1]))
+        self.assertEqual(mapper.updateEpisodes(), [1])
+        self.assertEqual(self.episodes(), {1: 1, 2: None})
+
+    def test_until(self):
+        self.addPlaylist(1, 0, [0, 1])
+        self.addPlaylist(2, 7, [1, 2])
+        self.assertEqual(mapper.updateEpisodes(until=START + timedelta(days=6)), [1])
+        self.assertEqual(self.episodes(), {1: 1, 2: None})
+        self.assertEqual(mapper.updateEpisodes(until=START + timedelta(days=7)), [2])
+        self.assertEqual(self.episodes(), {1: 1, 2: 2})
@@ -0,0 +1,81 @@
+import tempfile
+import unittest
+from unittest import mock
+
+from . import context as ctx
+httpcache = ctx.mondojazz.httpcache
+scraper = ctx.mondojazz.scraper
+
+URL = 'http://spinitron.test/RFB/pl/1/Mondo-Jazz'
+
+
+class FakeResponse:
+    def __init__(self, status_code, text='', headers=None):
+        self.status_code = status_code
+        self.text = text
+        self.headers = headers or {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise httpcache.requests.HTTPError(f'{self.status_code} Error', response=self)
+
+
+class FakeHttp:
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.requests = []
+
+    def get(self, url, headers=None):
+        self.requests.append(headers)
+        return self.responses.pop(0)
+
+
+class TestHttpCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def cache(self, *responses, offline=False):
+        http = FakeHttp(*responses)
+        return httpcache.HttpCache(self.tmp.name, http, offline), http
+
+    def test_revalidate(self):
+        cache, http = self.cache(
+            FakeResponse(200, 'page', {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2024 08:00:00 GMT'}),
+            FakeResponse(304))
+        self.assertEqual(cache.fetch(URL), ('page', '"v1"'))
+        self.assertEqual(cache.fetch(URL), ('page', '"v1"'))
+        self.assertEqual(http.requests, [{}, {'If-None-Match': '"v1"',
+                                              'If-Modified-Since': 'Mon, 01 Jan 2024 08:00:00 GMT'}])
+
+    def test_ttl(self):
+        cache, http = self.cache(FakeResponse(200, 'page', {'ETag': '"v1"'}), FakeResponse(200, 'new'))
+        self.assertEqual(cache.get(URL, ttl=60), 'page')
+        self.assertEqual(cache.get(URL, ttl=60), 'page')
+        self.assertEqual(len(http.requests), 1)
+        self.assertEqual(cache.get(URL, ttl=0), 'new')
+
+    def test_error_not_stored(self):
+        cache, _ = self.cache(FakeResponse(503, 'unavailable'))
+        with self.assertRaises(httpcache.requests.HTTPError):
+            cache.fetch(URL)
+        offline, _ = self.cache(offline=True)
+        with self.assertRaises(httpcache.OfflineCacheMiss):
+            offline.fetch(URL)
+
+    def test_offline(self):
+        cache, _ = self.cache(FakeResponse(200, 'page', {'ETag': '"v1"'}))
+        cache.fetch(URL, {'page': 2})
+        offline, http = self.cache(offline=True)
+        self.assertEqual(offline.fetch(URL, {'page': 2}), ('page', '"v1"'))
+        with self.assertRaises(httpcache.OfflineCacheMiss):
+            offline.fetch(URL, {'page': 3})
+        self.assertEqual(http.requests, [])
+
+
+class TestSetCache(unittest.TestCase):
+    def test_offline_needs_path(self):
+        with mock.patch.object(scraper, 'cache', None):
+            with self.assertRaises(ValueError):
+                scraper.setCache(None, offline=True)
+            self.assertIsNone(scraper.cache)
@@ -0,0 +1,75 @@
+from contextlib import redirect_stdout
+from datetime import datetime, time
+import io
+import unittest
+from unittest import mock
+
+from sqlalchemy import delete
+
+from . import context as ctx
+main = ctx.mondojazz.__main__
+mapper = ctx.mondojazz.mapper
+models = ctx.mondojazz.models
+Session = ctx.mondojazz.Session
+
+
+class TestParser(unittest.TestCase):
+    def parse(self, *argv):
+        return main.makeParser().parse_args(argv)
+
+    def test_commands(self):
+        args = self.parse('scrape', '--all-spins', '--workers', '8', '--chunk-size', '50')
+        self.assertIs(args.func, main.cmdScrape)
+        self.assertEqual((args.all_spins, args.workers, args.chunk_size, args.resume), (True, 8, 50, False))
+        args = self.parse('publish', '3', '4', '--sync')
+        self.assertEqual((args.func, args.episodes, args.sync), (main.cmdPublish, [3, 4], True))
+        args = self.parse('run')
+        self.assertEqual((args.fetch_workers, args.parse_workers, args.publish), (4, 0, False))
+        args = self.parse('search', 'john', 'coltrane', '--field', 'artist')
+        self.assertEqual((args.query, args.field, args.songs), (['john', 'coltrane'], 'artist', False))
+
+    def test_invalid(self):
+        with redirect_stdout(io.StringIO()), mock.patch('sys.stderr', io.StringIO()):
+            for argv in [(), ('search',), ('search', 'monk', '--field', 'label'), ('publish', 'one')]:
+                with self.assertRaises(SystemExit):
+                    self.parse(*argv)
+
+
+class TestMain(unittest.TestCase):
+    def tearDown(self):
+        with Session() as session, session.begin():
+            for model in [models.Spin, models.SpinitronPlaylist, models.Episode]:
+                session.execute(delete(model))
+
+    def run_main(self, *argv):
+        out = io.StringIO()
+        with redirect_stdout(out):
+            status = main.main(list(argv))
+        return status, out.getvalue()
+
+    def test_init(self):
+        status, _ = self.run_main('init')
+        self.assertIsNone(status)
+        self.assertEqual(ctx.mondojazz.createSchema(), ctx.mondojazz.migrations.latestVersion())
+
+    def test_search(self):
+        with Session() as session, session.begin():
+            stpl = models.SpinitronPlaylist(spinitron_id=1, timeslot=datetime(2024, 1, 1, 8), title='Show')
+            stpl.episode = models.Episode(number=7)
+            stpl.spins.append(models.Spin(spinitron_id=1, artist='John Coltrane', title='Naima',
+                                          album='Giant Steps', year=1960, start_time=time(8), number=0))
+            session.add(stpl)
+        _, out = self.run_main('search', 'coltrane')
+        self.assertEqual(out.strip(), '2024-01-01  episode 7     John Coltrane - Naima (Giant Steps, 1960)')
+
+    def test_publish_failed(self):
+        results = [{'episode': 1, 'error': None}, {'episode': 2, 'error': 'Bad Gateway'}]
+        with mock.patch.object(mapper, 'publishEpisodes', return_value=results) as publish:
+            status, _ = self.run_main('publish', '--first', '1', '--workers', '2')
+        publish.assert_called_once_with(None, 1, None, 2)
+        self.assertEqual(status, 1)
+
+    def test_offline_without_cache(self):
+        with mock.patch.dict('os.environ', {'SCRAPER_CACHE_DIR': ''}):
+            with self.assertRaises(ValueError):
+                self.run_main('--offline', 'scrape')
@@ -0,0 +1,129 @@
+from datetime import datetime, time
+import threading
+import unittest
+from unittest import mock
+
+from sqlalchemy import delete, event, select
+
+from . import context as ctx
+mapper = ctx.mondojazz.mapper
+matcher = ctx.mondojazz.matcher
+models = ctx.mondojazz.models
+Session = ctx.mondojazz.Session
+
+
+class FakeSearch:
+    """Search answering with one track per normalized title and artist, so
+    "Naima" and "Naima (Live)" match the same track."""
+
+    def __init__(self):
+        self.queries = []
+        self.lock = threading.Lock()
+
+    def search_track(self, q):
+        with self.lock:
+            self.queries.append((q[''], q['artist']))
+        track_id = f'{matcher.normalize(q[""])}|{matcher.normalize(q["artist"])}'
+        return [{'id': track_id, 'track': q[''], 'artist': q['artist'], 'album': 'Album', 'date': '1960'}]
+
+    def stats(self):
+        return {}
+
+
+class CountStatements:
+    def __init__(self, engine):
+        self.engine = engine
+        self.count = 0
+
+    def __call__(self, *args):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(self.engine, 'before_cursor_execute', self)
+        return self
+
+    def __exit__(self, *exc):
+        event.remove(self.engine, 'before_cursor_execute', self)
+
+
+class TestMapSpins(unittest.TestCase):
+    def setUp(self):
+        self.search = FakeSearch()
+        patch = mock.patch.object(mapper, 'search', self.search)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        with Session() as session, session.begin():
+            for model in [models.Spin, models.SpinitronPlaylist, models.Song]:
+                session.execute(delete(model))
+
+    def addSpins(self, titles, spinitron_id=1):
+        with Session() as session, session.begin():
+            stpl = models.SpinitronPlaylist(spinitron_id=spinitron_id, timeslot=datetime(2024, 1, spinitron_id),
+                                            title='Show')
+            for i, (title, artist) in enumerate(titles):
+                stpl.spins.append(models.Spin(spinitron_id=spinitron_id * 1000 + i, artist=artist, title=title,
+                                              album='', year=0, start_time=time(8, i), number=i))
+            session.add(stpl)
+
+    def songOf(self):
+        with Session() as session:
+            return {(spin.title, spin.artist): spin.song and (spin.song.title, spin.song.spotify_id)
+                    for spin in session.scalars(select(models.Spin))}
+
+    def test_batch(self):
+        with Session() as session, session.begin():
+            session.add(models.Song(title='Stored', artist='Band', album='', year=0, spotify_id='stored|band'))
+        titles = [('Naima', 'John Coltrane'), ('Naima (Live)', 'John Coltrane'), ('Equinox', 'John Coltrane'),
+                  ('Stored', 'Band'), ('Stored (Remastered)', 'Band')]
+        self.addSpins(titles * 3)
+        mapper.mapSpinsBatch()
+
+        # one search per distinct song not stored yet
+        self.assertEqual(sorted(self.search.queries), sorted(titles[:3] + titles[4:]))
+        songs = self.songOf()
+        self.assertEqual(songs[('Naima', 'John Coltrane')], ('Naima', 'naima|john coltrane'))
+        # same track, same song
+        self.assertEqual(songs[('Naima (Live)', 'John Coltrane')], ('Naima', 'naima|john coltrane'))
+        self.assertEqual(songs[('Stored (Remastered)', 'Band')], ('Stored', 'stored|band'))
+        with Session() as session:
+            self.assertEqual(len(session.scalars(select(models.Song)).all()), 3)
+            self.assertEqual(session.scalars(select(models.Spin).where(models.Spin.song_id == None)).all(), [])
+
+    def test_statements(self):
+        # the same statements however many spins and songs
+        counts = []
+        for n, spinitron_id in [(4, 1), (40, 2)]:
+            self.addSpins([(f'Song {i % (n // 2)}.{n}', 'Artist') for i in range(n)], spinitron_id)
+            with CountStatements(ctx.mondojazz.getEngine()) as statements:
+                mapper.mapSpinsBatch()
+            counts.append(statements.count)
+        self.assertEqual(counts[0], counts[1])
+        self.assertEqual(len(self.search.queries), 2 + 20)
+
+    def test_chunks(self):
+        titles = [('Naima', 'John Coltrane'), ('Naima (Live)', 'John Coltrane'), ('Equinox', 'John Coltrane')]
+        self.addSpins(titles * 4)
+        mapper.mapSpinsBatch(chunk_size=5)
+        # a later chunk finds the songs stored by the earlier ones, only
+        # spins mapped to a song of another title are searched again
+        self.assertEqual(self.search.queries.count(('Naima', 'John Coltrane')), 1)
+        self.assertEqual(self.search.queries.count(('Equinox', 'John Coltrane')), 1)
+        songs = self.songOf()
+        self.assertEqual(songs[('Naima (Live)', 'John Coltrane')], ('Naima', 'naima|john coltrane'))
+        with Session() as session:
+            self.assertEqual(len(session.scalars(select(models.Song)).all()), 2)
+
+    def test_insert_songs(self):
+        with Session() as session, session.begin():
+            stored = models.Song(title='Stored', artist='Band', album='', year=0)
+            session.add(stored)
+            session.flush()
+            new = [models.Song(title=f'Song {i}', artist='Band', album='', year=0) for i in range(3)]
+            with CountStatements(ctx.mondojazz.getEngine()) as statements:
+                mapper.insertSongs(session, [stored, new[0], new[1], new[0], new[2]])
+            self.assertEqual(statements.count, 1)
+            self.assertEqual(len({song.id for song in new}), 3)
+            for song in new:
+                self.assertEqual(session.get(models.Song, song.id).title, song.title)
@@ -0,0 +1,58 @@
+from types import SimpleNamespace
+import unittest
+
+from . import context as ctx
+matcher = ctx.mondojazz.matcher
+
+
+def spin(title, artist, album='', year=0):
+    return SimpleNamespace(title=title, artist=artist, album=album, year=year)
+
+
+def result(track, artist, album='', date='2000'):
+    return {'id': track, 'track': track, 'artist': artist, 'album': album, 'date': date}
+
+
+class TestNormalize(unittest.TestCase):
+    def test_feat(self):
+        self.assertEqual(
+            matcher.normalize('Mondo Jazz Theme (feat. Ted Nash & Pyeng Threadgill)'),
+            'mondo jazz theme')
+        self.assertEqual(matcher.normalize('Stardust (with Nat King Cole)'), 'stardust')
+        self.assertEqual(matcher.normalize('Naima ft. Someone'), 'naima')
+
+    def test_with_in_title(self):
+        self.assertEqual(matcher.normalize('Come Fly with Me'), 'come fly with me')
+        self.assertEqual(matcher.normalize('Blues with a Feeling'), 'blues with a feeling')
+
+    def test_accents_and_case(self):
+        self.assertEqual(matcher.normalize('Il Cielo È Pieno di Stelle'), 'il cielo e pieno di stelle')
+
+    def test_parentheticals(self):
+        self.assertEqual(matcher.normalize('Un poco loco [Live] (Remastered 2001)'), 'un poco loco')
+
+
+class TestMatcher(unittest.TestCase):
+    def test_exact(self):
+        m = matcher.Matcher(spin('Second Sight', 'Gianfranco Menzella', 'Dedicated to Bob Berg', 2024))
+        self.assertAlmostEqual(
+            m.score(result('Second Sight', 'Gianfranco Menzella', 'Dedicated to Bob Berg', '2024-03-01')),
+            1.0)
+
+    def test_rank(self):
+        m = matcher.Matcher(spin('Un poco loco', 'Monday Orchestra'))
+        ranked = m.rank([
+            result('Un Poco Loco', 'Bud Powell'),
+            result('Un poco loco - Remastered', 'Monday Orchestra, Guest'),
+            result('Something Else', 'Monday Orchestra'),
+        ])
+        self.assertEqual(ranked[0][1]['artist'], 'Monday Orchestra, Guest')
+        self.assertEqual([s for s, _ in ranked], sorted((s for s, _ in ranked), reverse=True))
+
+    def test_missing_fields_rescaled(self):
+        m = matcher.Matcher(spin('Child You', 'Someone'))
+        self.assertAlmostEqual(m.score(result('Child You', 'Someone', 'Any', '1990')), 1.0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from . import context as ctx
+metrics = ctx.mondojazz.metrics
+Session = ctx.mondojazz.Session
+Song = ctx.mondojazz.models.Song
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        metrics.reset()
+        metrics.enable()
+
+    def tearDown(self):
+        metrics.enable(False)
+        metrics.reset()
+
+    def test_disabled(self):
+        metrics.enable(False)
+        metrics.inc('requests_total')
+        with metrics.timed('request_seconds'):
+            pass
+        self.assertEqual(metrics.report()['counters'], {})
+        self.assertEqual(metrics.report()['histograms'], {})
+
+    def test_report(self):
+        metrics.inc('cache_requests_total', cache='http', result='hit')
+        metrics.inc('cache_requests_total', 3, cache='http', result='miss')
+        metrics.observe('request_seconds', 0.2, endpoint='show')
+        metrics.observe('request_seconds', 0.4, endpoint='show')
+        report = metrics.report()
+        self.assertEqual(report['cache_hit_rates'], {'http': 0.25})
+        h = report['histograms']['request_seconds'][0]
+        self.assertEqual(h['labels'], {'endpoint': 'show'})
+        self.assertEqual(h['count'], 2)
+        self.assertAlmostEqual(h['mean'], 0.3)
+
+    def test_prometheus(self):
+        metrics.inc('requests_total', endpoint='show')
+        metrics.observe('request_seconds', 0.02)
+        text = metrics.prometheus()
+        self.assertIn('# TYPE mondojazz_requests_total counter', text)
+        self.assertIn('mondojazz_requests_total{endpoint="show"} 1', text)
+        self.assertIn('mondojazz_request_seconds_bucket{le="0.025"} 1', text)
+        self.assertIn('mondojazz_request_seconds_bucket{le="+Inf"} 1', text)
+        self.assertIn('mondojazz_request_seconds_count 1', text)
+
+    def test_session_flush(self):
+        with Session() as session:
+            session.add(Song(title='t', artist='a', album='b', year=2024))
+            session.flush()
+            session.rollback()
+        report = metrics.report()
+        self.assertEqual(report['counters']['rows_written_total'],
+                         [{'labels': {'table': 'song'}, 'value': 1}])
+        self.assertEqual(report['histograms']['db_flush_seconds'][0]['count'], 1)
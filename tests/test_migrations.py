@@ -0,0 +1,95 @@
+import os
+import unittest
+
+from sqlalchemy import create_engine, func, inspect, select, text
+
+from . import context as ctx
+migrations = ctx.mondojazz.migrations
+Session = ctx.mondojazz.Session
+models = ctx.mondojazz.models
+
+# schema of the first release, before versioning
+OLD_SCHEMA = [
+    'CREATE TABLE episode (number INTEGER NOT NULL, id INTEGER NOT NULL, PRIMARY KEY (id), UNIQUE (number))',
+    'CREATE TABLE spotifyplaylist (episode_id INTEGER NOT NULL, name VARCHAR NOT NULL, "desc" VARCHAR NOT NULL, '
+    'spotify_id VARCHAR, id INTEGER NOT NULL, PRIMARY KEY (id), UNIQUE (spotify_id))',
+    'CREATE TABLE spinitronplaylist (spinitron_id INTEGER NOT NULL, episode_id INTEGER, timeslot DATETIME NOT NULL, '
+    'title VARCHAR NOT NULL, "desc" VARCHAR, id INTEGER NOT NULL, PRIMARY KEY (id), UNIQUE (spinitron_id), '
+    'UNIQUE (timeslot))',
+    'CREATE TABLE playlistitem ("index" INTEGER NOT NULL, song_id INTEGER NOT NULL, playlist_id INTEGER NOT NULL, '
+    'id INTEGER NOT NULL, PRIMARY KEY (id))',
+    'CREATE TABLE spin (spinitron_id INTEGER NOT NULL, artist VARCHAR NOT NULL, title VARCHAR NOT NULL, '
+    'album VARCHAR NOT NULL, year INTEGER NOT NULL, start_time TIME NOT NULL, number INTEGER NOT NULL, '
+    'playlist_id INTEGER, song_id INTEGER, id INTEGER NOT NULL, PRIMARY KEY (id), UNIQUE (spinitron_id))',
+    'CREATE TABLE song (artist VARCHAR NOT NULL, title VARCHAR NOT NULL, album VARCHAR NOT NULL, '
+    'year INTEGER NOT NULL, spotify_id VARCHAR, id INTEGER NOT NULL, PRIMARY KEY (id), UNIQUE (spotify_id))',
+]
+
+
+def indexes(engine):
+    insp = inspect(engine)
+    return {(table, ix['name']) for table in insp.get_table_names() for ix in insp.get_indexes(table)}
+
+
+class TestUpgrade(unittest.TestCase):
+    def engine(self, name):
+        path = os.path.join(ctx.TMP_DIR, name)
+        if os.path.exists(path):
+            os.remove(path)
+        return create_engine(f'sqlite:///{path}')
+
+    def test_fresh(self):
+        engine = self.engine('fresh.db')
+        self.assertEqual(migrations.upgrade(engine), migrations.latestVersion())
+        with engine.connect() as conn:
+            self.assertEqual(migrations.currentVersion(conn), migrations.latestVersion())
+        self.assertIn(('spin', 'ix_spin_song_id'), indexes(engine))
+
+    def test_old_database(self):
+        engine = self.engine('old.db')
+        with engine.begin() as conn:
+            for ddl in OLD_SCHEMA:
+                conn.execute(text(ddl))
+            conn.execute(text("INSERT INTO song (artist, title, album, year) VALUES ('a', 't', 'b', 1959)"))
+
+        self.assertEqual(migrations.upgrade(engine), migrations.latestVersion())
+        self.assertEqual(migrations.upgrade(engine), migrations.latestVersion())
+
+        columns = {c['name'] for c in inspect(engine).get_columns('spinitronplaylist')}
+        self.assertTrue({'content_hash', 'etag', 'fingerprint'} <= columns)
+        self.assertIn('checkpoint', inspect(engine).get_table_names())
+        with engine.connect() as conn:
+            self.assertEqual(conn.scalar(text('SELECT title FROM song')), 't')
+
+        fresh = self.engine('fresh-compare.db')
+        migrations.upgrade(fresh)
+        self.assertEqual(indexes(engine), indexes(fresh))
+
+
+class TestQueryPlans(unittest.TestCase):
+    def plan(self, stmt):
+        sql = str(stmt.compile(ctx.mondojazz.getEngine(), compile_kwargs={'literal_binds': True}))
+        with Session() as session:
+            return ' / '.join(row[-1] for row in session.execute(text(f'EXPLAIN QUERY PLAN {sql}')))
+
+    def test_unmapped_spins(self):
+        plan = self.plan(select(models.Spin).where(models.Spin.song == None))
+        self.assertIn('USING INDEX ix_spin_song_id', plan)
+
+    def test_song_lookup(self):
+        Song = models.Song
+        plan = self.plan(select(Song).where(Song.title == 't', Song.artist == 'a'))
+        self.assertIn('USING INDEX ix_song_title_artist (title=? AND artist=?)', plan)
+
+    def test_playlist_items(self):
+        PlaylistItem = models.PlaylistItem
+        plan = self.plan(select(PlaylistItem).where(PlaylistItem.playlist_id == 1))
+        self.assertIn('USING INDEX ix_playlistitem_playlist_id', plan)
+
+    def test_episode_join(self):
+        SpinitronPlaylist, Spin = models.SpinitronPlaylist, models.Spin
+        plan = self.plan(
+            select(SpinitronPlaylist, func.group_concat(Spin.song_id))
+            .join(SpinitronPlaylist.spins)
+            .group_by(SpinitronPlaylist))
+        self.assertIn('SEARCH spin USING INDEX ix_spin_playlist_id', plan)
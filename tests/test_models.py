@@ -1,4 +1,6 @@
 import logging
+import subprocess
+import sys
 import unittest
 
 from sqlalchemy import select, text
@@ -29,5 +31,18 @@ class TestSpinitronPlaylist(SessionSetup, unittest.TestCase):
         self.assertEqual(pls, [])
 
 
+class TestLazyInit(unittest.TestCase):
+    def test_no_spotify_client_on_import(self):
+        self.assertIsNone(ctx.mondojazz._spotify)
+
+    def test_spotify_module_then_mapper(self):
+        # a fresh interpreter, the modules above are imported already
+        code = ('import mondojazz.spotify, mondojazz.mapper, mondojazz\n'
+                'assert mondojazz.spotify.SpotifyClient\n'
+                'assert mondojazz.mapper.spotifyClient is mondojazz.spotifyClient\n'
+                'assert mondojazz._spotify is None\n')
+        subprocess.run([sys.executable, '-c', code], cwd=ctx.TESTS_DIR, check=True)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,47 @@
+import os
+import tempfile
+import unittest
+
+from . import context as ctx
+PageArchive = ctx.mondojazz.pagearchive.PageArchive
+
+
+class TestPageArchive(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'archive')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_append(self):
+        with PageArchive(self.path) as archive:
+            self.assertTrue(archive.append('http://x/pl/1/', 'one'))
+            self.assertFalse(archive.append('http://x/pl/1/', 'one'))
+            self.assertTrue(archive.append('http://x/pl/2/', 'two'))
+            self.assertTrue(archive.append('http://x/pl/1/', 'uno'))
+            self.assertEqual(archive.get('http://x/pl/1/'), 'uno')
+            self.assertIsNone(archive.get('http://x/pl/3/'))
+
+        with PageArchive(self.path) as archive:
+            self.assertEqual(len(archive), 2)
+            self.assertEqual([(url, body) for url, body, _ in archive],
+                             [('http://x/pl/2/', 'two'), ('http://x/pl/1/', 'uno')])
+            self.assertEqual([url for url, _, _ in archive.iter(lambda url: '/1/' in url)],
+                             ['http://x/pl/1/'])
+
+    def test_torn_append(self):
+        with PageArchive(self.path) as archive:
+            archive.append('http://x/pl/1/', 'one')
+            archive.append('http://x/pl/2/', 'two')
+        with open(os.path.join(self.path, 'pages.dat'), 'r+b') as fp:
+            fp.truncate(os.path.getsize(fp.name) - 1)
+        with open(os.path.join(self.path, 'pages.idx'), 'ab') as fp:
+            fp.write(b'torn')
+
+        with PageArchive(self.path) as archive:
+            self.assertEqual(len(archive), 1)
+            self.assertEqual(archive.get('http://x/pl/1/'), 'one')
+            archive.append('http://x/pl/2/', 'two')
+        with PageArchive(self.path) as archive:
+            self.assertEqual(archive.get('http://x/pl/2/'), 'two')
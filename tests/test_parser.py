@@ -70,7 +70,44 @@ class TestPlaylistPage(LoadFile, unittest.TestCase):
         for item in items:
             del item['start_time']
         self.assertEqual(items, self.correct)
-    
+
+
+@unittest.skipIf(ctx.mondojazz.parser.etree is None, 'lxml not installed')
+class TestBackends(LoadFile, unittest.TestCase):
+    _data = [
+        ('show.html', 'show', lambda fp: fp.read()),
+        ('show_last.html', 'show_last', lambda fp: fp.read()),
+        ('pl1.html', 'pl1', lambda fp: fp.read()),
+    ]
+
+    def assertSameItems(self, cls, markup):
+        bs4, lxml = cls(markup, 'bs4'), cls(markup, 'lxml')
+        self.assertEqual(repr(bs4.getItems()), repr(lxml.getItems()))
+        return bs4, lxml
+
+    def test_show(self):
+        for markup in [self.show, self.show_last]:
+            bs4, lxml = self.assertSameItems(ShowPage, markup)
+            self.assertEqual(bs4.getNextPageNum(), lxml.getNextPageNum())
+
+    def test_playlist(self):
+        self.assertSameItems(PlaylistPage, self.pl1)
+
+    def test_unknown_backend(self):
+        with self.assertRaises(ValueError):
+            PlaylistPage(self.pl1, 'regex')
+
+
+class TestParsePool(LoadFile, unittest.TestCase):
+    _data = [
+        ('pl1.html', 'pl1', lambda fp: fp.read()),
+    ]
+
+    def test_same_items(self):
+        pool = ctx.mondojazz.scraper.getParsePool(2)
+        items = list(pool.map(ctx.mondojazz.parser.parsePlaylistMarkup, [self.pl1] * 3))
+        self.assertEqual(items, [PlaylistPage(self.pl1).getItems()] * 3)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,149 @@
+from collections import Counter
+import threading
+import time
+import unittest
+from unittest import mock
+
+from sqlalchemy import delete, func, select
+
+from benchmarks.fakes import Archive, FakeSpinitron
+
+from . import context as ctx
+mapper = ctx.mondojazz.mapper
+models = ctx.mondojazz.models
+scraper = ctx.mondojazz.scraper
+Session = ctx.mondojazz.Session
+pipeline = ctx.mondojazz.pipeline
+Pipeline = pipeline.Pipeline
+
+# first spin of every playlist of the fake archive
+THEME = ('Mondo Jazz Theme (feat. Ted Nash & Pyeng Threadgill)', 'Ben Allison')
+
+
+class FakeSearch:
+    """Search answering with the track the query asks for, slowly enough
+    for match workers to overlap."""
+
+    def __init__(self):
+        self.queries = Counter()
+        self.lock = threading.Lock()
+
+    def search_track(self, q):
+        with self.lock:
+            self.queries[(q[''], q['artist'])] += 1
+        time.sleep(0.005)
+        return [{'id': f'{q[""]}|{q["artist"]}', 'track': q[''], 'artist': q['artist'],
+                 'album': q.get('album', ''), 'date': str(q.get('year', 2000))}]
+
+    def stats(self):
+        return {}
+
+
+class FakeSpotify:
+    """Playlist calls of SpotifyClient used by publishEpisode."""
+
+    def __init__(self):
+        self.playlists = {}
+        self.lock = threading.Lock()
+
+    def create_playlist(self, name, description):
+        with self.lock:
+            playlist_id = f'pl{len(self.playlists)}'
+            self.playlists[playlist_id] = []
+        return playlist_id
+
+    def replace_playlist_items(self, playlist_id, items):
+        self.playlists[playlist_id] = list(items)
+        return f'{playlist_id}-1'
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        # 6 episodes aired twice, drawing 12 spins from 15 songs
+        self.archive = Archive(episodes=6, rebroadcast=2, spins=12, pool_size=15)
+        self.spinitron = FakeSpinitron(self.archive).start()
+        self.addCleanup(self.spinitron.stop)
+        self.search = FakeSearch()
+        self.spotify = FakeSpotify()
+        url = scraper.SPINITRON_URL
+        self.addCleanup(scraper.setBaseUrl, url)
+        scraper.setBaseUrl(self.spinitron.url)
+        for target, name, value in [(scraper, 'cache', None), (scraper, 'archive', None),
+                                    (mapper, 'search', self.search),
+                                    (mapper, 'spotifyClient', self.spotify)]:
+            patch = mock.patch.object(target, name, value)
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def tearDown(self):
+        with Session() as session, session.begin():
+            for model in [models.PlaylistItem, models.SpotifyPlaylist, models.Spin,
+                          models.SpinitronPlaylist, models.Episode, models.Song]:
+                session.execute(delete(model))
+
+    def count(self, model, *where):
+        with Session() as session:
+            return session.scalar(select(func.count()).select_from(model).where(*where))
+
+    def test_run(self):
+        stats = Pipeline(fetch_workers=3, match_workers=4, queue_size=4).run()
+        self.assertEqual(stats['discovered'], 12)
+        self.assertEqual(stats['written'], 12)
+        self.assertEqual(self.count(models.Spin), 12 * 13)
+        self.assertEqual(self.count(models.Spin, models.Spin.song_id == None), 0)
+        self.assertEqual(self.count(models.Episode), 6)
+
+        # every song searched once, however many workers met it at the same time
+        songs = {(song['title'], song['artist'])
+                 for k in range(len(self.archive))
+                 for song in map(Archive.song, self.archive.songs(k))}
+        self.assertEqual(max(self.search.queries.values()), 1)
+        self.assertEqual(set(self.search.queries), songs | {THEME})
+        self.assertEqual(self.count(models.Song), len(self.search.queries))
+
+        # nothing new on the next run
+        self.search.queries.clear()
+        stats = Pipeline().run()
+        self.assertEqual(stats['discovered'], 0)
+        self.assertEqual(self.search.queries, {})
+
+    def test_publish(self):
+        stats = Pipeline(publish=True).run()
+        self.assertEqual(stats['published'], 6)
+        self.assertEqual(len(self.spotify.playlists), 6)
+        # the theme is left out
+        self.assertEqual(sorted(map(len, self.spotify.playlists.values())), [12] * 6)
+        self.assertEqual(self.count(models.SpotifyPlaylist, models.SpotifyPlaylist.snapshot_id != None), 6)
+
+    def test_search_error(self):
+        with mock.patch.object(self.search, 'search_track', side_effect=ValueError('down')):
+            stats = Pipeline().run()
+        # spins are stored unmapped, the songs are searched again on the next match
+        self.assertEqual(stats['written'], 12)
+        self.assertEqual(self.count(models.Spin, models.Spin.song_id != None), 0)
+        self.assertEqual(self.count(models.Song), 0)
+
+    def test_failed_fetch(self):
+        fetch = pipeline.fetchPlaylistPage
+
+        def failOldest(pl_id):
+            if pl_id == Archive.FIRST_ID:
+                raise scraper.requests.HTTPError('503 Error')
+            return fetch(pl_id)
+
+        with mock.patch.object(pipeline, 'fetchPlaylistPage', failOldest):
+            stats = Pipeline().run()
+        self.assertEqual(stats['written'], 11)
+        self.assertEqual(self.count(models.SpinitronPlaylist), 11)
+        # the first episode aired is missing, none is numbered before it is stored
+        self.assertEqual(self.count(models.Episode), 0)
+
+        stats = Pipeline().run()
+        self.assertEqual((stats['discovered'], stats['written']), (1, 1))
+        self.assertEqual(self.count(models.Spin), 12 * 13)
+        with Session() as session:
+            numbers = session.execute(
+                select(models.SpinitronPlaylist.spinitron_id, models.Episode.number)
+                .join(models.SpinitronPlaylist.episode)
+                .order_by(models.SpinitronPlaylist.timeslot)).all()
+        self.assertEqual(numbers, [(Archive.FIRST_ID + k, k // 2 + 1) for k in range(12)])
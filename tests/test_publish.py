@@ -0,0 +1,106 @@
+from datetime import datetime, timedelta
+import json
+import os
+import unittest
+from unittest import mock
+
+from sqlalchemy import delete, select
+
+from . import context as ctx
+from .test_spotify import FlakySpotify
+mapper = ctx.mondojazz.mapper
+models = ctx.mondojazz.models
+Session = ctx.mondojazz.Session
+SpotifyClient = ctx.mondojazz.spotify.SpotifyClient
+
+
+class RecordingSpotify(FlakySpotify):
+    """FlakySpotify keeping the method and number of tracks of every playlist upload."""
+
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self.uploads = []
+
+    def respond(self, method, path, query, headers, body):
+        if path.endswith('/tracks') and method in ('PUT', 'POST'):
+            self.uploads.append((method, len(json.loads(body)['uris'])))
+        return super().respond(method, path, query, headers, body)
+
+
+class TestPublishEpisodes(unittest.TestCase):
+    def setUp(self):
+        self.server = RecordingSpotify().start()
+        self.addCleanup(self.server.stop)
+        with mock.patch.dict(os.environ, dict(self.server.env(), SPOTIFY_RATE='1000')):
+            client = SpotifyClient()
+        patch = mock.patch.object(mapper, 'spotifyClient', client)
+        patch.start()
+        self.addCleanup(patch.stop)
+        # episode 1 has a theme, 250 matched spins, 10 unmatched and 5 unmapped
+        self.addEpisode(1, 250, unmatched=10, unmapped=5)
+
+    def tearDown(self):
+        with Session() as session, session.begin():
+            for model in [models.PlaylistItem, models.SpotifyPlaylist, models.Spin,
+                          models.SpinitronPlaylist, models.Episode, models.Song]:
+                session.execute(delete(model))
+
+    def addEpisode(self, number, matched, unmatched=0, unmapped=0):
+        songs = [models.Song(title=f'Song {number}.{i}', artist='Artist', album='', year=0,
+                             spotify_id=f't{number}x{i}' if i < matched else None)
+                 for i in range(matched + unmatched)]
+        songs[matched:matched] = [None] * unmapped
+        with Session() as session, session.begin():
+            stpl = models.SpinitronPlaylist(spinitron_id=number, timeslot=datetime(2024, 1, number, 8),
+                                            title=f'Show {number}')
+            stpl.episode = models.Episode(number=number)
+            start = datetime(2024, 1, 1, 8)
+            # the theme goes first, here a song spun again later
+            for i, song in enumerate(songs[:1] + songs):
+                spin = models.Spin(spinitron_id=number * 1000 + i, artist='Artist', title='Song',
+                                   album='', year=0, number=i,
+                                   start_time=(start + timedelta(seconds=i)).time())
+                spin.song = song
+                stpl.spins.append(spin)
+            session.add(stpl)
+        return [f't{number}x{i}' for i in range(matched)]
+
+    def remote(self, number):
+        with Session() as session:
+            pl = session.scalars(
+                select(models.SpotifyPlaylist).join(models.SpotifyPlaylist.episode)
+                .where(models.Episode.number == number)).one()
+            uris = self.server.playlists[pl.spotify_id]['uris']
+            return pl.spotify_id, pl.snapshot_id, len(pl.items), [uri.rsplit(':', 1)[1] for uri in uris]
+
+    def test_publish(self):
+        [result] = mapper.publishEpisodes()
+        self.assertIsNone(result['error'])
+        # replaced with the first 100 tracks, the others added 100 at a time
+        self.assertEqual(self.server.uploads, [('PUT', 100), ('POST', 100), ('POST', 50)])
+        _, snapshot_id, items, tracks = self.remote(1)
+        self.assertEqual(tracks, [f't1x{i}' for i in range(250)])
+        self.assertEqual(snapshot_id, result['snapshot_id'])
+        self.assertEqual(items, 250)
+
+        self.server.uploads.clear()
+        self.assertEqual(mapper.publishEpisodes(), [])
+        self.assertEqual(self.server.uploads, [])
+
+    def test_failed_upload(self):
+        tracks = self.addEpisode(2, 3)
+        # creating the playlist of episode 2 works, filling it does not
+        self.server.errors = [None, 400]
+        [result] = mapper.publishEpisodes([2])
+        self.assertIsNotNone(result['error'])
+        spotify_id, snapshot_id, _, remote = self.remote(2)
+        self.assertEqual((spotify_id, snapshot_id), (result['spotify_id'], None))
+        self.assertEqual(remote, [])
+
+        # the next run fills the same playlist
+        [result] = mapper.publishEpisodes([2])
+        self.assertIsNone(result['error'])
+        _, snapshot_id, _, remote = self.remote(2)
+        self.assertEqual(remote, tracks)
+        self.assertIsNotNone(snapshot_id)
+        self.assertEqual(len(self.server.playlists), 1)
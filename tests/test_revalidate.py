@@ -0,0 +1,124 @@
+from datetime import datetime, time, timedelta
+import unittest
+from unittest import mock
+
+from sqlalchemy import delete, select
+
+from . import context as ctx
+mapper = ctx.mondojazz.mapper
+models = ctx.mondojazz.models
+Session = ctx.mondojazz.Session
+
+
+class FakeSpotify:
+    """In-memory stand-in for the track lookups and searches of SpotifyClient."""
+
+    MAX_TRACK_IDS = 50
+
+    def __init__(self, dead=()):
+        self.dead = set(dead)
+        self.lookups = []
+        self.searches = 0
+
+    def map(self, func, items, max_workers=8):
+        for item in items:
+            yield item, func(item)
+
+    def get_tracks(self, ids, market='from_token'):
+        self.lookups.append(len(ids))
+        return [None if i in self.dead else
+                {'id': i, 'is_playable': True, 'album': {'name': 'Album', 'release_date': '1959-08-17'}}
+                for i in ids]
+
+    def search_track(self, hints):
+        self.searches += 1
+        return [{'id': 'dead0', 'track': 'Song 0', 'artist': 'Artist', 'album': '', 'date': '1959'},
+                {'id': 'new0', 'track': 'Song 0', 'artist': 'Artist', 'album': '', 'date': '1959'}]
+
+
+class TestRevalidateSongs(unittest.TestCase):
+    def setUp(self):
+        self.spotify = FakeSpotify(dead={'dead0', 'dead1'})
+        for name in ['spotifyClient', 'search']:
+            patch = mock.patch.object(mapper, name, self.spotify)
+            patch.start()
+            self.addCleanup(patch.stop)
+        with Session() as session, session.begin():
+            session.add_all([models.Song(title=f'Song {i}', artist='Artist', album='', year=0,
+                                         spotify_id=f't{i}') for i in range(120)])
+            session.add_all([models.Song(title=f'Song {i}', artist='Artist', album='', year=0,
+                                         spotify_id=f'dead{i}') for i in range(2)])
+            session.add(models.Song(title='Unmatched', artist='Artist', album='', year=0))
+
+    def tearDown(self):
+        with Session() as session, session.begin():
+            for model in [models.Spin, models.SpinitronPlaylist, models.Episode, models.Song]:
+                session.execute(delete(model))
+
+    def addEpisode(self, spotify_ids):
+        """Fingerprinted episode 1 spinning a theme then the songs of spotify_ids."""
+        with Session() as session, session.begin():
+            songs = [session.scalars(select(models.Song).filter_by(spotify_id=i)).one() for i in spotify_ids]
+            stpl = models.SpinitronPlaylist(spinitron_id=1, timeslot=datetime(2024, 1, 1, 8), title='Show',
+                                            fingerprint='stored')
+            stpl.episode = models.Episode(number=1)
+            for i, song in enumerate(songs[:1] + songs):
+                stpl.spins.append(models.Spin(spinitron_id=i, artist='Artist', title='Song', album='', year=0,
+                                              start_time=time(8, i), number=i, song=song))
+            session.add(stpl)
+
+    def song(self, **where):
+        with Session() as session:
+            return session.scalars(select(models.Song).filter_by(**where)).one()
+
+    def test_revalidate(self):
+        stats = mapper.revalidateSongs()
+        self.assertEqual(self.spotify.lookups, [50, 50, 22])
+        self.assertEqual(stats['checked'], 122)
+        self.assertEqual(stats['dead'], 2)
+
+        song = self.song(spotify_id='t5')
+        self.assertTrue(song.playable)
+        self.assertEqual((song.album, song.year), ('Album', 1959))
+        self.assertIsNotNone(song.checked_at)
+
+        # searches still return the dead track, it is skipped
+        self.assertEqual(stats['rematched'], 2)
+        song = self.song(spotify_id='new0')
+        self.assertTrue(song.playable)
+        # its replacement is already stored under another song, which takes its spins
+        self.assertFalse(self.song(title='Song 1', spotify_id=None).playable)
+
+        self.spotify.lookups.clear()
+        mapper.revalidateSongs(max_age=timedelta(days=1))
+        self.assertEqual(self.spotify.lookups, [])
+
+    def test_moved_spins(self):
+        self.addEpisode(['t0', 'dead1', 't1'])
+        mapper.revalidateSongs()
+        with Session() as session:
+            stpl = session.scalars(select(models.SpinitronPlaylist)).one()
+            self.assertEqual([spin.song.spotify_id for spin in stpl.spins], ['t0', 't0', 'new0', 't1'])
+            # its songs changed, updateEpisodes fingerprints it again
+            self.assertIsNone(stpl.fingerprint)
+
+    def test_no_rematch(self):
+        stats = mapper.revalidateSongs(rematch=False)
+        self.assertEqual(stats['dead'], 2)
+        self.assertEqual(self.spotify.searches, 0)
+        song = self.song(spotify_id='dead1')
+        self.assertFalse(song.playable)
+
+        # the next run rematches the flagged songs, recent as their check is
+        self.spotify.lookups.clear()
+        stats = mapper.revalidateSongs(max_age=timedelta(days=1))
+        self.assertEqual(self.spotify.lookups, [2])
+        self.assertEqual(stats['rematched'], 2)
+        self.assertTrue(self.song(spotify_id='new0').playable)
+
+    def test_unplayable_not_published(self):
+        self.addEpisode(['t0', 't1', 'dead0', 't2'])
+        mapper.revalidateSongs(rematch=False)
+        with Session() as session:
+            ep = session.scalars(select(models.Episode)).one()
+            self.assertEqual([song.spotify_id for song in mapper.getEpisodeSongs(ep)], ['t0', 't1', 't2'])
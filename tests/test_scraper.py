@@ -0,0 +1,167 @@
+from datetime import datetime, time, timedelta
+import os
+import threading
+import unittest
+from unittest import mock
+
+from sqlalchemy import delete, select
+
+from . import context as ctx
+scraper = ctx.mondojazz.scraper
+models = ctx.mondojazz.models
+Session = ctx.mondojazz.Session
+
+START = datetime(2024, 1, 1, 8)
+
+
+class FakeShowPages:
+    """parseShowPage stand-in listing n playlists a day apart, newest first."""
+
+    def __init__(self, n, per_page=20):
+        self.n = n
+        self.per_page = per_page
+        self.requested = []
+        self.lock = threading.Lock()
+
+    def __call__(self, page):
+        with self.lock:
+            self.requested.append(page)
+        newest = self.n - 1 - (page - 1) * self.per_page
+        items = [{'spinitron_id': k, 'timeslot': START + timedelta(days=k)}
+                 for k in range(newest, max(newest - self.per_page, -1), -1)]
+        return items, page + 1 if newest - self.per_page >= 0 else None
+
+
+class TestShowPages(unittest.TestCase):
+    def genPages(self, n, **kw):
+        with mock.patch.object(scraper, 'parseShowPage', FakeShowPages(n)) as fake:
+            return [(page, len(items)) for page, items in scraper.genShowPages(**kw)], fake
+
+    def test_read_ahead(self):
+        serial, _ = self.genPages(95, read_ahead=0)
+        self.assertEqual(serial, [(1, 20), (2, 20), (3, 20), (4, 20), (5, 15)])
+        ahead, fake = self.genPages(95, read_ahead=3)
+        self.assertEqual(ahead, serial)
+        # at most read_ahead pages past the last one, unless cancelled in time
+        self.assertLessEqual(max(fake.requested), 8)
+
+    def test_last_page(self):
+        pages, fake = self.genPages(95, read_ahead=3, last_page=2)
+        self.assertEqual(pages, [(1, 20), (2, 20)])
+        self.assertEqual(sorted(fake.requested), [1, 2])
+
+    def test_find_boundary(self):
+        fake = FakeShowPages(10000)
+        with mock.patch.object(scraper, 'parseShowPage', fake):
+            for k in [9999, 9990, 9979, 5000, 1234, 0]:
+                page = scraper.findBoundaryPage(START + timedelta(days=k))
+                self.assertEqual(page, (9999 - k) // 20 + 1)
+            self.assertEqual(scraper.findBoundaryPage(START - timedelta(days=1)), 500)
+        self.assertLess(len(fake.requested) / 7, 20)
+
+
+def makeSpins(n, start=0):
+    return [{'spinitron_id': k, 'artist': f'Artist {k}', 'title': f'Title {k}', 'album': '',
+             'year': 2000, 'start_time': time(8, k % 60)} for k in range(start, start + n)]
+
+
+class FakeResponse:
+    def __init__(self, text, status_code=200):
+        self.text = text
+        self.status_code = status_code
+        self.headers = {}
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise scraper.requests.HTTPError(f'{self.status_code} Error', response=self)
+
+
+class TestStorePlaylistSpins(unittest.TestCase):
+    def setUp(self):
+        with Session() as session, session.begin():
+            session.add(models.SpinitronPlaylist(spinitron_id=1, timeslot=START, title='Show'))
+
+    def tearDown(self):
+        with Session() as session, session.begin():
+            for model in [models.Spin, models.SpinitronPlaylist, models.Song]:
+                session.execute(delete(model))
+
+    def store(self, spins, etag=None):
+        with Session() as session, session.begin():
+            stpl = session.scalars(select(models.SpinitronPlaylist)).one()
+            return scraper.storePlaylistSpins(stpl, spins, session, etag)
+
+    def stored(self):
+        with Session() as session:
+            return {spin.spinitron_id: spin for spin in session.scalars(select(models.Spin))}
+
+    def test_spins_hash(self):
+        spins = makeSpins(3)
+        self.assertEqual(scraper.spinsHash(spins), scraper.spinsHash(makeSpins(3)))
+        self.assertNotEqual(scraper.spinsHash(spins), scraper.spinsHash(spins[::-1]))
+        edited = makeSpins(3)
+        edited[1]['album'] = 'Live'
+        self.assertNotEqual(scraper.spinsHash(spins), scraper.spinsHash(edited))
+
+    def test_diff(self):
+        self.assertEqual(self.store(makeSpins(4)), (4, 0, 0))
+        self.assertEqual(self.store(makeSpins(4)), (0, 0, 0))
+        with Session() as session, session.begin():
+            song = models.Song(title='Title 1', artist='Artist 1', album='', year=0)
+            session.add(song)
+            session.flush()
+            for spin in session.scalars(select(models.Spin)):
+                spin.song_id = song.id
+
+        spins = makeSpins(4)[1:] + makeSpins(1, start=10)
+        spins[0]['year'] = 1999
+        spins[1]['title'] = 'Other'
+        self.assertEqual(self.store(spins), (1, 3, 1))
+        stored = self.stored()
+        self.assertEqual(sorted(stored), [1, 2, 3, 10])
+        self.assertEqual([stored[k].number for k in [1, 2, 3, 10]], [0, 1, 2, 3])
+        # edited details keep the song, an edited title loses it
+        self.assertEqual(stored[1].year, 1999)
+        self.assertIsNotNone(stored[1].song_id)
+        self.assertIsNone(stored[2].song_id)
+        self.assertIsNotNone(stored[3].song_id)
+
+    def test_etag(self):
+        self.assertEqual(self.store(makeSpins(2), etag='"a"'), (2, 0, 0))
+        self.assertEqual(self.store(makeSpins(3), etag='"a"'), (0, 0, 0))
+        self.assertEqual(self.store(makeSpins(3), etag='"b"'), (1, 0, 0))
+
+    def test_failed_fetch_keeps_spins(self):
+        with open(os.path.join(ctx.DATA_DIR, 'pl1.html')) as fp:
+            page = fp.read()
+        responses = [FakeResponse(page), FakeResponse('<html>Service Unavailable</html>', 503),
+                     FakeResponse('', 200)]
+        with mock.patch.object(scraper, 'cache', None), \
+             mock.patch.object(scraper.http, 'get', side_effect=responses):
+            for _ in responses:
+                with Session() as session, session.begin():
+                    scraper.scrapeSpinsOf(session.scalars(select(models.SpinitronPlaylist)).all(), session)
+                self.assertEqual(len(self.stored()), 20)
+
+
+class TestFetchPlaylistPages(unittest.TestCase):
+    def fakePage(self, pl_id):
+        if pl_id == 2:
+            raise ValueError('unparsable')
+        if pl_id == 3:
+            raise scraper.requests.HTTPError('503 Error')
+        return [{'spinitron_id': pl_id}], None
+
+    def test_failed_pages(self):
+        with mock.patch.object(scraper, 'fetchPlaylistPage', self.fakePage):
+            pages = dict(scraper.fetchPlaylistPages(range(5), max_workers=2, parse_workers=0))
+        self.assertEqual(sorted(pages), [0, 1, 2, 3, 4])
+        self.assertIsNone(pages[2])
+        self.assertIsNone(pages[3])
+        self.assertEqual(pages[4], ([{'spinitron_id': 4}], None))
+
+    def test_raise_for_status(self):
+        with mock.patch.object(scraper, 'cache', None), \
+             mock.patch.object(scraper.http, 'get', return_value=FakeResponse('Not Found', 404)):
+            with self.assertRaises(scraper.requests.HTTPError):
+                scraper.fetchWithEtag(scraper.PLAYLIST_FMT.format(1))
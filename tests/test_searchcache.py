@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from . import context as ctx
+SearchCache = ctx.mondojazz.searchcache.SearchCache
+normalizeQuery = ctx.mondojazz.searchcache.normalizeQuery
+
+
+class FakeClient:
+    def __init__(self, results):
+        self.results = results
+        self.queries = []
+
+    def search_track(self, hints):
+        self.queries.append(hints)
+        return self.results
+
+
+class TestSearchCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'cache.db')
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_normalize(self):
+        self.assertEqual(
+            normalizeQuery({'': 'Un  Poco Loco', 'year': 2024}),
+            normalizeQuery({'year': '2024', '': 'un poco loco '}))
+
+    def test_hit(self):
+        client = FakeClient([{'id': 'x'}])
+        cache = SearchCache(client, self.path)
+        self.assertEqual(cache.search_track({'': 'a'}), [{'id': 'x'}])
+        self.assertEqual(cache.search_track({'': 'A'}), [{'id': 'x'}])
+        self.assertEqual(len(client.queries), 1)
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+    def test_negative_persisted(self):
+        client = FakeClient([])
+        SearchCache(client, self.path).search_track({'': 'a'})
+        cache = SearchCache(client, self.path)
+        self.assertEqual(cache.search_track({'': 'a'}), [])
+        self.assertEqual(len(client.queries), 1)
+
+    def test_expired(self):
+        client = FakeClient([])
+        cache = SearchCache(client, self.path, max_age=-1)
+        cache.search_track({'': 'a'})
+        cache.search_track({'': 'a'})
+        self.assertEqual(len(client.queries), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+from collections import Counter
+import os
+import time
+import unittest
+from unittest import mock
+import urllib.error
+
+from benchmarks.fakes import FakeSpotify
+
+from . import context as ctx
+spotify = ctx.mondojazz.spotify
+
+
+class FlakySpotify(FakeSpotify):
+    """FakeSpotify answering the next API requests with the statuses in errors."""
+
+    def __init__(self, **kw):
+        super().__init__(**kw)
+        self.errors = []
+        self.methods = Counter()
+
+    def respond(self, method, path, query, headers, body):
+        if path != '/api/token':
+            with self.lock:
+                self.methods[method] += 1
+                status = self.errors.pop(0) if self.errors else None
+            if status:
+                return status, {}, {'error': {'status': status}}
+        return super().respond(method, path, query, headers, body)
+
+
+class TestTokenBucket(unittest.TestCase):
+    def test_rate(self):
+        bucket = spotify.TokenBucket(rate=200, burst=5)
+        start = time.monotonic()
+        for _ in range(5):
+            bucket.acquire()
+        self.assertLess(time.monotonic() - start, 0.02)
+        for _ in range(20):
+            bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 20 / 200 - 0.01)
+
+    def test_pause(self):
+        bucket = spotify.TokenBucket(rate=1000, burst=5)
+        bucket.pause(0.1)
+        start = time.monotonic()
+        bucket.acquire()
+        self.assertGreaterEqual(time.monotonic() - start, 0.09)
+
+
+class TestSpotifyClient(unittest.TestCase):
+    def client(self, **kw):
+        server = FlakySpotify(**kw).start()
+        self.addCleanup(server.stop)
+        env = dict(server.env(), SPOTIFY_RATE='1000')
+        with mock.patch.dict(os.environ, env):
+            client = spotify.SpotifyClient()
+        server.methods.clear()
+        server.count = 0
+        return client, server
+
+    def test_retry_after(self):
+        client, server = self.client(rate_limit_every=2, retry_after=0.2)
+        start = time.monotonic()
+        for _ in range(2):
+            self.assertEqual(client.call('/me'), {'id': server.USER_ID})
+        # the second call is rate limited once and held back for Retry-After
+        self.assertGreaterEqual(time.monotonic() - start, 0.2)
+        self.assertEqual(server.methods['GET'], 3)
+
+    def test_server_errors(self):
+        client, server = self.client()
+        playlist_id = client.create_playlist('Episode', 'Description')
+        with mock.patch.object(client, 'BACKOFF', 0.001):
+            server.errors = [503, 502]
+            self.assertTrue(client.replace_playlist_items(playlist_id, ['a', 'b']))
+            self.assertEqual(client.get_playlist_tracks(playlist_id), ['a', 'b'])
+            self.assertEqual(server.methods['PUT'], 3)
+
+            # a POST may have gone through, it is not sent again
+            server.errors = [503]
+            with self.assertRaises(urllib.error.HTTPError) as cm:
+                client.add_items_to_playlist(playlist_id, ['c'])
+            self.assertEqual(cm.exception.code, 503)
+            self.assertEqual(server.methods['POST'], 2)
+
+            server.errors = [404]
+            with self.assertRaises(urllib.error.HTTPError):
+                client.call('/me')
+
+    def test_single_refresh(self):
+        client, server = self.client()
+        server.expireTokens()
+        results = list(client.map(lambda _: client.call('/me'), range(16), max_workers=8))
+        self.assertEqual([r for _, r in results], [{'id': server.USER_ID}] * 16)
+        # the threads that got a 401 share one refresh
+        self.assertEqual(len(server.tokens), 1)
@@ -0,0 +1,160 @@
+from collections import Counter
+from datetime import datetime, time
+import random
+import unittest
+from unittest import mock
+
+from sqlalchemy import delete, select
+
+from . import context as ctx
+mapper = ctx.mondojazz.mapper
+models = ctx.mondojazz.models
+Session = ctx.mondojazz.Session
+
+
+def applyOps(tracks, ops):
+    tracks = list(tracks)
+    for op, *args in ops:
+        if op == 'remove':
+            tracks = [t for t in tracks if t not in args[0]]
+        elif op == 'move':
+            start, before = args
+            t = tracks.pop(start)
+            tracks.insert(before if before < start else before - 1, t)
+        else:
+            ids, position = args
+            tracks[position:position] = ids
+    return tracks
+
+
+class FakeSpotify:
+    """In-memory stand-in for the playlist calls of SpotifyClient."""
+
+    MAX_PLAYLIST_ITEMS = 100
+
+    def __init__(self):
+        self.playlists = {}
+        self.calls = Counter()
+
+    def map(self, func, items, max_workers=8):
+        for item in items:
+            yield item, func(item)
+
+    def edit(self, playlist_id, tracks):
+        pl = self.playlists[playlist_id]
+        pl['tracks'] = tracks
+        pl['version'] += 1
+        return f'{playlist_id}-{pl["version"]}'
+
+    def create_playlist(self, name, description):
+        self.calls['create'] += 1
+        playlist_id = f'pl{len(self.playlists)}'
+        self.playlists[playlist_id] = {'tracks': [], 'version': 0}
+        return playlist_id
+
+    def get_playlist_snapshot(self, playlist_id):
+        self.calls['snapshot'] += 1
+        return f'{playlist_id}-{self.playlists[playlist_id]["version"]}'
+
+    def get_playlist_tracks(self, playlist_id):
+        self.calls['tracks'] += 1
+        return list(self.playlists[playlist_id]['tracks'])
+
+    def remove_playlist_items(self, playlist_id, items, snapshot_id=None):
+        self.calls['remove'] += 1
+        return self.edit(playlist_id, applyOps(self.playlists[playlist_id]['tracks'], [('remove', items)]))
+
+    def reorder_playlist_items(self, playlist_id, range_start, insert_before, range_length=1, snapshot_id=None):
+        self.calls['move'] += 1
+        ops = [('move', range_start, insert_before)]
+        return self.edit(playlist_id, applyOps(self.playlists[playlist_id]['tracks'], ops))
+
+    def add_items_to_playlist(self, playlist_id, items, position=None):
+        self.calls['add'] += 1
+        tracks = self.playlists[playlist_id]['tracks']
+        position = len(tracks) if position is None else position
+        return self.edit(playlist_id, applyOps(tracks, [('add', items, position)]))
+
+
+class TestDiffPlaylistItems(unittest.TestCase):
+    def test_minimal(self):
+        self.assertEqual(mapper.diffPlaylistItems(list('abcde'), list('abcde')), [])
+        self.assertEqual(mapper.diffPlaylistItems(list('abcde'), list('abxcde')), [('add', ['x'], 2)])
+        self.assertEqual(mapper.diffPlaylistItems(list('abcde'), list('eabcd')), [('move', 4, 0)])
+        self.assertEqual(mapper.diffPlaylistItems(list('abcde'), list('abde')), [('remove', ['c'])])
+        self.assertEqual(mapper.diffPlaylistItems(list('abcde'), list('axyde')),
+                         [('remove', ['b', 'c']), ('add', ['x', 'y'], 1)])
+
+    def test_random(self):
+        rnd = random.Random(0)
+        for _ in range(2000):
+            current = rnd.choices('abcdefghij', k=rnd.randint(0, 12))
+            desired = rnd.sample(current, len(current)) if rnd.random() < 0.5 else current[:]
+            for _ in range(rnd.randint(0, 3)):
+                desired.insert(rnd.randint(0, len(desired)), rnd.choice('abcdefghijxyz'))
+            if desired and rnd.random() < 0.5:
+                desired.pop(rnd.randrange(len(desired)))
+            ops = mapper.diffPlaylistItems(current, desired)
+            self.assertEqual(applyOps(current, ops), desired, (current, desired, ops))
+
+
+class TestSyncEpisodes(unittest.TestCase):
+    def setUp(self):
+        self.spotify = FakeSpotify()
+        patch = mock.patch.object(mapper, 'spotifyClient', self.spotify)
+        patch.start()
+        self.addCleanup(patch.stop)
+        with Session() as session, session.begin():
+            self.songs = [models.Song(title=f'Song {i}', artist='Artist', album='', year=0,
+                                      spotify_id=f't{i}') for i in range(10)]
+            stpl = models.SpinitronPlaylist(spinitron_id=1, timeslot=datetime(2024, 1, 1), title='Show')
+            stpl.episode = models.Episode(number=1)
+            for i in range(5):
+                spin = models.Spin(spinitron_id=i, artist='Artist', title=f'Song {i}', album='', year=0,
+                                   start_time=time(8, i), number=i)
+                spin.song = self.songs[i]
+                stpl.spins.append(spin)
+            session.add_all([stpl, *self.songs])
+
+    def tearDown(self):
+        with Session() as session, session.begin():
+            for model in [models.PlaylistItem, models.SpotifyPlaylist, models.Spin,
+                          models.SpinitronPlaylist, models.Episode, models.Song]:
+                session.execute(delete(model))
+
+    def setSong(self, number, song_number):
+        with Session() as session, session.begin():
+            spin = session.scalars(select(models.Spin).where(models.Spin.number == number)).one()
+            spin.song = session.scalars(
+                select(models.Song).where(models.Song.spotify_id == f't{song_number}')).one()
+
+    def sync(self):
+        self.spotify.calls.clear()
+        [result] = mapper.syncEpisodes([1])
+        self.assertIsNone(result['error'])
+        with Session() as session:
+            pl = session.scalars(select(models.SpotifyPlaylist)).one()
+            items = sorted(pl.items, key=lambda item: item.index)
+            remote = self.spotify.playlists[pl.spotify_id]
+            self.assertEqual([item.track_id for item in items], remote['tracks'])
+            self.assertEqual(pl.snapshot_id, f'{pl.spotify_id}-{remote["version"]}')
+            return pl.spotify_id, [item.track_id for item in items]
+
+    def test_sync(self):
+        playlist_id, tracks = self.sync()
+        self.assertEqual(tracks, ['t1', 't2', 't3', 't4'])
+        self.assertEqual(self.spotify.calls, {'create': 1, 'add': 1})
+
+        _, tracks = self.sync()
+        self.assertEqual(self.spotify.calls, {'snapshot': 1})
+
+        self.setSong(2, 7)
+        _, tracks = self.sync()
+        self.assertEqual(tracks, ['t1', 't7', 't3', 't4'])
+        self.assertEqual(self.spotify.calls, {'snapshot': 1, 'remove': 1, 'add': 1})
+
+        # edited on Spotify: read back and fixed
+        self.spotify.edit(playlist_id, ['t4', 't1', 't7', 't3'])
+        _, tracks = self.sync()
+        self.assertEqual(tracks, ['t1', 't7', 't3', 't4'])
+        self.assertEqual(self.spotify.calls, {'snapshot': 1, 'tracks': 1, 'move': 1})
@@ -0,0 +1,82 @@
+from datetime import datetime, time
+import unittest
+from unittest import mock
+
+from sqlalchemy import delete, insert, update
+
+from . import context as ctx
+textsearch = ctx.mondojazz.textsearch
+models = ctx.mondojazz.models
+Session = ctx.mondojazz.Session
+
+SPINS = [
+    ('John Coltrane', 'Naima', 'Giant Steps'),
+    ('John Coltrane', 'Giant Steps', 'Giant Steps'),
+    ('Alice Coltrane', 'Journey in Satchidananda', 'Journey in Satchidananda'),
+    ('Thelonious Monk', 'Round Midnight', 'Genius of Modern Music'),
+    ('Bill Evans', 'Peace Piece', 'Everybody Digs Bill Evans'),
+]
+
+
+class TestTextSearch(unittest.TestCase):
+    def setUp(self):
+        with Session() as session, session.begin():
+            stpl = models.SpinitronPlaylist(spinitron_id=1, timeslot=datetime(2024, 1, 1, 8), title='Show')
+            stpl.episode = models.Episode(number=7)
+            session.add(stpl)
+            session.flush()
+            # bulk inserts are indexed too
+            session.execute(insert(models.Spin), [
+                {'spinitron_id': i, 'artist': artist, 'title': title, 'album': album, 'year': 1960,
+                 'start_time': time(8, i), 'number': i, 'playlist_id': stpl.id}
+                for i, (artist, title, album) in enumerate(SPINS)])
+            session.add_all([
+                models.Song(artist='Thelonious Monk', title="'Round Midnight", album='', year=0),
+                models.Song(artist='Thelonious Monk', title='Round Midnight', album='', year=0),
+                models.Song(artist='Bill Evans', title='Peace Piece', album='', year=0),
+            ])
+
+    def tearDown(self):
+        with Session() as session, session.begin():
+            for model in [models.Spin, models.SpinitronPlaylist, models.Episode, models.Song]:
+                session.execute(delete(model))
+
+    def titles(self, results):
+        return sorted(r['title'] for r in results)
+
+    def test_spins(self):
+        results = textsearch.searchSpins('coltrane')
+        self.assertEqual(self.titles(results), ['Giant Steps', 'Journey in Satchidananda', 'Naima'])
+        self.assertEqual((results[0]['episode'], results[0]['timeslot']), (7, datetime(2024, 1, 1, 8)))
+        self.assertEqual(self.titles(textsearch.searchSpins('john coltr')), ['Giant Steps', 'Naima'])
+        self.assertEqual(self.titles(textsearch.searchSpins('giant', field='title')), ['Giant Steps'])
+        self.assertEqual(textsearch.searchSpins('!!'), [])
+        with self.assertRaises(ValueError):
+            textsearch.searchSpins('monk', field='label')
+
+    def test_ranking(self):
+        # a title match weighs more than an album match
+        results = textsearch.searchSpins('giant steps')
+        self.assertEqual(results[0]['title'], 'Giant Steps')
+
+    def test_writes(self):
+        with Session() as session, session.begin():
+            session.execute(update(models.Spin).where(models.Spin.title == 'Naima').values(title='Equinox'))
+            session.execute(delete(models.Spin).where(models.Spin.artist == 'Bill Evans'))
+        self.assertEqual(self.titles(textsearch.searchSpins('equinox')), ['Equinox'])
+        self.assertEqual(textsearch.searchSpins('naima'), [])
+        self.assertEqual(textsearch.searchSpins('evans'), [])
+
+    def test_similar_songs(self):
+        monk = textsearch.searchSongs("'Round Midnight", field='title')
+        self.assertEqual(len(monk), 2)
+        similar = textsearch.similarSongs(monk[0]['id'])
+        self.assertEqual(similar[0]['id'], monk[1]['id'])
+        self.assertNotIn(monk[0]['id'], [r['id'] for r in similar])
+
+    def test_fallback(self):
+        with mock.patch.object(textsearch, 'hasIndex', return_value=False):
+            self.assertEqual(self.titles(textsearch.searchSpins('coltrane')),
+                             ['Giant Steps', 'Journey in Satchidananda', 'Naima'])
+            self.assertEqual(self.titles(textsearch.searchSpins('giant', field='title')), ['Giant Steps'])
+            self.assertEqual(len(textsearch.searchSongs('round midnight')), 2)
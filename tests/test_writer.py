@@ -0,0 +1,76 @@
+import threading
+import unittest
+
+from sqlalchemy import delete, func, select, text
+
+from . import context as ctx
+Session = ctx.mondojazz.Session
+Song = ctx.mondojazz.models.Song
+Writer = ctx.mondojazz.writer.Writer
+
+
+def songs(start, count):
+    return [{'title': f'Song {i}', 'artist': 'Artist', 'album': '', 'year': 0}
+            for i in range(start, start + count)]
+
+
+class TestWriter(unittest.TestCase):
+    def block(self):
+        """Keep the writer busy until the returned event is set."""
+        started, release = threading.Event(), threading.Event()
+        self.writer.submit(lambda session: started.set() or release.wait())
+        started.wait()
+        return release
+
+    def setUp(self):
+        self.commits = []
+        self.writer = Writer(batch_size=16, on_commit=self.commits.append).start()
+
+    def tearDown(self):
+        self.writer.close()
+        with Session() as session, session.begin():
+            session.execute(delete(Song))
+
+    def count(self):
+        with Session() as session:
+            return session.scalar(select(func.count()).select_from(Song))
+
+    def test_grouped(self):
+        release = self.block()
+        futures = [self.writer.insert(Song, songs(i, 1)) for i in range(20)]
+        release.set()
+        self.assertEqual([f.result() for f in futures], [(1, 0)] * 20)
+        # the 20 jobs queued behind the blocking one need only two transactions
+        self.assertEqual([len(results) for results in self.commits], [1, 16, 4])
+        self.assertEqual(self.count(), 20)
+
+    def test_failed_job(self):
+        release = self.block()
+        ok = self.writer.insert(Song, songs(0, 2))
+        failed = self.writer.submit(lambda session: session.execute(text('INSERT INTO nosuchtable VALUES (1)')))
+        ok2 = self.writer.insert(Song, songs(2, 2))
+        release.set()
+        self.assertEqual(ok.result(), (2, 0))
+        self.assertEqual(ok2.result(), (2, 0))
+        self.assertIsNotNone(failed.exception())
+        self.assertEqual(self.count(), 4)
+
+    def test_concurrent_submitters(self):
+        def work(n):
+            for i in range(20):
+                self.writer.insert(Song, songs(n * 100 + i * 5, 5))
+        threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        self.writer.flush()
+        self.assertEqual(self.count(), 8 * 100)
+
+
+class TestEngine(unittest.TestCase):
+    def test_pragmas(self):
+        with Session() as session:
+            self.assertEqual(session.scalar(text('PRAGMA journal_mode')), 'wal')
+            self.assertEqual(session.scalar(text('PRAGMA synchronous')), 1)
+            self.assertGreater(session.scalar(text('PRAGMA busy_timeout')), 0)